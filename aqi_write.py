@@ -3,18 +3,28 @@ import io
 import time
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from config import RedisConnection
+import healper
+from metrics import timed
 
-AMIBROKER_ASCII_DIR = r"C:\Program Files\AmiBroker\ASCII"
+load_dotenv()
+AMIBROKER_ASCII_DIR = os.getenv("AMIBROKER_ASCII_DIR", r"C:\Program Files\AmiBroker\ASCII")
 AMIBROKER_TRIGGER = os.path.join(AMIBROKER_ASCII_DIR, "~refresh.now")
+AQI_POLL_SECONDS = float(os.getenv("AQI_POLL_SECONDS", "1"))
+# New keys are picked up by a SCAN this often; known keys are checked every poll
+AQI_RESCAN_SECONDS = float(os.getenv("AQI_RESCAN_SECONDS", "30"))
+AQI_KEYS = ('spreads', 'historical')
+# Changed keys are exported in parallel; Redis reads and Arrow formatting release the GIL
+AQI_WORKERS = int(os.getenv("AQI_WORKERS", "4"))
 
 def read_feather_from_redis(redis_conn, symbol, key):
     try:
-        feather_bytes = redis_conn.get(f"{key}:{symbol}")
-        if feather_bytes is None:
-            return None
-        return pd.read_feather(io.BytesIO(feather_bytes))
+        return healper.read_feather_from_redis(redis_conn, symbol, key)
     except:
         return None
 
@@ -22,117 +32,239 @@ def get_ascii_filepath(symbol):
     clean_symbol = "_".join([p.split(":")[-1] for p in symbol.split("_")])
     return os.path.join(AMIBROKER_ASCII_DIR, f"{clean_symbol}.aqi")
 
+def _clean_frame(symbol, df):
+    """Sorted, NaN-free OHLC frame and its date column, or an error string."""
+    if df is None or df.empty:
+        return f"{symbol}: No data", None
+
+    # Handle both 'datetime' and 'date' columns
+    datetime_col = None
+    if 'datetime' in df.columns:
+        datetime_col = 'datetime'
+    elif 'date' in df.columns:
+        datetime_col = 'date'
+    else:
+        return f"{symbol}: Missing datetime/date column", None
+
+    required_cols = ['open', 'high', 'low', 'close']
+    if not all(col in df.columns for col in required_cols):
+        return f"{symbol}: Missing columns", None
+
+    df = df.sort_values(datetime_col).dropna(subset=[datetime_col] + required_cols).reset_index(drop=True)
+
+    if len(df) == 0:
+        return f"{symbol}: No valid data", None
+    return df, datetime_col
+
+def _join(*parts, sep):
+    return pc.binary_join_element_wise(*parts, pa.scalar(sep, pa.large_string()))
+
+def _fixed6(values):
+    # Same text as f"{x:.6f}": sign, integer part and zero-padded micro units
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    whole = np.floor(magnitude)
+    # Subtracting the integer part first is exact, so only the last step rounds
+    scaled = (magnitude - whole) * 1e6
+    micros = np.rint(scaled)
+    # That multiply can land a value just off a 7th-decimal tie on either side of it;
+    # the few rows that close to .5 are formatted by Python, which rounds the exact value
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        w, f = f"{magnitude[i]:.6f}".split('.')
+        whole[i], micros[i] = int(w), int(f)
+    carry = micros >= 1e6
+    whole, micros = (whole + carry).astype(np.int64), np.where(carry, 0, micros).astype(np.int64)
+    whole = pc.cast(pa.array(whole), pa.large_string())
+    frac = pc.utf8_lpad(pc.cast(pa.array(micros), pa.large_string()), 6, '0')
+    sign = pa.array(np.where(np.signbit(values), '-', ''), type=pa.large_string())
+    return _join(_join(sign, whole, sep=''), frac, sep='.')
+
+def _padded(ints, width):
+    return pc.utf8_lpad(pc.cast(pa.array(np.asarray(ints, dtype=np.int64)), pa.large_string()), width, '0')
+
+def format_aqi(df, datetime_col):
+    """
+    Serialize a clean OHLC frame to AQI text in bulk.
+
+    Dates are split with integer arithmetic and every column is formatted
+    by Arrow compute kernels, so no Python code runs per row. Returns the
+    encoded lines and the byte offset where the last line starts.
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(df[datetime_col]))
+    if dates.tz is not None:
+        # Local wall-clock time, as the bars are labelled on the exchange
+        dates = dates.tz_localize(None)
+    ymd = _padded((dates.year % 100) * 10000 + dates.month * 100 + dates.day, 6)
+    hm = _padded(dates.hour * 100 + dates.minute, 4)
+    beta_val = df['volume'].fillna(0).values if 'volume' in df.columns else np.zeros(len(df))
+
+    lines = _join(
+        ymd, hm,
+        _fixed6(df['open'].values), _fixed6(df['high'].values),
+        _fixed6(df['low'].values), _fixed6(df['close'].values),
+        _fixed6(beta_val), pa.scalar("0", pa.large_string()),
+        pa.scalar("0.000000", pa.large_string()), pa.scalar("0\n", pa.large_string()),
+        sep=',',
+    )
+    # The string values buffer already holds the lines back to back
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int64)[lines.offset:lines.offset + len(lines) + 1]
+    data = memoryview(lines.buffers()[2])[offsets[0]:offsets[-1]]
+    return data, int(offsets[-2] - offsets[0])
+
+def write_aqi(aqi_file, data, last_start, offset=None):
+    """
+    Write serialized lines to aqi_file and return the byte offset where the last line starts.
+
+    With offset=None the file is replaced atomically; otherwise it is truncated
+    at offset and the lines are appended there.
+    """
+    if offset is None:
+        temp_file = aqi_file + ".tmp"
+        with open(temp_file, 'wb', buffering=1048576) as f:
+            f.write(data)
+        os.replace(temp_file, aqi_file)
+        return last_start
+    with open(aqi_file, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+    return offset + last_start
+
 def write_symbol_to_aqi(symbol, key, redis_conn):
     try:
-        df = read_feather_from_redis(redis_conn, symbol, key)
-        
-        if df is None or df.empty:
-            return f"{symbol}: No data"
-        
-        # Handle both 'datetime' and 'date' columns
-        datetime_col = None
-        if 'datetime' in df.columns:
-            datetime_col = 'datetime'
-        elif 'date' in df.columns:
-            datetime_col = 'date'
-        else:
-            return f"{symbol}: Missing datetime/date column"
-        
-        required_cols = ['open', 'high', 'low', 'close']
-        if not all(col in df.columns for col in required_cols):
-            return f"{symbol}: Missing columns"
-        
-        df = df.sort_values(datetime_col).dropna(subset=[datetime_col] + required_cols).reset_index(drop=True)
-        
-        if len(df) == 0:
-            return f"{symbol}: No valid data"
-        
-        # Convert to numpy arrays
-        dates = df[datetime_col].astype(str).values
-        spreadO = df['open'].values.astype(float)
-        spreadH = df['high'].values.astype(float)
-        spreadL = df['low'].values.astype(float)
-        spreadC = df['close'].values.astype(float)
-        beta_val = df['volume'].fillna(0).values.astype(float) if 'volume' in df.columns else np.zeros(len(df))
-        sqrt_Q = np.zeros(len(df))
-        
-        # Vectorized date extraction
-        extract_yr = np.vectorize(lambda s: int(s[2:4]))
-        extract_m = np.vectorize(lambda s: int(s[5:7]))
-        extract_d = np.vectorize(lambda s: int(s[8:10]))
-        extract_hr = np.vectorize(lambda s: int(s[11:13]))
-        extract_mn = np.vectorize(lambda s: int(s[14:16]))
-        
-        yr, m, d, hr, mn = extract_yr(dates), extract_m(dates), extract_d(dates), extract_hr(dates), extract_mn(dates)
-        
-        # Format date and time
-        format_ymd = np.vectorize(lambda y, mo, da: f"{y:02d}{mo:02d}{da:02d}")
-        format_hm = np.vectorize(lambda h, mi: f"{h:02d}{mi:02d}")
-        ymd, hm = format_ymd(yr, m, d), format_hm(hr, mn)
-        
-        # Format floats
-        format_float = np.vectorize(lambda x: f"{x:.6f}")
-        o_str = format_float(spreadO)
-        h_str = format_float(spreadH)
-        l_str = format_float(spreadL)
-        c_str = format_float(spreadC)
-        b_str = format_float(beta_val)
-        q_str = format_float(sqrt_Q)
-        
-        # Build AQI lines
-        lines = np.char.add(np.char.add(np.char.add(ymd, ','), hm), ',')
-        lines = np.char.add(np.char.add(np.char.add(lines, o_str), ','), h_str)
-        lines = np.char.add(np.char.add(np.char.add(lines, ','), l_str), ',')
-        lines = np.char.add(np.char.add(np.char.add(lines, c_str), ','), b_str)
-        lines = np.char.add(np.char.add(np.char.add(lines, ',0,'), q_str), ',0\n')
-        
+        df, datetime_col = _clean_frame(symbol, read_feather_from_redis(redis_conn, symbol, key))
+        if datetime_col is None:
+            return df
+
         # Write to file
-        aqi_file = get_ascii_filepath(symbol)
-        temp_file = aqi_file + ".tmp"
-        
-        with open(temp_file, 'w', buffering=1048576) as f:
-            f.writelines(lines)
-        
-        os.replace(temp_file, aqi_file)
+        write_aqi(get_ascii_filepath(symbol), *format_aqi(df, datetime_col))
         return f"{symbol}: Wrote {len(df)} lines"
     
     except Exception as e:
         return f"{symbol}: Error - {e}"
 
-def get_all_symbols_from_redis(redis_conn):
+class AqiExporter:
+    """
+    Keeps the .aqi files in step with Redis without re-reading unchanged keys.
+
+    Each poll fetches only the meta version/revision counters of every known
+    key in one pipeline. A changed version means new bars: the rows from the
+    last exported bar onward are range-read and written over the file's last
+    line. A changed revision means earlier history was replaced, which is
+    the only case that rewrites the whole file.
+    """
+
+    def __init__(self, redis_conn, keys=AQI_KEYS, workers=AQI_WORKERS):
+        self.redis = redis_conn
+        self.keys = keys
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.tracked = []
+        # (symbol, key) -> {'version', 'revision', 'last_ts', 'offset'}
+        self.state = {}
+        self.last_scan = None
+
+    def scan(self):
+        found = set(get_all_symbols_from_redis(self.redis, self.keys))
+        healper.ensure_meta(self.redis, found - set(self.tracked))
+        self.tracked = sorted(found)
+        self.last_scan = time.monotonic()
+
+    def full_write(self, symbol, key, version, revision):
+        df, datetime_col = _clean_frame(symbol, read_feather_from_redis(self.redis, symbol, key))
+        if datetime_col is None:
+            self.state.pop((symbol, key), None)
+            return df
+        offset = write_aqi(get_ascii_filepath(symbol), *format_aqi(df, datetime_col))
+        self.state[(symbol, key)] = {'version': version, 'revision': revision,
+                                     'last_ts': df[datetime_col].iloc[-1], 'offset': offset}
+        return f"{symbol}: Wrote {len(df)} lines"
+
+    def append(self, symbol, key, version):
+        state = self.state[(symbol, key)]
+        df = healper.read_range_from_redis(self.redis, symbol, key, start=state['last_ts'])
+        df, datetime_col = _clean_frame(symbol, df)
+        state['version'] = version
+        if datetime_col is None:
+            return None
+        state['offset'] = write_aqi(get_ascii_filepath(symbol), *format_aqi(df, datetime_col), state['offset'])
+        state['last_ts'] = df[datetime_col].iloc[-1]
+        return f"{symbol}: Appended {len(df)} lines"
+
+    def export(self, symbol, key, version, revision):
+        state = self.state.get((symbol, key))
+        try:
+            with timed("aqi_export"):
+                if (state is None or state['revision'] != revision
+                        or not os.path.exists(get_ascii_filepath(symbol))):
+                    return self.full_write(symbol, key, version, revision)
+                return self.append(symbol, key, version)
+        except Exception as e:
+            self.state.pop((symbol, key), None)
+            return f"{symbol}: Error - {e}"
+
+    def sync_once(self):
+        """Export every changed key; returns how many files were written."""
+        if self.last_scan is None or time.monotonic() - self.last_scan >= AQI_RESCAN_SECONDS:
+            self.scan()
+        with self.redis.pipeline(transaction=False) as pipe:
+            for symbol, key in self.tracked:
+                pipe.hmget(healper.meta_key(key, symbol), 'version', 'revision')
+            counters = pipe.execute()
+
+        jobs = []
+        for (symbol, key), (version, revision) in zip(self.tracked, counters):
+            version, revision = int(version or 0), int(revision or 0)
+            state = self.state.get((symbol, key))
+            if state is None or state['version'] != version:
+                jobs.append((symbol, key, version, revision))
+        if len(jobs) > 1 and self.workers > 1:
+            results = list(self.pool.map(lambda job: self.export(*job), jobs))
+        else:
+            results = [self.export(*job) for job in jobs]
+
+        written = 0
+        for result in results:
+            if result is None:
+                continue
+            if "Error" in result or "No data" in result:
+                print(result)
+            else:
+                written += 1
+        return written
+
+def export_symbols(symbols_data, redis_conn, workers=AQI_WORKERS):
+    """Full export of many (symbol, key) pairs on a thread pool; returns the status lines."""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return list(pool.map(lambda item: write_symbol_to_aqi(item[0], item[1], redis_conn), symbols_data))
+
+def get_all_symbols_from_redis(redis_conn, keys=AQI_KEYS):
     result = []
-    for key in ['spreads', 'historical']:
-        cursor = 0
-        while True:
-            cursor, keys_batch = redis_conn.scan(cursor, match=f"{key}:*", count=1000)
-            for full_key in keys_batch:
-                symbol = full_key.decode('utf-8').split(':', 1)[1] if isinstance(full_key, bytes) else full_key.split(':', 1)[1]
-                result.append((symbol, key))
-            if cursor == 0:
-                break
-    return result 
+    for key in keys:
+        # Appended data only has a tail and a sidecar until it is compacted
+        for pattern in (f"{key}:*", healper.meta_key(key, "*")):
+            prefix = pattern[:-1]
+            for full_key in redis_conn.scan_iter(match=pattern, count=1000):
+                full_key = full_key.decode('utf-8') if isinstance(full_key, bytes) else full_key
+                result.append((full_key[len(prefix):], key))
+    return list(dict.fromkeys(result))
 
 def aqi_write():
     Path(AMIBROKER_ASCII_DIR).mkdir(parents=True, exist_ok=True)
     redis_conn = RedisConnection.get_instance()
+    exporter = AqiExporter(redis_conn)
     
     print("AQI Writer started. Press Ctrl+C to stop.")
 
     try:
         while True:
-            symbols_data = get_all_symbols_from_redis(redis_conn)
-            
-            if symbols_data:                
-                for symbol, key in symbols_data:
-                    result = write_symbol_to_aqi(symbol, key, redis_conn)
-                    if "Error" in result or "No data" in result:
-                        print(result)
+            if exporter.sync_once():
                 with open(AMIBROKER_TRIGGER, 'w') as f:
                     f.write(str(pd.Timestamp.now()))
-            time.sleep(1)
+            time.sleep(AQI_POLL_SECONDS)
     
     except KeyboardInterrupt:
         print("AQI Writer stopped")
 
 if __name__ == "__main__":
-    aqi_write()
\ No newline at end of file
+    aqi_write()
@@ -0,0 +1,72 @@
+"""
+Rows/s of the AQI serializer on a synthetic OHLCV frame, old vs new.
+
+    python -m benchmarks.aqi_serializer [rows]
+"""
+import sys
+import time
+import numpy as np
+from aqi_write import format_aqi
+from benchmarks.synthetic import ohlcv_frame
+
+
+def legacy_aqi_lines(df, datetime_col):
+    # write_symbol_to_aqi before the bulk serializer, kept as the baseline
+    dates = df[datetime_col].astype(str).values
+    fmt = np.vectorize(lambda x: f"{x:.6f}")
+    yr = np.vectorize(lambda s: int(s[2:4]))(dates)
+    m = np.vectorize(lambda s: int(s[5:7]))(dates)
+    d = np.vectorize(lambda s: int(s[8:10]))(dates)
+    hr = np.vectorize(lambda s: int(s[11:13]))(dates)
+    mn = np.vectorize(lambda s: int(s[14:16]))(dates)
+    ymd = np.vectorize(lambda y, mo, da: f"{y:02d}{mo:02d}{da:02d}")(yr, m, d)
+    hm = np.vectorize(lambda h, mi: f"{h:02d}{mi:02d}")(hr, mn)
+    o, h, l, c = (fmt(df[col].values.astype(float)) for col in ('open', 'high', 'low', 'close'))
+    b, q = fmt(df['volume'].values.astype(float)), fmt(np.zeros(len(df)))
+    lines = np.char.add(np.char.add(np.char.add(ymd, ','), hm), ',')
+    lines = np.char.add(np.char.add(np.char.add(lines, o), ','), h)
+    lines = np.char.add(np.char.add(np.char.add(lines, ','), l), ',')
+    lines = np.char.add(np.char.add(np.char.add(lines, c), ','), b)
+    lines = np.char.add(np.char.add(np.char.add(lines, ',0,'), q), ',0\n')
+    return "".join(lines).encode()
+
+
+def _differing_lines(old, new):
+    old_lines, new_lines = old.splitlines(), bytes(new).splitlines()
+    return sum(a != b for a, b in zip(old_lines, new_lines)) + abs(len(old_lines) - len(new_lines))
+
+
+def binance_frame(rows, seed=0):
+    # Crypto bars: 8-decimal prices and fractional volume, which hit 7th-decimal ties
+    rng = np.random.default_rng(seed)
+    df = ohlcv_frame(rows, seed)
+    scale = 10.0 ** rng.uniform(-5, 0, rows)
+    for col in ('open', 'high', 'low', 'close'):
+        df[col] = np.round(df[col] * scale, 8)
+    df['volume'] = np.round(rng.uniform(0, 1e4, rows), 8)
+    return df
+
+
+def run(rows=1_000_000):
+    df = ohlcv_frame(rows)
+    t1 = time.perf_counter()
+    old = legacy_aqi_lines(df, 'date')
+    t2 = time.perf_counter()
+    new, _ = format_aqi(df, 'date')
+    t3 = time.perf_counter()
+    crypto = binance_frame(rows)
+    result = {
+        'rows': rows,
+        'legacy_rows_per_s': rows / (t2 - t1),
+        'bulk_rows_per_s': rows / (t3 - t2),
+        'speedup': (t2 - t1) / (t3 - t2),
+        'differing_lines': _differing_lines(old, new),
+        'differing_lines_8dp': _differing_lines(legacy_aqi_lines(crypto, 'date'), format_aqi(crypto, 'date')[0]),
+    }
+    for name, value in result.items():
+        print(f"{name:>18}: {value:,.0f}" if name != 'speedup' else f"{name:>18}: {value:.1f}x")
+    return result
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
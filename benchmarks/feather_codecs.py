@@ -0,0 +1,45 @@
+"""
+Size, encode and decode cost of each feather codec on 5m OHLCV and spread frames.
+
+    python -m benchmarks.feather_codecs [rows]
+"""
+import io
+import sys
+import time
+import pandas as pd
+from healper import _encode_base
+from benchmarks.synthetic import ohlcv_frame, spread_frame
+
+CODECS = ["uncompressed", "lz4", "zstd:1", "zstd:3", "zstd:9"]
+
+
+def measure(df, codec, repeat=3):
+    encode, decode = [], []
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        blob, _ = _encode_base(df, codec)
+        t2 = time.perf_counter()
+        pd.read_feather(io.BytesIO(blob))
+        t3 = time.perf_counter()
+        encode.append(t2 - t1)
+        decode.append(t3 - t2)
+    return {'bytes': len(blob), 'encode_ms': min(encode) * 1000, 'decode_ms': min(decode) * 1000}
+
+
+def run(rows=100_000):
+    results = []
+    for family, df in (("historical", ohlcv_frame(rows)), ("spreads", spread_frame(rows))):
+        raw = None
+        print(f"\n{family}: {rows:,} rows")
+        print(f"{'codec':>14} {'KiB':>9} {'ratio':>6} {'encode ms':>10} {'decode ms':>10}")
+        for codec in CODECS:
+            r = measure(df, codec)
+            raw = raw or r['bytes']
+            r.update(family=family, codec=codec, ratio=raw / r['bytes'])
+            results.append(r)
+            print(f"{codec:>14} {r['bytes'] / 1024:>9,.0f} {r['ratio']:>6.2f} {r['encode_ms']:>10.1f} {r['decode_ms']:>10.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
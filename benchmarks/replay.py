@@ -0,0 +1,238 @@
+"""
+Replay ticks through the live pipeline on a simulated clock.
+
+Ticks go through main.on_tick into the real CandleAggregator, stamped with
+their exchange time. Whenever the watermark closes bars, they are written
+and announced by main.write_closed_bars, calculate_historical runs as
+live_loop would on the announcement, and main.rollup_closed_bars follows,
+the same calls run_ws makes. In between, prices
+are coalesced by an LTPWriter and the batched live spread tick runs every
+--flush-ms of simulated time.
+
+--speed 1 or 10 paces the replay against the wall clock; --speed max runs
+as fast as the pipeline allows. Ticks come from --ticks-file (feather/CSV
+with ts, symbol, last_price, last_traded_quantity) or are synthetic.
+
+    python -m benchmarks.replay --speed max --minutes 30
+"""
+import sys
+import json
+import time
+import argparse
+from contextlib import contextmanager
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from benchmarks import synthetic
+from benchmarks.suite import connect
+
+
+class SimClock:
+    """Simulated epoch seconds; with a speed set, advancing waits for the wall clock to catch up."""
+
+    def __init__(self, start, speed=None):
+        self.t = start
+        self.start = start
+        self.speed = speed
+        self.wall_start = time.perf_counter()
+
+    def now(self):
+        return self.t
+
+    def advance(self, ts):
+        if self.speed:
+            wait = self.wall_start + (ts - self.start) / self.speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        self.t = max(self.t, ts)
+
+
+class StageTimes:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.items = defaultdict(int)
+
+    def add(self, stage, seconds, items=1):
+        self.samples[stage].append(seconds)
+        self.items[stage] += items
+
+    @contextmanager
+    def time(self, stage, items=1):
+        t1 = time.perf_counter()
+        yield
+        self.add(stage, time.perf_counter() - t1, items)
+
+    def report(self):
+        out = {}
+        for stage, samples in self.samples.items():
+            ms = np.array(samples) * 1000
+            busy = ms.sum() / 1000
+            out[stage] = {
+                'count': len(ms),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p90_ms': float(np.percentile(ms, 90)),
+                'p99_ms': float(np.percentile(ms, 99)),
+                'max_ms': float(ms.max()),
+                # Items handled per second of time spent inside the stage
+                'items_per_busy_s': self.items[stage] / busy if busy else None,
+            }
+        return out
+
+
+def load_ticks(path):
+    df = pd.read_feather(path) if path.endswith(".feather") else pd.read_csv(path)
+    ts = df['ts']
+    if not np.issubdtype(ts.dtype, np.number):
+        ts = pd.to_datetime(ts).astype('int64') / 1e9
+    qty = df['last_traded_quantity'] if 'last_traded_quantity' in df.columns else np.zeros(len(df))
+    order = np.argsort(ts.to_numpy(), kind='stable')
+    return [(df['symbol'].iat[i], {'last_price': float(df['last_price'].iat[i]),
+                                   'last_traded_quantity': float(qty[i])}, float(ts.iat[i]))
+            for i in order]
+
+
+def seed_history(redis_conn, symbols, bars, interval_minutes, end_ts):
+    """Write `bars` synthetic candles per symbol ending at end_ts; returns the last closes."""
+    from healper import write_feather_to_redis, compact_feather_in_redis
+    start = pd.Timestamp(end_ts, unit='s', tz=synthetic.TZ) - pd.Timedelta(minutes=interval_minutes * bars)
+    frames = synthetic.symbol_frames(symbols, bars, start=start, freq=f"{interval_minutes}min")
+    for sym, df in frames.items():
+        write_feather_to_redis(redis_conn, sym, df, key="historical", live=False, spreads=True)
+        compact_feather_in_redis(redis_conn, sym, "historical", force=True)
+    return {sym: df['close'].iat[-1] for sym, df in frames.items()}
+
+
+def replay(redis_conn, ticks, symbols, pairs, speed=None, flush_ms=50, recompute=True):
+    # Imported late: these modules bind the shared Redis connection at import
+    import main
+    from data.ltp_writer import LTPWriter
+    from spreads.live import LiveSpreadBatch
+    from spreads.spreads import calculate_historical
+
+    aggregator = main.aggregator
+    clock = SimClock(ticks[0][2], speed)
+    aggregator.clock = clock.now
+    writer = LTPWriter(redis_conn, flush_ms=flush_ms)
+    live = LiveSpreadBatch(redis_conn, pairs)
+    live.load()
+    stages = StageTimes()
+
+    next_flush = ticks[0][2] + flush_ms / 1000
+    pending_since = None
+    wall_start = time.perf_counter()
+
+    def close_bar():
+        t_close = time.perf_counter()
+        with stages.time('candle_write', len(symbols)):
+            written = main.write_closed_bars(symbols)
+        if recompute:
+            with stages.time('spread_recompute', len(pairs)):
+                calculate_historical(loop=False)
+        stages.add('bar_close_to_spreads', time.perf_counter() - t_close)
+        # run_ws rolls up after announcing the bars; here after the recompute it would trigger
+        with stages.time('rollup', len(written)):
+            main.rollup_closed_bars(written)
+
+    for sym, tick, ts in ticks:
+        clock.advance(ts)
+        tick = dict(tick, exchange_timestamp=ts)
+        t1 = time.perf_counter()
+        main.on_tick(sym, tick)
+        writer.update(sym, tick['last_price'])
+        stages.add('on_tick', time.perf_counter() - t1)
+        if aggregator.pending and aggregator.wait_closed(timeout=0):
+            close_bar()
+        if pending_since is None:
+            pending_since = t1
+        if ts >= next_flush:
+            with stages.time('ltp_flush'):
+                writer.flush()
+            with stages.time('live_spread', len(pairs)):
+                live.tick()
+            # Oldest price in the batch until every pair's spread reflects it
+            stages.add('tick_to_live_spread', time.perf_counter() - pending_since)
+            pending_since = None
+            next_flush = ts + flush_ms / 1000
+    # End of input: let the watermark pass the last forming bar
+    end = aggregator.bucket(ticks[-1][2]) + aggregator.interval_seconds
+    clock.advance(end)
+    aggregator.advance(end)
+    if aggregator.wait_closed(timeout=0):
+        close_bar()
+
+    wall = time.perf_counter() - wall_start
+    simulated = ticks[-1][2] - ticks[0][2]
+    return {
+        'ticks': len(ticks),
+        'symbols': len(symbols),
+        'pairs': len(pairs),
+        'simulated_s': simulated,
+        'wall_s': wall,
+        'speedup': simulated / wall if wall else None,
+        'ticks_per_s': len(ticks) / wall if wall else None,
+        'stages': stages.report(),
+    }
+
+
+def print_report(result):
+    print(f"\n{result['ticks']:,} ticks, {result['symbols']} symbols, {result['pairs']} pairs: "
+          f"{result['simulated_s']:.0f}s simulated in {result['wall_s']:.1f}s "
+          f"({result['speedup']:.1f}x, {result['ticks_per_s']:,.0f} ticks/s)")
+    print(f"{'stage':>22} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'items/busy s':>14}")
+    for stage, r in result['stages'].items():
+        rate = f"{r['items_per_busy_s']:,.0f}" if r['items_per_busy_s'] else "-"
+        print(f"{stage:>22} {r['count']:>7} {r['p50_ms']:>9.3f} {r['p90_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['max_ms']:>9.3f} {rate:>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--speed", default="max", help="1, 10, ... or max")
+    parser.add_argument("--minutes", type=float, default=30, help="simulated minutes of synthetic ticks")
+    parser.add_argument("--tick-interval", type=float, default=0.01, help="seconds between synthetic ticks")
+    parser.add_argument("--ticks-file", help="recorded ticks instead of synthetic ones")
+    parser.add_argument("--flush-ms", type=float, default=50)
+    parser.add_argument("--seed-bars", type=int, help="history per symbol; default LOOKBACK_DAYS + 100")
+    parser.add_argument("--no-recompute", action="store_true", help="skip calculate_historical at bar close")
+    parser.add_argument("--redis", help="Redis URL; default BENCH_REDIS_URL or an in-process fake")
+    parser.add_argument("--out", help="write the report as JSON here")
+    args = parser.parse_args(argv)
+
+    redis_conn = connect(args.redis)
+    import main as pipeline
+    from spreads.spreads import load_pairs, LOOKBACK_DAYS, calculate_historical
+    symbols = list(pipeline.symbols)
+    pairs = load_pairs()['pair'].tolist()
+    interval = pipeline.aggregator.interval
+
+    if args.ticks_file:
+        ticks = load_ticks(args.ticks_file)
+        symbols = sorted({t[0] for t in ticks})
+        pairs = [p for p in pairs if all(s in symbols for s in p.split('_', 1))]
+        start_ts = ticks[0][2]
+    else:
+        start_ts = pd.Timestamp(synthetic.START, tz=synthetic.TZ).timestamp()
+
+    seed_bars = args.seed_bars if args.seed_bars is not None else LOOKBACK_DAYS + 100
+    start_bar = pipeline.aggregator.bucket(start_ts)
+    print(f"Seeding {seed_bars} bars for {len(symbols)} symbols...")
+    closes = seed_history(redis_conn, symbols, seed_bars, interval, start_bar)
+    if not args.no_recompute:
+        calculate_historical(loop=False)
+
+    if not args.ticks_file:
+        count = int(args.minutes * 60 / args.tick_interval)
+        ticks = synthetic.ticks(symbols, count, start_ts=start_ts, interval=args.tick_interval, prices=closes)
+
+    speed = None if args.speed == "max" else float(args.speed)
+    result = replay(redis_conn, ticks, symbols, pairs, speed, args.flush_ms, not args.no_recompute)
+    result['speed'] = args.speed
+    print_report(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Offline benchmarks of the hot paths, fed by benchmarks.synthetic.
+
+Runs against BENCH_REDIS_URL (or --redis) when given, otherwise an in-process
+fakeredis. Results are written as JSON to benchmarks/baselines/<label>.json;
+--compare <file> reports the change against an earlier run and exits 1 when
+any case slowed down by more than --threshold.
+
+    python -m benchmarks.suite --rows 20000 --symbols 20 --pairs 200
+    python -m benchmarks.suite --compare benchmarks/baselines/abc1234.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import config
+from benchmarks import synthetic
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+CASES = {}
+
+
+def case(name):
+    """Register a case: fn(ctx) does the setup and returns (run, items); run() is what gets timed."""
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def connect(url=None):
+    url = url or os.getenv("BENCH_REDIS_URL")
+    if url:
+        import redis
+        conn = redis.Redis.from_url(url)
+    else:
+        import fakeredis
+        conn = fakeredis.FakeRedis()
+    # Modules that talk to Redis through the shared instance use this one
+    config.RedisConnection._instance = conn
+    return conn
+
+
+class Context:
+    def __init__(self, redis_conn, rows, symbols, pairs, ticks, seed=0):
+        self.redis = redis_conn
+        self.rows = rows
+        self.symbols = synthetic.symbol_names(symbols)
+        self.pairs = synthetic.pairs_of(self.symbols, pairs)
+        self.ticks = ticks
+        self.seed = seed
+        self._frames = None
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            self._frames = synthetic.symbol_frames(self.symbols, self.rows, self.seed)
+        return self._frames
+
+    def pair_frames(self):
+        s1, s2 = self.symbols[:2]
+        return f"{s1}_{s2}", {s1: self.frames[s1], s2: self.frames[s2]}
+
+
+@case("feather_write")
+def bench_feather_write(ctx):
+    from healper import write_feather_to_redis
+    runs = iter(range(1_000_000))
+
+    def run():
+        # Fresh keys each time so every run appends to an empty history
+        n = next(runs)
+        for sym, df in ctx.frames.items():
+            write_feather_to_redis(ctx.redis, f"bw{n}_{sym}", df, key="historical", live=False, spreads=True)
+    return run, ctx.rows * len(ctx.symbols)
+
+
+def _stored_symbols(ctx, compact=True):
+    from healper import write_feather_to_redis, compact_feather_in_redis
+    for sym, df in ctx.frames.items():
+        if ctx.redis.exists(f"meta:historical:{sym}"):
+            continue
+        write_feather_to_redis(ctx.redis, sym, df, key="historical", live=False, spreads=True)
+        if compact:
+            compact_feather_in_redis(ctx.redis, sym, "historical", force=True)
+
+
+@case("feather_read")
+def bench_feather_read(ctx):
+    from healper import read_feather_from_redis
+    _stored_symbols(ctx)
+
+    def run():
+        for sym in ctx.symbols:
+            read_feather_from_redis(ctx.redis, sym, key="historical")
+    return run, ctx.rows * len(ctx.symbols)
+
+
+@case("feather_read_range")
+def bench_feather_read_range(ctx):
+    from healper import read_range_from_redis
+    _stored_symbols(ctx)
+    start = ctx.frames[ctx.symbols[0]]['date'].iloc[-500]
+
+    def run():
+        for sym in ctx.symbols:
+            read_range_from_redis(ctx.redis, sym, key="historical", start=start, lookback=100)
+    return run, 600 * len(ctx.symbols)
+
+
+@case("hedge_ratios")
+def bench_hedge_ratios(ctx):
+    from spreads.spreads_resepy import calculate_hedge_ratios
+    pair, frames = ctx.pair_frames()
+    return (lambda: calculate_hedge_ratios(frames, pair)), ctx.rows
+
+
+@case("historical_spreads")
+def bench_historical_spreads(ctx):
+    from spreads.cal import calculate_historical_spreads
+    pair, frames = ctx.pair_frames()
+    return (lambda: calculate_historical_spreads(frames, pair)), ctx.rows
+
+
+@case("aggregator_ticks")
+def bench_aggregator_ticks(ctx):
+    from data.aggregator import CandleAggregator
+    ticks = synthetic.ticks(ctx.symbols, ctx.ticks, ctx.seed)
+
+    def run():
+        aggregator = CandleAggregator(interval_minutes=5)
+        for sym, tick, _ in ticks:
+            aggregator.process_tick(sym, tick)
+    return run, len(ticks)
+
+
+@case("aggregator_get_candle")
+def bench_aggregator_get_candle(ctx):
+    from data.aggregator import CandleAggregator
+    aggregator = CandleAggregator(interval_minutes=5)
+
+    def run():
+        # Every symbol has one bar the watermark is about to pass, as at a bucket boundary
+        now = time.time()
+        start = aggregator.bucket(now) - 600
+        with aggregator.lock:
+            for i, sym in enumerate(ctx.symbols):
+                aggregator.bars[sym] = {start: [start, 100.0 + i, 101.0, 99.0, 100.5, 10.0, False]}
+        aggregator.advance(now)
+        for sym in ctx.symbols:
+            aggregator.get_candle(sym)
+    return run, len(ctx.symbols)
+
+
+@case("live_tick")
+def bench_live_tick(ctx):
+    from healper import append_feather_to_redis
+    from spreads.live import LiveSpreadBatch
+    for i, pair in enumerate(ctx.pairs):
+        if not ctx.redis.exists(f"meta:spreads:{pair}"):
+            append_feather_to_redis(ctx.redis, pair, synthetic.spread_frame(1, i, pair), key="spreads")
+    ctx.redis.mset({f"ltp:{sym}": 100.0 + i for i, sym in enumerate(ctx.symbols)})
+    batch = LiveSpreadBatch(ctx.redis, ctx.pairs)
+    batch.load()
+    return batch.tick, len(ctx.pairs)
+
+
+@case("aqi_write")
+def bench_aqi_write(ctx):
+    import aqi_write
+    _stored_symbols(ctx)
+    aqi_write.AMIBROKER_ASCII_DIR = tempfile.mkdtemp(prefix="bench_aqi_")
+
+    def run():
+        for sym in ctx.symbols:
+            aqi_write.write_symbol_to_aqi(sym, "historical", ctx.redis)
+    return run, ctx.rows * len(ctx.symbols)
+
+
+def measure(run, items, repeat):
+    run()  # warm-up
+    times = []
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t1)
+    times = np.array(times)
+    median = float(np.median(times))
+    return {
+        'items': items,
+        'repeat': repeat,
+        'min_s': float(times.min()),
+        'median_s': median,
+        'max_s': float(times.max()),
+        'items_per_s': items / median if median else None,
+    }
+
+
+def git_version():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_suite(redis_conn, rows, symbols, pairs, ticks, repeat=5, only=None):
+    ctx = Context(redis_conn, rows, symbols, pairs, ticks)
+    results = {}
+    for name, fn in CASES.items():
+        if only and name not in only:
+            continue
+        try:
+            run, items = fn(ctx)
+            results[name] = measure(run, items, repeat)
+        except Exception as e:
+            results[name] = {'error': str(e)}
+            print(f"❌ {name}: {e}")
+            continue
+        r = results[name]
+        print(f"{name:>24}: median {r['median_s'] * 1000:9.2f} ms  {r['items_per_s']:>14,.0f} items/s")
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Print the median change per case; returns the names that regressed."""
+    regressed = []
+    for name, r in current['results'].items():
+        old = baseline['results'].get(name)
+        if not old or 'median_s' not in old or 'median_s' not in r:
+            continue
+        change = r['median_s'] / old['median_s'] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  ⚠️ regression"
+            regressed.append(name)
+        print(f"{name:>24}: {old['median_s'] * 1000:9.2f} -> {r['median_s'] * 1000:9.2f} ms ({change:+.0%}){flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--symbols", type=int, default=20)
+    parser.add_argument("--pairs", type=int, default=190)
+    parser.add_argument("--ticks", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--redis", help="Redis URL; default BENCH_REDIS_URL or an in-process fake")
+    parser.add_argument("--only", nargs="*", choices=sorted(CASES), help="run just these cases")
+    parser.add_argument("--label", help="baseline name; default the git commit")
+    parser.add_argument("--out", help="where to write the JSON; default benchmarks/baselines/<label>.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    redis_conn = connect(args.redis)
+    params = {k: getattr(args, k) for k in ("rows", "symbols", "pairs", "ticks", "repeat")}
+    results = run_suite(redis_conn, only=args.only, **params)
+    label = args.label or git_version() or datetime.now().strftime("%Y%m%d-%H%M%S")
+    report = {
+        'meta': {
+            'label': label,
+            'git': git_version(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'backend': 'redis' if (args.redis or os.getenv("BENCH_REDIS_URL")) else 'fakeredis',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'params': params,
+        },
+        'results': results,
+    }
+    out = args.out or os.path.join(BASELINE_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✓ Results written to {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('params') != params:
+            print("⚠️ Baseline was run with different parameters, numbers are not comparable")
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Synthetic bars, spreads and ticks for the benchmarks, deterministic per seed."""
+import numpy as np
+import pandas as pd
+
+START = '2015-01-01 09:15'
+TZ = 'Asia/Kolkata'
+
+
+def symbol_names(count):
+    return [f"SYM{i:03d}" for i in range(count)]
+
+
+def price_paths(symbols, rows, seed=0, vol=0.002):
+    """Log-normal closes sharing one market factor, so pairs are correlated."""
+    rng = np.random.default_rng(seed)
+    market = np.cumsum(rng.normal(0, vol, rows))
+    paths = {}
+    for sym in symbols:
+        beta = rng.uniform(0.6, 1.4)
+        own = np.cumsum(rng.normal(0, vol / 2, rows))
+        paths[sym] = rng.uniform(100, 3000) * np.exp(beta * market + own)
+    return paths
+
+
+def ohlcv_frame(rows, seed=0, close=None, start=START, freq='5min', tick=0.05):
+    # NSE-like bars: prices on a 0.05 tick, integer volume
+    rng = np.random.default_rng(seed)
+    if close is None:
+        close = price_paths(['_'], rows, seed)['_']
+    close = np.round(close / tick) * tick
+    open_ = np.round((close * (1 + rng.normal(0, 5e-4, rows))) / tick) * tick
+    return pd.DataFrame({
+        'date': pd.date_range(start, periods=rows, freq=freq, tz=TZ),
+        'open': open_,
+        'high': np.maximum(open_, close) + np.round(rng.exponential(close * 5e-4) / tick) * tick,
+        'low': np.minimum(open_, close) - np.round(rng.exponential(close * 5e-4) / tick) * tick,
+        'close': close,
+        'volume': rng.integers(100, 500_000, rows),
+    })
+
+
+def symbol_frames(symbols, rows, seed=0, **kwargs):
+    paths = price_paths(symbols, rows, seed)
+    return {sym: ohlcv_frame(rows, seed + i + 1, close=paths[sym], **kwargs) for i, sym in enumerate(symbols)}
+
+
+def spread_frame(rows, seed=1, pair='SYM000_SYM001', start=START, freq='5min'):
+    # Log spreads and a slowly drifting hedge ratio, as calculate_historical writes them
+    rng = np.random.default_rng(seed)
+    close = np.cumsum(rng.normal(0, 1e-3, rows))
+    return pd.DataFrame({
+        'datetime': pd.date_range(start, periods=rows, freq=freq, tz=TZ),
+        'symbol': pair,
+        'open': close + rng.normal(0, 2e-4, rows),
+        'high': close + np.abs(rng.normal(0, 5e-4, rows)),
+        'low': close - np.abs(rng.normal(0, 5e-4, rows)),
+        'close': close,
+        'Volume': 0.9 + np.cumsum(rng.normal(0, 1e-4, rows)),
+    })
+
+
+def pairs_of(symbols, count):
+    pairs = [f"{a}_{b}" for i, a in enumerate(symbols) for b in symbols[i + 1:]]
+    return pairs[:count]
+
+
+def ticks(symbols, count, seed=0, start_ts=None, interval=0.05, prices=None):
+    """(symbol, tick, exchange_ts) triples in Kite tick shape, round-robin over symbols."""
+    rng = np.random.default_rng(seed)
+    start_ts = pd.Timestamp(START, tz=TZ).timestamp() if start_ts is None else start_ts
+    base = {sym: rng.uniform(100, 3000) for sym in symbols}
+    if prices:
+        # Carry on from existing bars, e.g. the seeded history of a replay
+        base.update({sym: float(prices[sym]) for sym in symbols if sym in prices})
+    moves = np.exp(np.cumsum(rng.normal(0, 2e-4, (count // max(len(symbols), 1) + 1, len(symbols))), axis=0))
+    qty = rng.integers(1, 500, count)
+    out = []
+    for i in range(count):
+        row, col = divmod(i, len(symbols))
+        sym = symbols[col]
+        out.append((sym, {'last_price': round(float(base[sym] * moves[row, col]), 2),
+                          'last_traded_quantity': int(qty[i])}, start_ts + i * interval))
+    return out
@@ -1,53 +1,207 @@
+import os
 import time
+import threading
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict, deque
+from collections import deque
+from dotenv import load_dotenv
+
+IST = timezone(timedelta(hours=5, minutes=30))
+# Bars sit on the IST wall-clock grid whatever the host's TZ is
+IST_OFFSET = int(IST.utcoffset(None).total_seconds())
+
+load_dotenv()
+# Ticks may arrive this much out of order before the watermark passes them
+WATERMARK_DELAY = float(os.getenv("WATERMARK_DELAY", "1"))
+# A closed bar still accepts ticks this long after its end; they re-emit it
+ALLOWED_LATENESS = float(os.getenv("ALLOWED_LATENESS", "5"))
+# With no ticks at all the watermark follows the clock, this far behind
+WATERMARK_IDLE = float(os.getenv("WATERMARK_IDLE", "5"))
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def tick_ts_ns(tick):
+    """Exchange time of a tick (Kite full mode, Binance) in epoch ns, else None for arrival time."""
+    ts = tick.get('exchange_timestamp')
+    if ts is None:
+        return None
+    if isinstance(ts, (int, float)):
+        # Microseconds, like the datetime path; a float has no exact nanoseconds this far from 1970
+        return round(ts * 1e6) * 1000
+    # Kite sends naive exchange-local datetimes
+    delta = (ts if ts.tzinfo else ts.replace(tzinfo=IST)) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+
+
+def bar_time(ts):
+    """Bar date for epoch seconds, as live candles and downloaded crypto bars both label it."""
+    return datetime.fromtimestamp(ts, IST)
+
+
+def bucket_start(ts, interval_seconds):
+    """Start of the IST interval bucket holding epoch seconds `ts` (scalars or integer arrays)."""
+    return (ts + IST_OFFSET) // interval_seconds * interval_seconds - IST_OFFSET
+
 
 class CandleAggregator:
-    def __init__(self, interval_minutes=5):
+    """
+    Running OHLCV bar per symbol on the configured interval grid, in event time.
+
+    Ticks are bucketed by their exchange timestamp (arrival time when the
+    feed has none). The watermark trails the newest event by `delay`
+    seconds, or the clock by `idle` when the feed is quiet. Bars whose end
+    the watermark has passed are closed for every symbol at once and queued
+    for get_candle; wait_closed wakes up the writer when that happens.
+    Ticks up to `lateness` seconds behind a closed bar update it and queue
+    it again; later ones are dropped and counted.
+    """
+
+    def __init__(self, interval_minutes=5, on_close=None, max_closed=64, clock=time.time,
+                 delay=WATERMARK_DELAY, lateness=ALLOWED_LATENESS, idle=WATERMARK_IDLE):
         self.interval = interval_minutes
-        self.data = {}
-    
+        # Replays swap in a simulated clock
+        self.clock = clock
+        self.interval_seconds = interval_minutes * 60
+        self.on_close = on_close
+        self.max_closed = max_closed
+        self.delay = delay
+        self.lateness = lateness
+        self.idle = idle
+        # symbol -> {bucket start: [start, open, high, low, close, volume, closed]}
+        self.bars = {}
+        self.closed = {}
+        self.max_ts = float('-inf')
+        self.next_close = float('-inf')
+        self.late = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.pending = False
+
+    def bucket(self, ts):
+        return bucket_start(int(ts), self.interval_seconds)
+
+    def watermark(self, now=None):
+        wm = self.max_ts - self.delay
+        if now is not None:
+            wm = max(wm, now - self.idle)
+        return wm
+
+    def _close(self, symbol, bar):
+        if symbol not in self.closed:
+            self.closed[symbol] = deque(maxlen=self.max_closed)
+        self.closed[symbol].append(bar[:6])
+        self.pending = True
+
+    def _advance(self, wm):
+        """Close bars that ended at or before wm and forget those past lateness; returns the closed ones."""
+        finished = []
+        for symbol, bars in self.bars.items():
+            for start in list(bars):
+                bar = bars[start]
+                end = start + self.interval_seconds
+                if end > wm:
+                    continue
+                if not bar[6]:
+                    bar[6] = True
+                    self._close(symbol, bar)
+                    finished.append((symbol, bar[:6]))
+                if end + self.lateness <= wm:
+                    del bars[start]
+        self.next_close = self.bucket(wm) + self.interval_seconds
+        if finished:
+            self.ready.notify_all()
+        return finished
+
+    def _emit(self, finished):
+        if self.on_close:
+            for symbol, bar in finished:
+                self.on_close(symbol, self.to_candle(bar))
+
     def process_tick(self, symbol, tick):
-        if symbol not in self.data:
-            self.data[symbol] = deque()
-        
-        self.data[symbol].append({
-            'time': datetime.now(),
-            'price': tick['last_price']
-        })
-        
-        cutoff = datetime.now() - timedelta(minutes=self.interval)
-        while self.data[symbol] and self.data[symbol][0]['time'] < cutoff:
-            self.data[symbol].popleft()
-    
+        price = float(tick['last_price'])
+        qty = float(tick.get('last_traded_quantity') or 0)
+        ts = tick.get('exchange_timestamp')
+        if ts is None:
+            ts = self.clock()
+        elif not isinstance(ts, float):
+            ts = tick_ts_ns(tick) / 1e9
+        start = self.bucket(ts)
+        finished = None
+
+        with self.lock:
+            if ts > self.max_ts:
+                self.max_ts = ts
+            bars = self.bars.get(symbol)
+            if bars is None:
+                bars = self.bars[symbol] = {}
+            bar = bars.get(start)
+            if bar is None:
+                if start + self.interval_seconds + self.lateness <= self.watermark():
+                    self.dropped += 1
+                    return
+                # [bucket start, open, high, low, close, volume, closed]
+                bars[start] = [start, price, price, price, price, qty, False]
+            elif bar[6] and start + self.interval_seconds + self.lateness <= self.watermark():
+                self.dropped += 1
+                return
+            else:
+                if price > bar[2]:
+                    bar[2] = price
+                elif price < bar[3]:
+                    bar[3] = price
+                bar[4] = price
+                bar[5] += qty
+                if bar[6]:
+                    # Late tick for a bar already handed out: hand out the amended bar
+                    self.late += 1
+                    self._close(symbol, bar)
+                    self.ready.notify_all()
+            if self.max_ts - self.delay >= self.next_close:
+                finished = self._advance(self.watermark())
+
+        if finished:
+            self._emit(finished)
+
+    def advance(self, watermark=None):
+        """Close bars up to `watermark`, or the clock-driven watermark when ticks stall; returns them."""
+        with self.lock:
+            wm = self.watermark(self.clock()) if watermark is None else watermark
+            finished = self._advance(wm) if watermark is not None or wm >= self.next_close else []
+        self._emit(finished)
+        return finished
+
+    def wait_closed(self, timeout=1.0):
+        """Block until bars are waiting for get_candle, advancing on the clock each timeout."""
+        with self.lock:
+            if not self.pending:
+                self.ready.wait(timeout)
+        self.advance()
+        with self.lock:
+            pending, self.pending = self.pending, False
+        return pending
+
+    @staticmethod
+    def to_candle(bar):
+        return {
+            'date': bar_time(bar[0]),
+            'open': bar[1],
+            'high': bar[2],
+            'low': bar[3],
+            'close': bar[4],
+            'volume': int(bar[5])
+        }
+
     def get_candle(self, symbol):
-        if symbol not in self.data or not self.data[symbol]:
-            return {'data': []}
+        with self.lock:
+            closed = self.closed.pop(symbol, None)
 
-        ticks = sorted(self.data[symbol], key=lambda t: t['time'])
-        ist_offset = timezone(timedelta(hours=5, minutes=30))
-        candles = defaultdict(lambda: {'prices': [], 'volumes': []})
-
-        for t in ticks:
-            candle_time = t['time'].replace(tzinfo=ist_offset)
-            start = candle_time.replace(minute=(candle_time.minute // 5) * 5, second=0, microsecond=0)
-            candles[start]['prices'].append(float(t['price']))
-            candles[start]['volumes'].append(float(t.get('volume', 0)))
-
-        data_list = []
-        for start, info in sorted(candles.items()):
-            prices = info['prices']
-            if prices:
-                data_list.append({
-                    'date': start,
-                    'open': float(prices[0]),
-                    'high': float(max(prices)),
-                    'low': float(min(prices)),
-                    'close': float(prices[-1]),
-                    'volume': int(sum(info['volumes']))
-                })
-
-        return {'data': data_list}
+        if not closed:
+            return {'data': []}
+        # Late ticks can queue a bar more than once; the last copy is the complete one
+        latest = {bar[0]: bar for bar in closed}
+        return {'data': [self.to_candle(latest[start]) for start in sorted(latest)]}
 
 # aggregator = LightweightCandleAggregator(interval_minutes=1)
 
@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from data.ratelimit import get_limiter, call_with_retries
+from data.data import plan_historical_data
+from data.crypto import plan_crypto_historical_data
+
+load_dotenv()
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "8"))
+
+
+def _plan(symbol, exchange, start, end_date, interval):
+    if exchange == "nse":
+        return plan_historical_data(symbol, start, end_date, interval=interval)
+    return plan_crypto_historical_data(symbol, start, end_date, interval=interval)
+
+
+def backfill(symbols, exchange, starts, end_date, interval, workers=BACKFILL_WORKERS):
+    """
+    Download history for many symbols at once and yield (symbol, rows) as
+    each symbol finishes.
+
+    Chunk requests from all symbols share one thread pool and the venue's
+    token bucket. Failed chunks are retried with backoff. If a chunk still
+    fails, only the rows before it are yielded, so the next run resumes from
+    the gap.
+    """
+    limiter = get_limiter(exchange)
+    results, failed, remaining = {}, {}, {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_plan, sym, exchange, starts[sym], end_date, interval): (sym, None)
+                   for sym in symbols}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                sym, idx = pending.pop(fut)
+
+                if idx is None:
+                    chunks = fut.exception() is None and fut.result()
+                    if not chunks:
+                        print(f"❌ Backfill skipped for {sym}")
+                        continue
+                    results[sym] = [None] * len(chunks)
+                    remaining[sym] = len(chunks)
+                    for i, (label, fn) in enumerate(chunks):
+                        pending[pool.submit(call_with_retries, fn, limiter, label)] = (sym, i)
+                    continue
+
+                if fut.exception() is None:
+                    results[sym][idx] = fut.result()
+                else:
+                    failed[sym] = min(failed.get(sym, idx), idx)
+                remaining[sym] -= 1
+                if remaining[sym]:
+                    continue
+
+                total = len(results[sym])
+                parts = results.pop(sym)[:failed.get(sym, total)]
+                rows = [row for part in parts for row in part]
+                if sym in failed:
+                    print(f"⚠️ {sym}: chunk {failed[sym] + 1}/{total} failed, keeping the {failed[sym]} before it")
+                if rows:
+                    yield sym, rows
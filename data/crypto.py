@@ -7,34 +7,51 @@ import websocket
 import os
 from dotenv import load_dotenv
 from config import RedisConnection
+from data.ratelimit import get_limiter, call_with_retries, fetch_chunks
+from data.ltp_writer import LTPWriter
+from data.tick_recorder import get_tick_recorder
+from data.aggregator import bar_time, IST, tick_ts_ns
+from metrics import timed
 
 redis_conn = RedisConnection.get_instance()
 
 load_dotenv()
 API_KEY = os.getenv("BINANCE_API_KEY")
 API_SECRET = os.getenv("BINANCE_API_SECRET")
-client = Client(API_KEY, API_SECRET)
+_client = None
 
+def get_client():
+    # Client() pings the API, so it is only built once something needs it
+    global _client
+    if _client is None:
+        _client = Client(API_KEY, API_SECRET)
+    return _client
 
-def crypto_historical_data(symbol, current, end_date, interval="5m", chunk_days=60, exchange="spot"):
-    """
-    Binance historical data fetcher
-    
-    Args:
-        symbol: Trading pair like "BTCUSDT", "ETHUSDT" or just "BTC", "ETH"
-        current: Start datetime
-        end_date: End datetime
-        interval: "1m", "5m", "15m", "1h", "4h", "1d" etc
-        chunk_days: Days per chunk (max 1000 candles per request)
-        exchange: "spot" or "futures" (not used, kept for compatibility)
-    """
-    all_data = []
-    
-    # Remove timezone if present
-    if hasattr(current, 'tz') and current.tz is not None:
-        current = current.tz_localize(None)
-    if hasattr(end_date, 'tz') and end_date.tz is not None:
-        end_date = end_date.tz_localize(None)
+BINANCE_WS_URL = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443")
+BINANCE_WS_COMBINED = os.getenv("BINANCE_WS_COMBINED", "1") == "1"
+# Binance allows up to 1024 streams per combined connection
+BINANCE_STREAMS_PER_CONN = int(os.getenv("BINANCE_STREAMS_PER_CONN", "200"))
+BINANCE_RECONNECT_MIN = 1.0
+BINANCE_RECONNECT_MAX = 60.0
+
+
+# Interval mapping for compatibility
+INTERVAL_MAP = {
+    "1minute": "1m", "5minute": "5m", "15minute": "15m",
+    "1m": "1m", "5m": "5m", "15m": "15m",
+    "1h": "1h", "4h": "4h", "1d": "1d"
+}
+INTERVAL_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+KLINES_LIMIT = 1000
+
+
+def plan_crypto_historical_data(symbol, current, end_date, interval="5m"):
+    """Split current..end_date into (label, fetch) chunks of at most 1000 candles, one request each."""
+    # Naive bounds are IST wall-clock time, like the bars they are compared with
+    if current.tzinfo is None:
+        current = current.replace(tzinfo=IST)
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=IST)
     
     # Convert symbol format if needed (BTC -> BTCUSDT)
     if not symbol.endswith('USDT'):
@@ -42,7 +59,7 @@ def crypto_historical_data(symbol, current, end_date, interval="5m", chunk_days=
     
     # Validate symbol
     try:
-        info = client.get_symbol_info(symbol)
+        info = call_with_retries(lambda: get_client().get_symbol_info(symbol), get_limiter("crypto"), f"{symbol} info")
         if not info:
             print(f"❌ Symbol {symbol} not found")
             return None
@@ -50,67 +67,78 @@ def crypto_historical_data(symbol, current, end_date, interval="5m", chunk_days=
         print(f"❌ Error validating symbol: {e}")
         return None
     
-    # Interval mapping for compatibility
-    interval_map = {
-        "1minute": "1m", "5minute": "5m", "15minute": "15m",
-        "1m": "1m", "5m": "5m", "15m": "15m",
-        "1h": "1h", "4h": "4h", "1d": "1d"
-    }
-    binance_interval = interval_map.get(interval, interval)
+    binance_interval = INTERVAL_MAP.get(interval, interval)
+    step_ms = int(binance_interval[:-1]) * INTERVAL_UNIT_MS[binance_interval[-1]] * KLINES_LIMIT
     
-    while current < end_date:
-        chunk_end = min(current + timedelta(days=chunk_days-1), end_date)
-        
-        try:
-            # Binance expects milliseconds
-            start_ms = int(current.timestamp() * 1000)
-            end_ms = int(chunk_end.timestamp() * 1000)
-            
-            klines = client.get_historical_klines(
+    def fetch(start_ms, end_ms):
+        def run():
+            klines = get_client().get_klines(
                 symbol=symbol,
                 interval=binance_interval,
-                start_str=start_ms,
-                end_str=end_ms,
-                limit=1000
+                startTime=start_ms,
+                endTime=end_ms,
+                limit=KLINES_LIMIT
             )
-            
-            if klines:
-                # Convert to Kite-like format
-                chunk_data = []
-                for k in klines:
-                    chunk_data.append({
-                        'date': datetime.fromtimestamp(k[0]/1000),
-                        'open': float(k[1]),
-                        'high': float(k[2]),
-                        'low': float(k[3]),
-                        'close': float(k[4]),
-                        'volume': float(k[5])
-                    })
-                
-                all_data.extend(chunk_data)
-            
-            time.sleep(0.34)  # Rate limit protection
-            
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            time.sleep(1)
-        
-        current = chunk_end + timedelta(days=1)
+            # Convert to Kite-like format, dated like the live candles they continue
+            return [{
+                'date': bar_time(k[0]/1000),
+                'open': float(k[1]),
+                'high': float(k[2]),
+                'low': float(k[3]),
+                'close': float(k[4]),
+                'volume': float(k[5])
+            } for k in klines]
+        return run
     
-    return all_data if all_data else None
+    # Binance expects milliseconds
+    start_ms = int(current.timestamp() * 1000)
+    final_ms = int(end_date.timestamp() * 1000)
+    chunks = []
+    while start_ms < final_ms:
+        end_ms = min(start_ms + step_ms - 1, final_ms)
+        label = f"{symbol} {datetime.fromtimestamp(start_ms/1000, IST):%Y-%m-%d %H:%M}"
+        chunks.append((label, fetch(start_ms, end_ms)))
+        start_ms = end_ms + 1
+    return chunks
+
+
+def crypto_historical_data(symbol, current, end_date, interval="5m", chunk_days=60, exchange="spot"):
+    """
+    Binance historical data fetcher
+    
+    Args:
+        symbol: Trading pair like "BTCUSDT", "ETHUSDT" or just "BTC", "ETH"
+        current: Start datetime
+        end_date: End datetime
+        interval: "1m", "5m", "15m", "1h", "4h", "1d" etc
+        chunk_days: Not used, requests are chunked by the 1000 candle limit (kept for compatibility)
+        exchange: "spot" or "futures" (not used, kept for compatibility)
+    """
+    chunks = plan_crypto_historical_data(symbol, current, end_date, interval)
+    if chunks is None:
+        return None
+    return fetch_chunks(chunks, get_limiter("crypto"))
 
 
 class BinanceWS:
     """Binance WebSocket handler - Simple & Stable"""
     
-    def __init__(self, api_key, api_secret, redis_conn):
+    def __init__(self, api_key, api_secret, redis_conn, combined=True,
+                 streams_per_conn=BINANCE_STREAMS_PER_CONN, base_url=BINANCE_WS_URL):
         self.api_key = api_key
         self.api_secret = api_secret
         self.redis = redis_conn
+        self.ltp_writer = LTPWriter(redis_conn)
+        self.recorder = get_tick_recorder()
         self.symbols = []
+        self.names = {}
         self.ws_threads = []
+        self.apps = []
         self.tick_callback = None
         self.running = False
+        self.combined = combined
+        self.streams_per_conn = streams_per_conn
+        self.base_url = base_url.rstrip('/')
     
     def start(self, symbols, tick_callback=None):
         """
@@ -123,68 +151,113 @@ class BinanceWS:
         # Normalize symbols to USDT pairs
         self.symbols = [s.upper() + 'USDT' if not s.endswith('USDT') else s.upper() 
                        for s in symbols]
+        # Callbacks get the names the caller used, so BTC ticks build BTC candles
+        self.names = dict(zip(self.symbols, symbols))
         self.tick_callback = tick_callback
         self.running = True
+        self.ltp_writer.start()
         
-        # Start WebSocket thread for each symbol
-        for symbol in self.symbols:
-            thread = threading.Thread(target=self._run_websocket, args=(symbol,), daemon=True)
-            thread.start()
-            self.ws_threads.append(thread)
+        if self.combined:
+            # A few combined-stream connections, each carrying a slice of the symbols
+            for i in range(0, len(self.symbols), self.streams_per_conn):
+                chunk = self.symbols[i:i + self.streams_per_conn]
+                thread = threading.Thread(target=self._run_combined, args=(chunk,), daemon=True)
+                thread.start()
+                self.ws_threads.append(thread)
+        else:
+            # Start WebSocket thread for each symbol
+            for symbol in self.symbols:
+                thread = threading.Thread(target=self._run_websocket, args=(symbol,), daemon=True)
+                thread.start()
+                self.ws_threads.append(thread)
         
-        print(f"✅ WebSocket started for {len(self.symbols)} symbols")
+        print(f"✅ WebSocket started for {len(self.symbols)} symbols over {len(self.ws_threads)} connections")
         return self
     
+    def _handle_ticker(self, symbol, data):
+        if data.get('e') == '24hrTicker':
+            # Kite-like tick structure
+            tick = {
+                'instrument_token': symbol,
+                'last_price': float(data['c']),
+                'volume': float(data['v']),
+                'change': float(data['p']),
+                'change_percent': float(data['P']),
+                # Event time in epoch seconds, for event-time candles
+                'exchange_timestamp': data['E'] / 1000 if 'E' in data else None,
+            }
+            
+            # Store in Redis, coalesced and batched by the writer thread
+            self.ltp_writer.update(symbol, tick['last_price'])
+            if self.recorder:
+                # Q is the last trade's quantity
+                self.recorder.record(self.names.get(symbol, symbol), tick['last_price'],
+                                     float(data.get('Q', 0)), tick_ts_ns(tick))
+            
+            # User callback
+            if self.tick_callback:
+                self.tick_callback(self.names.get(symbol, symbol), tick)
+    
+    def _run_forever(self, url, on_message, label):
+        """Keep one connection up, reconnecting with exponential backoff"""
+        delay = BINANCE_RECONNECT_MIN
+        
+        def on_error(ws, error):
+            if self.running:
+                print(f"⚠️ WebSocket error for {label}: {error}")
+        
+        def on_open(ws):
+            nonlocal delay
+            delay = BINANCE_RECONNECT_MIN
+            print(f"📡 Connected: {label}")
+        
+        while self.running:
+            ws = websocket.WebSocketApp(
+                url,
+                on_message=on_message,
+                on_error=on_error,
+                on_open=on_open
+            )
+            self.apps.append(ws)
+            try:
+                ws.run_forever()
+            finally:
+                self.apps.remove(ws)
+            if not self.running:
+                break
+            print(f"🔌 WebSocket closed for {label}, reconnecting in {delay:.0f}s...")
+            time.sleep(delay)
+            delay = min(delay * 2, BINANCE_RECONNECT_MAX)
+    
+    def _run_combined(self, symbols):
+        """Run one combined-stream connection and dispatch by stream name"""
+        by_stream = {f"{s.lower()}@ticker": s for s in symbols}
+        url = f"{self.base_url}/stream?streams={'/'.join(by_stream)}"
+        
+        def on_message(ws, message):
+            try:
+                with timed("ws_receive"):
+                    payload = json.loads(message)
+                    symbol = by_stream.get(payload.get('stream'))
+                    if symbol:
+                        self._handle_ticker(symbol, payload['data'])
+            except Exception as e:
+                print(f"❌ Error processing combined message: {e}")
+        
+        self._run_forever(url, on_message, f"{len(symbols)} streams")
+    
     def _run_websocket(self, symbol):
         """Run WebSocket connection for a symbol"""
-        ws_url = f"wss://stream.binance.com:9443/ws/{symbol.lower()}@ticker"
+        ws_url = f"{self.base_url}/ws/{symbol.lower()}@ticker"
         
         def on_message(ws, message):
             try:
-                data = json.loads(message)
-                if data.get('e') == '24hrTicker':
-                    # Kite-like tick structure
-                    tick = {
-                        'instrument_token': symbol,
-                        'last_price': float(data['c']),
-                        'volume': float(data['v']),
-                        'change': float(data['p']),
-                        'change_percent': float(data['P'])
-                    }
-                    
-                    # Store in Redis
-                    self.redis.set(f"ltp:{symbol}", tick['last_price'])
-                    
-                    # User callback
-                    if self.tick_callback:
-                        self.tick_callback(symbol, tick)
+                with timed("ws_receive"):
+                    self._handle_ticker(symbol, json.loads(message))
             except Exception as e:
                 print(f"❌ Error processing message for {symbol}: {e}")
         
-        def on_error(ws, error):
-            if self.running:
-                print(f"⚠️ WebSocket error for {symbol}: {error}")
-        
-        def on_close(ws, close_status_code, close_msg):
-            if self.running:
-                print(f"🔌 WebSocket closed for {symbol}, reconnecting...")
-                time.sleep(2)
-                if self.running:
-                    self._run_websocket(symbol)
-        
-        def on_open(ws):
-            print(f"📡 Connected: {symbol}")
-        
-        # Create WebSocket connection
-        ws = websocket.WebSocketApp(
-            ws_url,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close,
-            on_open=on_open
-        )
-        
-        ws.run_forever()
+        self._run_forever(ws_url, on_message, symbol)
     
     def get_ltp(self, symbol):
         """Get last price from Redis"""
@@ -198,6 +271,11 @@ class BinanceWS:
         """Stop WebSocket"""
         print("🛑 Stopping WebSocket...")
         self.running = False
+        for ws in list(self.apps):
+            ws.close()
+        self.ltp_writer.stop()
+        if self.recorder:
+            self.recorder.flush()
 
 
 def crypto_websocket_connect(symbols, tick_callback=None):
@@ -208,6 +286,6 @@ def crypto_websocket_connect(symbols, tick_callback=None):
         ws = websocket_connect(["BTC", "ETH"], tick_callback=my_callback)
         ltp = ws.get_ltp("BTC")
     """
-    ws = BinanceWS(API_KEY, API_SECRET, redis_conn)
+    ws = BinanceWS(API_KEY, API_SECRET, redis_conn, combined=BINANCE_WS_COMBINED)
     ws.start(symbols, tick_callback)
     return ws
\ No newline at end of file
@@ -4,6 +4,12 @@ from kiteconnect import KiteConnect, KiteTicker
 import os
 from dotenv import load_dotenv
 from config import RedisConnection
+from data.instruments import get_instrument_master
+from data.ratelimit import get_limiter, fetch_chunks
+from data.ltp_writer import LTPWriter
+from data.tick_recorder import get_tick_recorder
+from data.aggregator import IST, tick_ts_ns
+from metrics import timed
 redis_conn = RedisConnection.get_instance()
 
 load_dotenv()
@@ -13,15 +19,16 @@ kite = KiteConnect(api_key=API_KEY)
 kite.set_access_token(ACCESS_TOKEN)
 
 
-def get_historical_data(symbol, current, end_date, interval="5minute", chunk_days=60, exchange="NSE"):
-    all_data = []
-    if hasattr(current, 'tz') and current.tz is not None:
-        current = current.tz_localize(None)
+def plan_historical_data(symbol, current, end_date, interval="5minute", chunk_days=60, exchange="NSE"):
+    """Split current..end_date into (label, fetch) chunks, one Kite request each."""
+    # Kite takes naive IST wall-clock bounds
+    if current.tzinfo is not None:
+        current = current.astimezone(IST).replace(tzinfo=None)
+    if end_date.tzinfo is not None:
+        end_date = end_date.astimezone(IST).replace(tzinfo=None)
     
     try:
-        instruments = kite.instruments(exchange)
-        token = next((i['instrument_token'] for i in instruments 
-                    if i['tradingsymbol'] == symbol and i['instrument_type'] == 'EQ'), None)
+        token = get_instrument_master(kite, exchange).token(symbol)
         if not token:
             print(f"❌ Symbol {symbol} not found")
             return None
@@ -29,29 +36,28 @@ def get_historical_data(symbol, current, end_date, interval="5minute", chunk_day
         print(f"❌ Error: {e}")
         return None
 
+    def fetch(start, end):
+        return lambda: kite.historical_data(
+            instrument_token=token,
+            from_date=start,
+            to_date=end,
+            interval=interval
+        ) or []
+
+    chunks = []
     while current < end_date:
-        chunk_end = min(current + timedelta(days=chunk_days-1), end_date)
-        
-        try:
-            chunk_data = kite.historical_data(
-                instrument_token=token,
-                from_date=current,
-                to_date=chunk_end,
-                interval=interval
-            )
-            if chunk_data:
-                all_data.extend(chunk_data)
-                # print(f"✓ {len(chunk_data):5d} candles | {current.strftime('%Y-%m-%d')} to {chunk_end.strftime('%Y-%m-%d')}")
-            
-            time.sleep(0.34)  # 3 req/sec = 333ms minimum, so 340ms safe
-            
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            time.sleep(1)
-        
-        current = chunk_end + timedelta(days=1)
-    
-    return all_data if all_data else None
+        chunk_end = min(current + timedelta(days=chunk_days), end_date)
+        chunks.append((f"{symbol} {current:%Y-%m-%d}", fetch(current, chunk_end)))
+        # to_date is inclusive, so start the next chunk just after it
+        current = chunk_end + timedelta(seconds=1)
+    return chunks
+
+
+def get_historical_data(symbol, current, end_date, interval="5minute", chunk_days=60, exchange="NSE"):
+    chunks = plan_historical_data(symbol, current, end_date, interval, chunk_days, exchange)
+    if chunks is None:
+        return None
+    return fetch_chunks(chunks, get_limiter("nse"))
 
 
 # websocket_handler.py
@@ -60,7 +66,10 @@ class KiteWS:
         self.api_key = api_key
         self.access_token = access_token
         self.redis = redis_conn
+        self.ltp_writer = LTPWriter(redis_conn)
+        self.recorder = get_tick_recorder()
         self.tokens = {}
+        self.symbols_by_token = {}
         self.symbols = []
         self.kws = None
         self.tick_callback = None
@@ -68,6 +77,7 @@ class KiteWS:
     def start(self, symbols, tick_callback=None):
         self.symbols = symbols
         self.tick_callback = tick_callback
+        self.ltp_writer.start()
         self.kws = KiteTicker(self.api_key, self.access_token)
         self.kws.on_ticks = self._on_ticks
         self.kws.on_connect = self._on_connect
@@ -75,23 +85,24 @@ class KiteWS:
         return self.kws
     
     def _on_ticks(self, ws, ticks):
-        for tick in ticks:
-            symbol = next((s for s in self.symbols 
-                         if tick['instrument_token'] == self.tokens.get(s)), None)
-            if symbol:
-                self.redis.set(f"ltp:{symbol}", tick['last_price'])
-                
-                if self.tick_callback:
-                    self.tick_callback(symbol, tick)
+        with timed("ws_receive"):
+            for tick in ticks:
+                symbol = self.symbols_by_token.get(tick['instrument_token'])
+                if symbol:
+                    self.ltp_writer.update(symbol, tick['last_price'])
+                    if self.recorder:
+                        self.recorder.record(symbol, tick['last_price'], tick.get('last_traded_quantity'), tick_ts_ns(tick))
+
+                    if self.tick_callback:
+                        self.tick_callback(symbol, tick)
     
     def _on_connect(self, ws, response):
         kite = KiteConnect(api_key=self.api_key)
         kite.set_access_token(self.access_token)
-        instruments = kite.instruments("NSE")
-        
-        self.tokens = {s: next((i['instrument_token'] for i in instruments 
-                               if i['tradingsymbol'] == s and i['instrument_type'] == 'EQ'), None) 
-                      for s in self.symbols}
+        # Cached per trading day, so reconnects don't download the dump again
+        master = get_instrument_master(kite, "NSE")
+        self.tokens = {s: master.token(s) for s in self.symbols}
+        self.symbols_by_token = {t: s for s, t in self.tokens.items() if t}
         
         valid_tokens = [t for t in self.tokens.values() if t]
         if valid_tokens:
@@ -105,6 +116,9 @@ class KiteWS:
     def stop(self):
         if self.kws:
             self.kws.close()
+        self.ltp_writer.stop()
+        if self.recorder:
+            self.recorder.flush()
 
 
 def websocket(symbols, tick_callback=None):
@@ -0,0 +1,72 @@
+import os
+import glob
+import threading
+from datetime import datetime
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+INSTRUMENT_CACHE_DIR = os.getenv("INSTRUMENT_CACHE_DIR", "instruments")
+
+
+class InstrumentMaster:
+    """
+    EQ instrument dump for one exchange, fetched at most once per trading day.
+
+    The dump is stored as a small feather file per day and loaded into two
+    dicts, so tradingsymbol -> token and token -> tradingsymbol are O(1).
+    """
+
+    def __init__(self, kite, exchange="NSE", cache_dir=INSTRUMENT_CACHE_DIR):
+        self.kite = kite
+        self.exchange = exchange
+        self.cache_dir = cache_dir
+        self.day = None
+        self.tokens = {}
+        self.symbols = {}
+        self.lock = threading.Lock()
+
+    def _path(self, day):
+        return os.path.join(self.cache_dir, f"{self.exchange}_{day:%Y%m%d}.feather")
+
+    def _fetch(self, day):
+        instruments = pd.DataFrame(self.kite.instruments(self.exchange))
+        df = instruments.loc[instruments['instrument_type'] == 'EQ', ['tradingsymbol', 'instrument_token']]
+        df = df.drop_duplicates('tradingsymbol').reset_index(drop=True)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self._path(day) + ".tmp"
+        df.to_feather(tmp)
+        os.replace(tmp, self._path(day))
+        for old in glob.glob(os.path.join(self.cache_dir, f"{self.exchange}_*.feather")):
+            if old != self._path(day):
+                os.remove(old)
+        print(f"✓ Instrument master for {self.exchange} refreshed ({len(df)} EQ symbols)")
+        return df
+
+    def load(self):
+        day = datetime.now().date()
+        with self.lock:
+            if self.day == day:
+                return self
+            path = self._path(day)
+            df = pd.read_feather(path) if os.path.exists(path) else self._fetch(day)
+            tokens = df['instrument_token'].astype(int).tolist()
+            self.tokens = dict(zip(df['tradingsymbol'], tokens))
+            self.symbols = dict(zip(tokens, df['tradingsymbol']))
+            self.day = day
+        return self
+
+    def token(self, symbol):
+        return self.load().tokens.get(symbol)
+
+    def symbol(self, token):
+        return self.load().symbols.get(token)
+
+
+_masters = {}
+
+def get_instrument_master(kite, exchange="NSE"):
+    if exchange not in _masters:
+        _masters[exchange] = InstrumentMaster(kite, exchange)
+    return _masters[exchange]
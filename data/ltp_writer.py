@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import threading
+from dotenv import load_dotenv
+from metrics import observe
+
+load_dotenv()
+LTP_FLUSH_MS = float(os.getenv("LTP_FLUSH_MS", "50"))
+# Every flush is also published here as {symbol: price} for event-driven readers
+LTP_CHANNEL = os.getenv("LTP_CHANNEL", "ltp_updates")
+
+
+class LTPWriter:
+    """
+    Keeps only the latest price per symbol and writes every changed symbol
+    with one MSET per flush, off the websocket thread. The same batch is
+    published on `channel` in the same round trip.
+    """
+
+    def __init__(self, redis_conn, flush_ms=LTP_FLUSH_MS, prefix="ltp", channel=LTP_CHANNEL):
+        self.redis = redis_conn
+        self.interval = flush_ms / 1000.0
+        self.prefix = prefix
+        self.channel = channel
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.updates = 0
+        self.written = 0
+        self.flushes = 0
+        self.flush_ms_total = 0.0
+        self.flush_ms_max = 0.0
+        self.flush_ms_last = 0.0
+
+    def update(self, symbol, price):
+        with self.lock:
+            self.pending[symbol] = float(price)
+            self.updates += 1
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+        t1 = time.perf_counter()
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.mset({f"{self.prefix}:{s}": p for s, p in batch.items()})
+            if self.channel:
+                pipe.publish(self.channel, json.dumps(batch))
+            pipe.execute()
+        elapsed = (time.perf_counter() - t1) * 1000
+        observe("ltp_write", elapsed / 1000)
+        with self.lock:
+            self.written += len(batch)
+            self.flushes += 1
+            self.flush_ms_total += elapsed
+            self.flush_ms_last = elapsed
+            self.flush_ms_max = max(self.flush_ms_max, elapsed)
+        return len(batch)
+
+    def _run(self):
+        while self.running:
+            started = time.monotonic()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ LTP flush error: {e}")
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        self.flush()
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True, name="LTPWriter")
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'updates': self.updates,
+                'written': self.written,
+                'coalesced': self.updates - self.written - len(self.pending),
+                'flushes': self.flushes,
+                'flush_ms_last': self.flush_ms_last,
+                'flush_ms_avg': self.flush_ms_total / self.flushes if self.flushes else 0.0,
+                'flush_ms_max': self.flush_ms_max,
+            }
@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+# Requests per second allowed by each venue, shared by every thread in the process
+RATE_LIMITS = {
+    "nse": float(os.getenv("KITE_REQ_PER_SEC", "3")),
+    "crypto": float(os.getenv("BINANCE_REQ_PER_SEC", "10")),
+}
+RETRIES = int(os.getenv("BACKFILL_RETRIES", "5"))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may go out."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(venue):
+    with _limiters_lock:
+        if venue not in _limiters:
+            _limiters[venue] = TokenBucket(RATE_LIMITS[venue])
+        return _limiters[venue]
+
+
+def call_with_retries(fn, limiter, label, retries=RETRIES):
+    """Run fn() under the limiter, retrying failures with exponential backoff."""
+    delay = RETRY_BASE_DELAY
+    for attempt in range(1, retries + 1):
+        limiter.acquire()
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries:
+                print(f"❌ {label} failed after {retries} attempts: {e}")
+                raise
+            print(f"⚠️ {label} failed ({e}), retry {attempt}/{retries - 1} in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+
+def fetch_chunks(chunks, limiter):
+    """Fetch planned (label, fn) chunks in order, keeping the rows before the first failure."""
+    all_data = []
+    for label, fn in chunks:
+        try:
+            all_data.extend(call_with_retries(fn, limiter, label))
+        except Exception:
+            # Later chunks would leave a gap that the next run can't see
+            break
+    return all_data if all_data else None
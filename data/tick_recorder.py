@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from data.aggregator import IST, bar_time, bucket_start
+
+load_dotenv()
+# Recording is off unless TICK_LOG=1
+TICK_LOG = os.getenv("TICK_LOG") == "1"
+TICK_LOG_DIR = os.getenv("TICK_LOG_DIR", "ticks")
+TICK_LOG_FLUSH = float(os.getenv("TICK_LOG_FLUSH", "1"))
+TICK_LOG_BUFFER = 1 << 20
+# One fixed-width little-endian record per tick
+TICK_DTYPE = np.dtype([('ts', '<i8'), ('price', '<f8'), ('qty', '<f8')])
+
+
+def tick_path(symbol, day, root=TICK_LOG_DIR):
+    return os.path.join(root, f"{day:%Y%m%d}", f"{symbol}.ticks")
+
+
+def _local_day(ts_ns):
+    return datetime.fromtimestamp(ts_ns / 1e9, IST).date()
+
+
+class TickRecorder:
+    """
+    Appends every tick to {root}/{YYYYMMDD}/{symbol}.ticks as a TICK_DTYPE record.
+
+    Files are opened in append mode with a 1 MiB buffer and flushed every
+    TICK_LOG_FLUSH seconds, so a crash loses at most that much. A torn last
+    record is ignored by read_ticks.
+    """
+
+    def __init__(self, root=TICK_LOG_DIR, flush_seconds=TICK_LOG_FLUSH):
+        self.root = root
+        self.flush_seconds = flush_seconds
+        self.files = {}
+        self.day = None
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.records = 0
+
+    def _file(self, symbol, day):
+        if day != self.day:
+            self._close_all()
+            self.day = day
+            os.makedirs(os.path.dirname(tick_path("_", day, self.root)), exist_ok=True)
+        f = self.files.get(symbol)
+        if f is None:
+            f = self.files[symbol] = open(tick_path(symbol, day, self.root), 'ab', buffering=TICK_LOG_BUFFER)
+        return f
+
+    def record(self, symbol, price, qty=0.0, ts_ns=None):
+        ts_ns = time.time_ns() if ts_ns is None else int(ts_ns)
+        rec = np.array((ts_ns, price, qty or 0.0), dtype=TICK_DTYPE).tobytes()
+        with self.lock:
+            self._file(symbol, _local_day(ts_ns)).write(rec)
+            self.records += 1
+
+    def flush(self):
+        with self.lock:
+            for f in self.files.values():
+                f.flush()
+
+    def _close_all(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Tick log flush error: {e}")
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True, name="TickRecorder")
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            self._close_all()
+
+
+_recorder = None
+
+def get_tick_recorder():
+    """Process-wide recorder when TICK_LOG=1, else None."""
+    global _recorder
+    if TICK_LOG and _recorder is None:
+        _recorder = TickRecorder().start()
+    return _recorder
+
+
+def read_ticks(symbol, day, root=TICK_LOG_DIR):
+    """Memory-mapped TICK_DTYPE records for one symbol and day, or None."""
+    path = tick_path(symbol, day, root)
+    if not os.path.exists(path):
+        return None
+    count = os.path.getsize(path) // TICK_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=TICK_DTYPE)
+    return np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(count,))
+
+
+def recorded_symbols(day, root=TICK_LOG_DIR):
+    folder = os.path.dirname(tick_path("_", day, root))
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f[:-len(".ticks")] for f in os.listdir(folder) if f.endswith(".ticks"))
+
+
+def ticks_to_bars(ticks, interval_minutes):
+    """OHLCV bars bucketed and dated like the aggregator's live candles, computed with reduceat over bucket runs."""
+    if ticks is None or len(ticks) == 0:
+        return None
+    ts, price, qty = ticks['ts'], ticks['price'], ticks['qty']
+    if not (np.diff(ts) >= 0).all():
+        # Feed threads can interleave a few records out of order
+        order = np.argsort(ts, kind='stable')
+        ts, price, qty = ts[order], price[order], qty[order]
+    bucket = bucket_start(ts // 10**9, interval_minutes * 60)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.append(starts[1:], len(ts)) - 1
+    return pd.DataFrame({
+        'date': [bar_time(int(start)) for start in bucket[starts]],
+        'open': price[starts],
+        'high': np.maximum.reduceat(price, starts),
+        'low': np.minimum.reduceat(price, starts),
+        'close': price[ends],
+        'volume': np.add.reduceat(qty, starts).astype(np.int64),
+    })
+
+
+def rebuild_day(day, interval_minutes, symbols=None, redis_conn=None, root=TICK_LOG_DIR, key="historical"):
+    """
+    Rebuild bars for `day` from the tick logs and write them into the historical store.
+
+    Rebuilt bars replace candles with the same date, so bars that were cut
+    short by a crash are overwritten with the complete ones.
+    """
+    from healper import write_feather_to_redis
+    from disk_store import store_write
+    from rollup import update_rollups
+    if redis_conn is None:
+        from config import RedisConnection
+        redis_conn = RedisConnection.get_instance()
+    symbols = symbols or recorded_symbols(day, root)
+    rebuilt = {}
+    for sym in symbols:
+        bars = ticks_to_bars(read_ticks(sym, day, root), interval_minutes)
+        if bars is None:
+            continue
+        write_feather_to_redis(redis_conn, sym, bars, key=key, live=False, spreads=True)
+        store_write(key, sym, bars)
+        update_rollups(redis_conn, sym, key, bars)
+        rebuilt[sym] = len(bars)
+    return rebuilt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild OHLCV bars from recorded tick logs")
+    parser.add_argument("--day", default=datetime.now(IST).strftime("%Y-%m-%d"))
+    parser.add_argument("--interval", type=int, default=int(''.join(filter(str.isdigit, os.getenv("hist_intv", "5")))))
+    parser.add_argument("--symbols", nargs="*")
+    parser.add_argument("--root", default=TICK_LOG_DIR)
+    args = parser.parse_args(argv)
+
+    day = datetime.strptime(args.day, "%Y-%m-%d").date()
+    t1 = time.perf_counter()
+    rebuilt = rebuild_day(day, args.interval, args.symbols, root=args.root)
+    elapsed = time.perf_counter() - t1
+    print(f"✓ Rebuilt {sum(rebuilt.values())} bars for {len(rebuilt)} symbols in {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import os
+import glob
+import threading
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from dotenv import load_dotenv
+from healper import _date_col, _merge_frames, _ns, _ns_array, _as_datetime
+
+load_dotenv()
+HISTORY_STORE_DIR = os.getenv("HISTORY_STORE_DIR", "history")
+# download_histD, run_ws and calculate_historical mirror their writes here when set
+HISTORY_STORE = os.getenv("HISTORY_STORE") == "1"
+HISTORY_TAIL_SEGMENTS = int(os.getenv("HISTORY_TAIL_SEGMENTS", "64"))
+
+
+class HistoryStore:
+    """
+    Arrow IPC files at {root}/{key}/{symbol}/{YYYY-MM}.arrow, one per month.
+
+    Each file is uncompressed and holds a single record batch sorted by date,
+    so reads memory-map it and numeric columns reach NumPy without a copy.
+
+    Bars newer than everything in their month are appended to a tail file
+    next to it ({YYYY-MM}.tail.arrows, one IPC stream per write) and folded
+    into the month file on compaction: after HISTORY_TAIL_SEGMENTS appends,
+    when a later month starts, or when a write amends an older bar.
+    """
+
+    def __init__(self, root=HISTORY_STORE_DIR, tail_segments=HISTORY_TAIL_SEGMENTS):
+        self.root = root
+        self.tail_segments = tail_segments
+        self.locks = defaultdict(threading.RLock)
+        # (key, symbol) -> {month: [tail segments, last date ns]}
+        self.state = {}
+
+    def _dir(self, key, symbol):
+        return os.path.join(self.root, key, symbol)
+
+    def _path(self, key, symbol, month):
+        return os.path.join(self._dir(key, symbol), f"{month}.arrow")
+
+    def _tail_path(self, key, symbol, month):
+        return os.path.join(self._dir(key, symbol), f"{month}.tail.arrows")
+
+    def months(self, key, symbol):
+        files = glob.glob(os.path.join(self._dir(key, symbol), "*.arrow*"))
+        return sorted({os.path.basename(f)[:len("YYYY-MM")] for f in files})
+
+    def symbols(self, key):
+        base = os.path.join(self.root, key)
+        return sorted(os.listdir(base)) if os.path.isdir(base) else []
+
+    def _open(self, path, columns=None):
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        return table.select(columns) if columns else table
+
+    def _open_tail(self, path):
+        source = pa.memory_map(path, 'r')
+        segments = []
+        while source.tell() < source.size():
+            segments.append(pa.ipc.open_stream(source).read_all())
+        return segments
+
+    def _write_month(self, path, df):
+        table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+        tmp = path + ".tmp"
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=max(len(table), 1))
+        os.replace(tmp, path)
+
+    def _append_tail(self, path, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with open(path, 'ab') as sink:
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def _month_table(self, key, symbol, month):
+        """The month file with its tail folded in, as one single-chunk table."""
+        path, tail = self._path(key, symbol, month), self._tail_path(key, symbol, month)
+        with self.locks[(key, symbol)]:
+            base = self._open(path) if os.path.exists(path) else None
+            segments = self._open_tail(tail) if os.path.exists(tail) else []
+        if not segments:
+            return base
+        tables = ([base] if base is not None else []) + segments
+        date_col = _date_col(pd.DataFrame(columns=tables[0].column_names))
+        if all(t.schema.equals(tables[0].schema) for t in tables):
+            table = pa.concat_tables(tables).combine_chunks()
+            if date_col is None or self._increasing(table.column(date_col)):
+                return table
+        # Differing dtypes, or rows another process appended out of order
+        merged = _merge_frames([t.to_pandas() for t in tables])
+        return pa.Table.from_pandas(merged, preserve_index=False).combine_chunks()
+
+    @staticmethod
+    def _increasing(dates):
+        ns = dates.to_numpy().astype('datetime64[ns]').astype('int64')
+        return bool(np.all(ns[1:] > ns[:-1]))
+
+    def _months_state(self, key, symbol):
+        state = self.state.get((key, symbol))
+        if state is None:
+            # Tails left by an earlier process are counted once, then tracked here
+            state = self.state[(key, symbol)] = {}
+            for path in glob.glob(os.path.join(self._dir(key, symbol), "*.tail.arrows")):
+                month = os.path.basename(path)[:len("YYYY-MM")]
+                state[month] = [len(self._open_tail(path)), None]
+        return state
+
+    def _last_ns(self, key, symbol, month, entry):
+        if entry[1] is None:
+            table = self._month_table(key, symbol, month)
+            date_col = _date_col(pd.DataFrame(columns=table.column_names)) if table is not None else None
+            if date_col is not None and len(table):
+                dates = table.column(date_col).to_numpy().astype('datetime64[ns]').astype('int64')
+                entry[1] = int(dates.max())
+        return entry[1]
+
+    def _compact_month(self, key, symbol, month, df=None):
+        table = self._month_table(key, symbol, month)
+        parts = [table.to_pandas()] if table is not None else []
+        if df is not None:
+            parts.append(df)
+        merged = _merge_frames(parts)
+        date_col = _date_col(merged)
+        merged = merged.sort_values(date_col, kind='stable').reset_index(drop=True)
+        self._write_month(self._path(key, symbol, month), merged)
+        tail = self._tail_path(key, symbol, month)
+        if os.path.exists(tail):
+            os.remove(tail)
+        self._months_state(key, symbol)[month] = [0, int(_ns_array(merged[date_col]).max())]
+
+    def compact(self, key, symbol, before=None):
+        """Fold every tail (only months before `before`, if given) into its month file."""
+        state = self._months_state(key, symbol)
+        with self.locks[(key, symbol)]:
+            months = [m for m, (segments, _) in state.items() if segments and (before is None or m < before)]
+            for month in sorted(months):
+                self._compact_month(key, symbol, month)
+        return len(months)
+
+    def write(self, key, symbol, df):
+        """
+        Add rows to their months; rows with an existing date replace it.
+
+        Bars after the month's last date go to its tail file. Anything else
+        (a new month, a late amendment, an overlapping re-save) rewrites the month.
+        """
+        if df is None or df.empty:
+            return 0
+        date_col = _date_col(df)
+        if date_col is None:
+            raise ValueError(f"{key}:{symbol} has no date column")
+        df = df.reset_index(drop=True)
+        df[date_col] = _as_datetime(df[date_col])
+        # Partitions follow the bars' own wall-clock month
+        months = df[date_col].dt.strftime('%Y-%m')
+        os.makedirs(self._dir(key, symbol), exist_ok=True)
+        state = self._months_state(key, symbol)
+        with self.locks[(key, symbol)]:
+            # A live bar is one row in one month; skip the grouping and sorting
+            parts = [(months.iloc[0], df)] if len(df) == 1 else df.groupby(months.values, sort=True)
+            for month, part in parts:
+                if len(part) > 1:
+                    part = part.drop_duplicates(subset=[date_col], keep='last')
+                    part = part.sort_values(date_col, kind='stable').reset_index(drop=True)
+                entry = state.setdefault(month, [0, None])
+                last = self._last_ns(key, symbol, month, entry)
+                dates = _ns_array(part[date_col])
+                if last is None or dates[0] <= last:
+                    self._compact_month(key, symbol, month, part)
+                    continue
+                self._append_tail(self._tail_path(key, symbol, month), part)
+                entry[0], entry[1] = entry[0] + 1, int(dates[-1])
+                if entry[0] >= self.tail_segments:
+                    self._compact_month(key, symbol, month)
+            # A month that is over takes no more appends
+            self.compact(key, symbol, before=months.max())
+        return len(df)
+
+    def _month_range(self, key, symbol, start, end):
+        months = self.months(key, symbol)
+        # A day of slack either side covers bars stored in another timezone
+        if start is not None:
+            first = (pd.Timestamp(start) - pd.Timedelta(days=1)).strftime('%Y-%m')
+            months = [m for m in months if m >= first]
+        if end is not None:
+            last = (pd.Timestamp(end) + pd.Timedelta(days=1)).strftime('%Y-%m')
+            months = [m for m in months if m <= last]
+        return months
+
+    def _tables(self, key, symbol, start=None, end=None, columns=None):
+        for month in self._month_range(key, symbol, start, end):
+            table = self._month_table(key, symbol, month)
+            if table is None:
+                continue
+            date_col = _date_col(pd.DataFrame(columns=table.column_names))
+            if date_col is not None and (start is not None or end is not None):
+                dates = table.column(date_col).chunk(0).to_numpy().astype('datetime64[ns]').astype('int64')
+                lo = np.searchsorted(dates, _ns(start), 'left') if start is not None else 0
+                hi = np.searchsorted(dates, _ns(end), 'left') if end is not None else len(dates)
+                table = table.slice(lo, max(hi - lo, 0))
+            if columns:
+                table = table.select(columns)
+            if len(table):
+                yield month, table
+
+    def read(self, key, symbol, start=None, end=None, columns=None):
+        """Rows in [start, end) as a pyarrow Table backed by the mapped files."""
+        tables = [table for _, table in self._tables(key, symbol, start, end, columns)]
+        return pa.concat_tables(tables) if tables else None
+
+    def read_frame(self, key, symbol, start=None, end=None, columns=None):
+        table = self.read(key, symbol, start, end, columns)
+        return table.to_pandas() if table is not None else None
+
+    def scan(self, key, symbol, columns=None, start=None, end=None):
+        """Yield (month, {column: ndarray}) per partition; numeric columns are views of the mapped file."""
+        for month, table in self._tables(key, symbol, start, end, columns):
+            yield month, {name: table.column(name).chunk(0).to_numpy(zero_copy_only=False)
+                          for name in table.column_names}
+
+    def read_arrays(self, key, symbol, columns=None, start=None, end=None):
+        """Whole range as one ndarray per column; copies only when it spans several months."""
+        parts = [arrays for _, arrays in self.scan(key, symbol, columns, start, end)]
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = HistoryStore()
+    return _store
+
+def store_write(key, symbol, data):
+    """Mirror rows into the disk store when HISTORY_STORE is on; never raises."""
+    if not HISTORY_STORE:
+        return
+    try:
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        get_store().write(key, symbol, df)
+    except Exception as e:
+        print(f"❌ History store write failed for {key}:{symbol}: {e}")
@@ -1,71 +1,402 @@
 import pandas as pd, io
+import json
 import time
+import redis
+import numpy as np
+import pyarrow as pa
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 load_dotenv()
 hist_intv=os.getenv("hist_intv")
 
+# Append-only layout: "{key}:{symbol}" holds the compacted base blob and
+# "tail:{key}:{symbol}" is a Redis list of feather segments with the rows
+# written since the last compaction. Readers stitch both together.
+COMPACT_SEGMENTS = int(os.getenv("COMPACT_SEGMENTS", "32"))
+COMPACT_INTERVAL = float(os.getenv("COMPACT_INTERVAL", "30"))
+# Every write bumps meta "version"; an append that replaces rows before the
+# previous last bar also bumps "revision", so readers that keep derived copies
+# (aqi_write) know when appending is not enough.
+# The base blob is written as record batches of INDEX_CHUNK_ROWS rows so range
+# reads can GETRANGE just the batches they need.
+INDEX_CHUNK_ROWS = int(os.getenv("INDEX_CHUNK_ROWS", "2048"))
+DATE_COLS = ['datetime', 'timestamp', 'date']
+FEATHER_MAGIC_LEN = 8
+# Codec for blobs and tail segments per key family: "uncompressed", "lz4" or
+# "zstd" with an optional level ("zstd:3"). Readers detect it from the file.
+FEATHER_CODEC = os.getenv("FEATHER_CODEC", "lz4")
+FEATHER_CODECS = {
+    'historical': os.getenv("HISTORICAL_CODEC", FEATHER_CODEC),
+    'spreads': os.getenv("SPREADS_CODEC", FEATHER_CODEC),
+}
+# Timezone bar dates are compared in; naive dates are read as its wall clock
+HISTORY_TZ = os.getenv("HISTORY_TZ", "Asia/Kolkata")
+
+def tail_key(key, symbol):
+    return f"tail:{key}:{symbol}"
+
+def meta_key(key, symbol):
+    return f"meta:{key}:{symbol}"
+
+def _date_col(df):
+    return next((col for col in DATE_COLS if col in df.columns), None)
+
+def _str(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def _ts(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize(HISTORY_TZ) if ts.tz is None else ts
+
+def _ns(ts):
+    return _ts(ts).value
+
+def _as_datetime(dates):
+    """Dates as HISTORY_TZ timestamps, so naive and tz-aware sources compare alike."""
+    # to_datetime walks every element of an already-parsed tz-aware column
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        # Fixed +05:30 candles and Asia/Kolkata bars only parse together through UTC
+        first = next(iter(dates), None)
+        dates = pd.to_datetime(dates, utc=first is not None and pd.Timestamp(first).tz is not None)
+    values = dates.dt if isinstance(dates, pd.Series) else dates
+    if values.tz is None:
+        return values.tz_localize(HISTORY_TZ)
+    if str(values.tz) != HISTORY_TZ:
+        return values.tz_convert(HISTORY_TZ)
+    return dates
+
+def _normalize_dates(df):
+    """df with its date column in HISTORY_TZ; naive and tz-aware sources are never stored side by side."""
+    date_col = _date_col(df)
+    if date_col is None:
+        return df
+    dates = _as_datetime(df[date_col])
+    return df if dates is df[date_col] else df.assign(**{date_col: dates})
+
+def _ns_array(dates):
+    return _as_datetime(dates).to_numpy(dtype='datetime64[ns]').astype('int64')
+
+def codec_for(key):
+    return FEATHER_CODECS.get(key, FEATHER_CODEC)
+
+_codec_cache = {}
+
+def _ipc_options(codec):
+    """IpcWriteOptions for a codec spec; unavailable codecs fall back to uncompressed."""
+    if codec not in _codec_cache:
+        name, _, level = (codec or "uncompressed").partition(":")
+        compression = None
+        if name != "uncompressed":
+            try:
+                compression = pa.Codec(name, compression_level=int(level) if level else None)
+            except (ValueError, NotImplementedError, pa.ArrowException) as e:
+                print(f"⚠️ Codec {codec} unusable ({e}), writing uncompressed")
+        _codec_cache[codec] = pa.ipc.IpcWriteOptions(compression=compression)
+    return _codec_cache[codec]
+
+def _to_feather_bytes(df, codec="uncompressed"):
+    return _table_bytes(pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False), codec)
+
+def _table_bytes(table, codec="uncompressed"):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema, options=_ipc_options(codec)) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _merge_frames(frames):
+    # Rows stored before dates were normalized can still be naive
+    frames = [_normalize_dates(f) for f in frames if f is not None]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    combined_df = pd.concat(frames, ignore_index=True)
+    date_col = _date_col(combined_df)
+    merged = combined_df.drop_duplicates(subset=[date_col] if date_col else None, keep='last')
+    if date_col and not merged[date_col].is_monotonic_increasing:
+        # A replaced older bar (late ticks, rollups) lands at its date, not at the end
+        merged = merged.sort_values(date_col, kind='stable')
+    return merged.reset_index(drop=True)
+
+def _merge_segments(base_bytes, segments):
+    blobs = ([base_bytes] if base_bytes else []) + list(segments)
+    return _merge_frames([pd.read_feather(io.BytesIO(b)) for b in blobs])
+
+def _encode_base(df, codec=FEATHER_CODEC):
+    # Same bytes as to_feather, but we record where every record batch ends
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    ends, rows = [], []
+    with pa.ipc.new_file(sink, table.schema, options=_ipc_options(codec)) as writer:
+        for batch in table.to_batches(max_chunksize=INDEX_CHUNK_ROWS):
+            writer.write_batch(batch)
+            ends.append(sink.tell())
+            rows.append(batch.num_rows)
+    blob = sink.getvalue()
+
+    date_col = _date_col(df)
+    if date_col is None or not rows:
+        return blob.to_pybytes(), None
+    reader = pa.BufferReader(blob)
+    reader.seek(FEATHER_MAGIC_LEN)
+    pa.ipc.read_message(reader)
+    dates = _ns_array(df[date_col])
+    if not (np.diff(dates) >= 0).all():
+        return blob.to_pybytes(), None
+    index = {
+        'offsets': [reader.tell()] + ends,
+        'rows': rows,
+        'starts': [int(v) for v in dates[np.cumsum([0] + rows[:-1])]],
+    }
+    return blob.to_pybytes(), index
+
+def _meta_fields(df):
+    fields = {'rows': len(df)}
+    if len(df):
+        # One-row blobs are left uncompressed, a codec only adds overhead there
+        fields['last'] = _to_feather_bytes(df.tail(1))
+    date_col = _date_col(df)
+    if date_col is not None and len(df):
+        dates = _as_datetime(df[date_col])
+        fields['first_ts'] = str(dates.min())
+        fields['last_ts'] = str(dates.iloc[-1])
+    return fields
+
+def write_base_to_redis(pipe, symbol, key, df):
+    """Queue a full base rewrite plus its metadata on a MULTI pipeline."""
+    df = _normalize_dates(df)
+    blob, index = _encode_base(df, codec_for(key))
+    meta = meta_key(key, symbol)
+    fields = _meta_fields(df)
+    fields['base_len'] = len(blob)
+    pipe.set(f"{key}:{symbol}", blob)
+    pipe.hdel(meta, 'index', 'first_ts', 'last_ts', 'last')
+    if index is not None:
+        fields['index'] = json.dumps(index)
+    pipe.hset(meta, mapping=fields)
+    pipe.hincrby(meta, 'version', 1)
+
+def _appended_meta(new_df, rows, first_ts, last_ts):
+    """Sidecar fields after appending new_df, and whether it rewrites earlier history."""
+    rows = int(rows or 0)
+    date_col = _date_col(new_df)
+    if date_col is None:
+        return {'rows': rows + len(new_df), 'last': _to_feather_bytes(new_df.tail(1))}, True
+
+    dates = _ns_array(new_df[date_col])
+    last_ns = _ns(_str(last_ts)) if last_ts else None
+    first_ns = _ns(_str(first_ts)) if first_ts else None
+    fields = {'rows': rows + int(np.unique(dates if last_ns is None else dates[dates > last_ns]).size)}
+    revised = last_ns is not None and bool((dates < last_ns).any())
+
+    pos = len(dates) - 1 - int(np.argmax(dates[::-1]))
+    if last_ns is None or dates[pos] >= last_ns:
+        fields['last'] = _to_feather_bytes(new_df.iloc[[pos]])
+        fields['last_ts'] = str(_as_datetime(new_df[date_col]).iloc[pos])
+    first = int(np.argmin(dates))
+    if first_ns is None or dates[first] < first_ns:
+        fields['first_ts'] = str(_as_datetime(new_df[date_col]).iloc[first])
+    return fields, revised
+
+def append_feather_to_redis(redis_conn, symbol, new_df, key, extra_meta=None):
+    """Append new_df as a tail segment; extra_meta fields go into the sidecar in the same transaction."""
+    if new_df is None or new_df.empty:
+        return
+    new_df = _normalize_dates(new_df.reset_index(drop=True))
+    segment = _to_feather_bytes(new_df, codec_for(key))
+    meta = meta_key(key, symbol)
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(meta)
+                rows, first_ts, last_ts = pipe.hmget(meta, 'rows', 'first_ts', 'last_ts')
+                if rows is None and pipe.exists(f"{key}:{symbol}", tail_key(key, symbol)):
+                    # Data written before the sidecar existed: build it once
+                    pipe.unwatch()
+                    compact_feather_in_redis(redis_conn, symbol, key, force=True)
+                    continue
+                fields, revised = _appended_meta(new_df, rows, first_ts, last_ts)
+                fields.update(extra_meta or {})
+                pipe.multi()
+                pipe.rpush(tail_key(key, symbol), segment)
+                pipe.hset(meta, mapping=fields)
+                pipe.hincrby(meta, 'version', 1)
+                if revised:
+                    pipe.hincrby(meta, 'revision', 1)
+                pipe.execute()
+                return
+            except redis.WatchError:
+                continue
+
 def write_feather_to_redis(redis_conn, symbol, data, key, live, spreads):
-    key = f"{key}:{symbol}"
     new_df = pd.DataFrame(data)
-    
-    if redis_conn.exists(key):
-        existing_bytes = redis_conn.get(key)
-        if existing_bytes:
-            existing_df = pd.read_feather(io.BytesIO(existing_bytes))
-            combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-            
-            date_col = next((col for col in ['datetime', 'timestamp', 'date'] if col in combined_df.columns), None)
-            combined_df = combined_df.drop_duplicates(subset=[date_col] if date_col else None, keep='last').reset_index(drop=True)
-        else:
-            combined_df = new_df
-    else:
-        combined_df = new_df
-    
-    # print("combined_df", combined_df)
-    buffer = io.BytesIO()
-    combined_df.to_feather(buffer)
-    redis_conn.set(key, buffer.getvalue())
+    append_feather_to_redis(redis_conn, symbol, new_df, key)
 
 def live_feather_to_redis(redis_conn, symbol, data, key, live, spreads):
-    key = f"{key}:{symbol}"
     if live == True:
-        new_df = pd.DataFrame(data['data']) 
-    
-    if redis_conn.exists(key):
-        existing_bytes = redis_conn.get(key)
-        if existing_bytes:
-            existing_df = pd.read_feather(io.BytesIO(existing_bytes))
-            combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-            
-            date_col = next((col for col in ['datetime', 'timestamp', 'date'] if col in combined_df.columns), None)
-            combined_df = combined_df.drop_duplicates(subset=[date_col] if date_col else None, keep='last').reset_index(drop=True)
-        else:
-            combined_df = new_df
+        new_df = pd.DataFrame(data['data'])
     else:
-        combined_df = new_df
-        
-    buffer = io.BytesIO()
-    combined_df.to_feather(buffer)
-    redis_conn.set(key, buffer.getvalue())
-    
+        new_df = pd.DataFrame(data)
+    append_feather_to_redis(redis_conn, symbol, new_df, key)
+
+def compact_feather_in_redis(redis_conn, symbol, key, force=False):
+    base = f"{key}:{symbol}"
+    tail = tail_key(key, symbol)
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                # Appends touch the sidecar, so watching it catches them too
+                pipe.watch(base, meta_key(key, symbol))
+                segments = pipe.lrange(tail, 0, -1)
+                base_bytes = pipe.get(base)
+                if not segments and not (force and base_bytes):
+                    pipe.unwatch()
+                    return False
+                combined_df = _merge_segments(base_bytes, segments)
+                pipe.multi()
+                write_base_to_redis(pipe, symbol, key, combined_df)
+                pipe.ltrim(tail, len(segments), -1)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+def compact_all(redis_conn, key, min_segments=COMPACT_SEGMENTS):
+    compacted = 0
+    prefix = tail_key(key, "")
+    for full_key in redis_conn.scan_iter(match=f"{prefix}*", count=1000):
+        full_key = _str(full_key)
+        if redis_conn.llen(full_key) >= min_segments:
+            compact_feather_in_redis(redis_conn, full_key[len(prefix):], key)
+            compacted += 1
+    return compacted
+
+def compaction_loop(redis_conn, keys=("historical", "spreads"), interval=COMPACT_INTERVAL):
+    while True:
+        for key in keys:
+            try:
+                compact_all(redis_conn, key)
+            except Exception as e:
+                print(f"❌ Compaction error for {key}: {e}")
+        time.sleep(interval)
+
+def read_meta(redis_conn, symbol, key):
+    """Row count and first/last timestamps from the sidecar, without touching the blob."""
+    meta = meta_key(key, symbol)
+    rows, first_ts, last_ts = redis_conn.hmget(meta, 'rows', 'first_ts', 'last_ts')
+    if rows is None and compact_feather_in_redis(redis_conn, symbol, key, force=True):
+        rows, first_ts, last_ts = redis_conn.hmget(meta, 'rows', 'first_ts', 'last_ts')
+    if rows is None:
+        return None
+    return {
+        'rows': int(rows),
+        'first_ts': _ts(_str(first_ts)) if first_ts else None,
+        'last_ts': _ts(_str(last_ts)) if last_ts else None,
+    }
+
+def ensure_meta(redis_conn, entries):
+    """
+    Row counts for (symbol, key) entries in one pipeline, as {entry: rows}.
+
+    Data written before the sidecar existed gets it built here, once.
+    """
+    entries = list(entries)
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for symbol, key in entries:
+            pipe.hget(meta_key(key, symbol), 'rows')
+        rows = pipe.execute() if entries else []
+    counts = {}
+    for (symbol, key), n in zip(entries, rows):
+        if n is None:
+            meta = read_meta(redis_conn, symbol, key)
+            n = meta['rows'] if meta else 0
+        counts[(symbol, key)] = int(n)
+    return counts
+
+def read_last_row(redis_conn, symbol, key):
+    meta = meta_key(key, symbol)
+    last = redis_conn.hget(meta, 'last')
+    if last is None and compact_feather_in_redis(redis_conn, symbol, key, force=True):
+        last = redis_conn.hget(meta, 'last')
+    if last is None:
+        return None
+    return pd.read_feather(io.BytesIO(last)).iloc[-1]
+
+def _select_batches(index, start, end, lookback):
+    starts, rows = index['starts'], index['rows']
+    first = 0
+    if start is not None:
+        first = max(bisect_right(starts, _ns(start)) - 1, 0)
+        need = lookback
+        while first > 0 and need > 0:
+            first -= 1
+            need -= rows[first]
+    last = len(starts) if end is None else bisect_left(starts, _ns(end))
+    return first, max(last, first)
+
+def _slice_range(df, start, end, lookback):
+    date_col = _date_col(df)
+    if date_col is None:
+        return df
+    dates = _as_datetime(df[date_col])
+    start = _ts(start) if start is not None else None
+    end = _ts(end) if end is not None else None
+    if end is not None:
+        df, dates = df[dates < end], dates[dates < end]
+    if start is None:
+        return df.reset_index(drop=True)
+    lookback_df = df[dates < start].tail(lookback) if lookback else df.iloc[:0]
+    return pd.concat([lookback_df, df[dates >= start]]).reset_index(drop=True)
+
+def read_range_from_redis(redis_conn, symbol, key, start=None, end=None, lookback=0):
+    """Rows in [start, end) plus `lookback` rows before start, decoding only the batches involved."""
+    if start is None and end is None:
+        return read_feather_from_redis(redis_conn, symbol, key)
+    base = f"{key}:{symbol}"
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(base)
+                index, base_len = pipe.hmget(meta_key(key, symbol), 'index', 'base_len')
+                if index is None or base_len is None or pipe.strlen(base) != int(base_len):
+                    pipe.unwatch()
+                    df = read_feather_from_redis(redis_conn, symbol, key)
+                    break
+                index = json.loads(index)
+                first, last = _select_batches(index, start, end, lookback)
+                offsets = index['offsets']
+                pipe.multi()
+                pipe.lrange(tail_key(key, symbol), 0, -1)
+                # The schema alone still decodes, to an empty frame
+                pipe.getrange(base, FEATHER_MAGIC_LEN, offsets[0] - 1)
+                if first < last:
+                    pipe.getrange(base, offsets[first], offsets[last] - 1)
+                replies = pipe.execute()
+                stream = pa.py_buffer(b"".join(replies[1:]))
+                frames = [pa.ipc.open_stream(stream).read_all().to_pandas()]
+                frames += [pd.read_feather(io.BytesIO(b)) for b in replies[0]]
+                df = _merge_frames(frames)
+                break
+            except redis.WatchError:
+                continue
+    if df is None:
+        return None
+    return _slice_range(df, start, end, lookback)
 
 def read_feather_from_redis(redis_conn, symbol, key, lr=False):
+    if lr:
+        return read_last_row(redis_conn, symbol, key)
+
     t1 = time.perf_counter()
-    feather_bytes = redis_conn.get(f"{key}:{symbol}")
-    if feather_bytes is None:
-        return None
-    buffer = io.BytesIO(feather_bytes)
-    df = pd.read_feather(buffer)
+    with redis_conn.pipeline() as pipe:
+        pipe.get(f"{key}:{symbol}")
+        pipe.lrange(tail_key(key, symbol), 0, -1)
+        feather_bytes, segments = pipe.execute()
+    df = _merge_segments(feather_bytes, segments)
     t2 = time.perf_counter()
 
     # print(f"Redis READ for {symbol}: {t2-t1:.6f} seconds")
 
-    if lr:
-        if len(df) == 0:
-            print(f"No Data found for this symbol {symbol}")
-            return None
-        return df.iloc[-1]
-    else:
-        return df
+    return df
@@ -9,15 +9,20 @@ import pandas as pd, io
 from data.auth import auth_run
 from data.crypto import crypto_historical_data, crypto_websocket_connect
 from data.data import get_historical_data, websocket
+from data.backfill import backfill
 import os
 from dotenv import load_dotenv
 from config import RedisConnection
-from healper import write_feather_to_redis, read_feather_from_redis, live_feather_to_redis
-from rm import monitor_process_usage
-from spreads.spreads import calculate_historical, live_Spreads_loop
+from healper import write_feather_to_redis, read_feather_from_redis, live_feather_to_redis, compaction_loop
+from rm import Supervisor
+from spreads.spreads import calculate_historical, live_Spreads_loop, live_spread_engine
 from aqi_write import aqi_write
+from redis_to_db import archive_loop
+from disk_store import store_write
+from metrics import timed, serve_metrics, METRICS_PORT
 import multiprocessing as mp
-from data.aggregator import CandleAggregator
+from data.aggregator import CandleAggregator, IST
+from rollup import update_rollups, rollup_keys
 load_dotenv()
 redis_conn = RedisConnection.get_instance()
 
@@ -27,26 +32,54 @@ symbols = pd.read_csv("pair.csv")['pair'].str.split('_').explode().unique().toli
 
 num = int(re.findall(r'\d+', hist_intv)[0])
 aggregator = CandleAggregator(interval_minutes=num)
+# run_ws announces closed bars here; live_loop recomputes spreads on each message
+BAR_CLOSE_CHANNEL = os.getenv("BAR_CLOSE_CHANNEL", "bars_closed")
 
 def download_histD(symbols, exchange):
     print("Data Downloader")
+    starts = {}
     for sym in symbols:
         df = read_feather_from_redis(redis_conn, sym, key="historical", lr=True)
         if df is not None:
-            start = pd.to_datetime(df.iloc[0])
+            starts[sym] = pd.to_datetime(df.iloc[0])
         else:
-            start = datetime.strptime(data_startD, "%Y-%m-%d %H:%M")
-        final_end = datetime.now()
-        if exchange == "nse":
-            data = get_historical_data(sym, start, final_end, interval=hist_intv)
-        else:
-            data = crypto_historical_data(sym, start, final_end, interval=hist_intv)
-            # print("data", data)
+            starts[sym] = datetime.strptime(data_startD, "%Y-%m-%d %H:%M")
+    final_end = datetime.now(IST)
+    for sym, data in backfill(symbols, exchange, starts, final_end, interval=hist_intv):
+        # print("data", data)
         write_feather_to_redis(redis_conn, sym, data, key="historical", live=False, spreads=True)
+        store_write("historical", sym, data)
+        update_rollups(redis_conn, sym, "historical", data)
     print("Data Downloader Complete")
 
 def on_tick(symbol, tick):
-    aggregator.process_tick(symbol, tick)
+    with timed("tick_callback"):
+        aggregator.process_tick(symbol, tick)
+
+def write_closed_bars(symbols):
+    """Write the bars the aggregator closed for `symbols` and announce them; returns {sym: rows}."""
+    last_date = None
+    written = {}
+    for sym in symbols:
+        with timed("candle_flush"):
+            candle = aggregator.get_candle(sym)
+            if not candle['data']:
+                continue
+            live_feather_to_redis(redis_conn, sym, candle, key="historical", live=True, spreads=True)
+            store_write("historical", sym, candle['data'])
+            written[sym] = candle['data']
+            date = candle['data'][-1]['date']
+            last_date = date if last_date is None else max(last_date, date)
+        # print("candle for sym",sym, candle)
+    if last_date is not None:
+        redis_conn.publish(BAR_CLOSE_CHANNEL, last_date.isoformat())
+    return written
+
+def rollup_closed_bars(written):
+    # Higher timeframes after the announcement, so spreads don't wait on them
+    for sym, rows in written.items():
+        with timed("rollup"):
+            update_rollups(redis_conn, sym, "historical", rows)
 
 def run_ws(symbols, exchange):
     if isinstance(symbols, str):
@@ -61,36 +94,31 @@ def run_ws(symbols, exchange):
     # live_Spreads = threading.Thread(target=live_Spreads_loop, daemon=True, name="LiveSpreads")
     # live_Spreads.start()
     
-    interval_minutes = int(''.join(filter(str.isdigit, os.getenv("hist_intv", "5"))))
+    # Bars close when the tick watermark passes their end, not on a wall-clock timer
+    dropped = 0
     while True:
-        now = datetime.now()
-        next_minute = (now.minute // interval_minutes + 1) * interval_minutes
-        next_time = now.replace(second=0, microsecond=0)
-        if next_minute >= 60:
-            next_time = next_time.replace(minute=0) + timedelta(hours=1)
-        else:
-            next_time = next_time.replace(minute=next_minute)
-        wait_seconds = (next_time - now).total_seconds()
-        print("remain time to update ", int(wait_seconds))
-        time.sleep(wait_seconds)
+        if not aggregator.wait_closed(timeout=1.0):
+            continue
         start_time = datetime.now()
-        for sym in symbols:
-            candle = aggregator.get_candle(sym)
-            live_feather_to_redis(redis_conn, sym, candle, key="historical", live=True, spreads=True)
-            # print("candle for sym",sym, candle)
+        rollup_closed_bars(write_closed_bars(symbols))
 
         end_time = datetime.now()
         elapsed_ms = (end_time - start_time).total_seconds() * 1000
         print(f"total time for candle Update: {elapsed_ms:.2f} ms")
+        if aggregator.dropped > dropped:
+            print(f"⚠️ {aggregator.dropped - dropped} ticks arrived after the allowed lateness and were dropped")
+            dropped = aggregator.dropped
 
 def live_loop():
-    interval_minutes = int(''.join(filter(str.isdigit, os.getenv("hist_intv", "5"))))
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(BAR_CLOSE_CHANNEL)
+    print(f"Waiting for closed bars on {BAR_CLOSE_CHANNEL}...")
     while True:
-        now = datetime.now()
-        next_run = (now.minute // interval_minutes + 1) * interval_minutes
-        wait_seconds = (next_run - now.minute) * 60 - now.second
-        print(f"Waiting {wait_seconds}s...")
-        time.sleep(wait_seconds + 5)
+        if pubsub.get_message(timeout=60) is None:
+            continue
+        # Bars announced while the last recompute ran are all covered by this one
+        while pubsub.get_message(timeout=0) is not None:
+            pass
         # t1 = time.perf_counter()
         # download_histD(symbols)
         # t2 = time.perf_counter()
@@ -101,17 +129,22 @@ if __name__ == "__main__":
     # auth_run()
     download_histD(symbols,"crypto")
     calculate_historical(loop=False)
-    p1 = mp.Process(target=run_ws, args=(symbols,"crypto",))
-    # p2 = mp.Process(target=aqi_write)
-    p3 = mp.Process(target=live_loop)
-    p1.start()
-    # p2.start()
-    p3.start()
-    allpid = {
-        "run_ws PID": p1.pid,
-        # "aqi_write PID": p2.pid,
-        "live_loop PID": p3.pid
-    }
-    # print("allpid", allpid)
-    monitor_process_usage(allpid)
+    # Children that die are restarted with backoff
+    supervisor = Supervisor()
+    supervisor.add("run_ws", run_ws, (symbols, "crypto"))
+    # supervisor.add("aqi_write", aqi_write)
+    supervisor.add("live_loop", live_loop)
+    if os.getenv("LIVE_SPREADS") == "1":
+        supervisor.add("live_spreads", live_spread_engine)
+    supervisor.start()
+    # print("allpid", supervisor.pids())
+    compactor = threading.Thread(target=compaction_loop, args=(redis_conn, ("historical", "spreads") + rollup_keys()),
+                                 daemon=True, name="Compaction")
+    compactor.start()
+    archiver = threading.Thread(target=archive_loop, args=(redis_conn,), daemon=True, name="Archiver")
+    archiver.start()
+    if METRICS_PORT:
+        # Process samples are served even when the stage histograms are off
+        serve_metrics(redis_conn, collectors=[supervisor.prometheus], routes={"/processes": supervisor.series_json})
+    supervisor.run()
 
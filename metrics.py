@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+METRICS = os.getenv("METRICS", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 disables the HTTP endpoint; the histograms are still collected in Redis
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_PUSH_SECONDS = float(os.getenv("METRICS_PUSH_SECONDS", "5"))
+METRICS_PREFIX = "metrics"
+METRICS_STAGES = f"{METRICS_PREFIX}:stages"
+# Bucket upper bounds in seconds; +Inf is implicit
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _empty():
+    return [[0] * (len(BUCKETS) + 1), 0.0]
+
+
+class Metrics:
+    """
+    Per-process latency histograms, pushed to Redis as deltas.
+
+    observe() only bumps in-memory counters. A background thread adds them to
+    the metrics:{stage} hashes every METRICS_PUSH_SECONDS with HINCRBY, so
+    every process (run_ws, live_loop, pool workers, ...) sums into the same
+    histogram and serve_metrics renders the total.
+    """
+
+    def __init__(self, push_seconds=METRICS_PUSH_SECONDS):
+        self.push_seconds = push_seconds
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.redis = None
+        self.pid = None
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = _empty()
+            hist[0][bisect_left(BUCKETS, seconds)] += 1
+            hist[1] += seconds
+        if self.pid != os.getpid():
+            self._start()
+
+    def _start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True, name="MetricsPush").start()
+
+    def _after_fork(self):
+        # A forked child must not push the parent's counts a second time
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.pid = None
+
+    def push(self):
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        if not stages:
+            return 0
+        if self.redis is None:
+            from config import RedisConnection
+            self.redis = RedisConnection.get_instance()
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                pipe.sadd(METRICS_STAGES, *stages)
+                for stage, (counts, total) in stages.items():
+                    name = f"{METRICS_PREFIX}:{stage}"
+                    for i, n in enumerate(counts):
+                        if n:
+                            pipe.hincrby(name, f"b{i}", n)
+                    pipe.hincrby(name, "count", sum(counts))
+                    pipe.hincrbyfloat(name, "sum", total)
+                pipe.execute()
+        except Exception as e:
+            # Keep the deltas for the next push
+            with self.lock:
+                for stage, (counts, total) in stages.items():
+                    hist = self.stages.setdefault(stage, _empty())
+                    hist[0] = [a + b for a, b in zip(hist[0], counts)]
+                    hist[1] += total
+            print(f"❌ Metrics push failed: {e}")
+            return 0
+        return len(stages)
+
+    def _run(self):
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(self.push_seconds)
+            self.push()
+
+
+metrics = Metrics()
+os.register_at_fork(after_in_child=metrics._after_fork)
+
+
+class timed:
+    """with timed("stage"): ... records the block's duration."""
+    __slots__ = ("stage", "t1")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t1 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.t1)
+        return False
+
+
+def observe(stage, seconds):
+    if METRICS:
+        metrics.observe(stage, seconds)
+
+def push_metrics():
+    """Push now; for short-lived processes such as pool workers."""
+    if METRICS:
+        metrics.push()
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def read_histograms(redis_conn):
+    """{stage: (bucket counts, sum, count)} summed over every process."""
+    stages = sorted(_decode(s) for s in redis_conn.smembers(METRICS_STAGES))
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for stage in stages:
+            pipe.hgetall(f"{METRICS_PREFIX}:{stage}")
+        hashes = pipe.execute()
+    out = {}
+    for stage, fields in zip(stages, hashes):
+        fields = {_decode(k): v for k, v in fields.items()}
+        counts = [int(fields.get(f"b{i}", 0)) for i in range(len(BUCKETS) + 1)]
+        out[stage] = (counts, float(fields.get("sum", 0)), int(fields.get("count", 0)))
+    return out
+
+def render_prometheus(histograms):
+    lines = [
+        "# HELP pipeline_stage_seconds Time spent per pipeline stage.",
+        "# TYPE pipeline_stage_seconds histogram",
+    ]
+    for stage, (counts, total, count) in histograms.items():
+        cumulative = 0
+        for le, n in zip(BUCKETS, counts):
+            cumulative += n
+            lines.append(f'pipeline_stage_seconds_bucket{{stage="{stage}",le="{le:g}"}} {cumulative}')
+        lines.append(f'pipeline_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'pipeline_stage_seconds_sum{{stage="{stage}"}} {total!r}')
+        lines.append(f'pipeline_stage_seconds_count{{stage="{stage}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(redis_conn, host=METRICS_HOST, port=METRICS_PORT, collectors=(), routes=None):
+    """
+    Serve GET /metrics in Prometheus text format from a daemon thread; returns the server.
+
+    Each collector returns more exposition text for /metrics. `routes` maps
+    other paths to callables returning a JSON string.
+    """
+    routes = routes or {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path not in ("/metrics", "/") and path not in routes:
+                self.send_error(404)
+                return
+            try:
+                if path in routes:
+                    body, content_type = routes[path]().encode(), "application/json"
+                else:
+                    # The serving process's own counts are included in the scrape
+                    push_metrics()
+                    text = render_prometheus(read_histograms(redis_conn))
+                    body = "".join([text] + [collect() for collect in collectors]).encode()
+                    content_type = "text/plain; version=0.0.4"
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="Metrics").start()
+    print(f"📈 Metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -1,92 +1,273 @@
 import pandas as pd
 import io
-import redis 
+import time
+import redis
 import os
 from dotenv import load_dotenv
 import sqlite3
+from pathlib import Path
 
 from config import RedisConnection
+from healper import compact_feather_in_redis, write_base_to_redis, read_meta, ensure_meta, read_last_row, read_range_from_redis, meta_key, tail_key
+from healper import _merge_segments, _date_col, _str, _ns, _ns_array, _as_datetime
 load_dotenv()
 hist_intv = os.getenv("hist_intv")
-redis_conn = RedisConnection.get_instance()
-
-def trim_to_last_n_rows_and_export_older(redis_conn, base_key, db_path='historical_data.db', n_rows=10000):
-    pattern = f"{base_key}:*"
-    all_keys = redis_conn.keys(pattern)
-    
-    if not all_keys:
-        print(f"No keys found matching pattern '{pattern}'")
+
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "historical_data.db")
+# Rows kept in Redis per key; older rows move to SQLite
+REDIS_ROW_BUDGET = int(os.getenv("REDIS_ROW_BUDGET", "10000"))
+# A key is trimmed once it is this fraction over budget, so appends don't trigger a trim each pass
+REDIS_ROW_SLACK = float(os.getenv("REDIS_ROW_SLACK", "0.1"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "60"))
+ARCHIVE_KEYS = ("historical", "spreads")
+COLD_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def cold_table(base_key):
+    return f"{base_key}_archive"
+
+def connect_archive(db_path=ARCHIVE_DB_PATH, keys=ARCHIVE_KEYS):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for base_key in keys:
+        # Dates are stored as UTC 'YYYY-MM-DD HH:MM:SS' so range filters compare as text
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {cold_table(base_key)} (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID
+        """)
+    if "historical" in keys:
+        _migrate_legacy_table(conn)
+    conn.commit()
+    return conn
+
+def connect_archive_readonly(db_path=ARCHIVE_DB_PATH):
+    # Readers take no write lock; the tables and the migration belong to the archiver
+    return sqlite3.connect(Path(os.path.abspath(db_path)).as_uri() + "?mode=ro", uri=True, timeout=30)
+
+def _migrate_legacy_table(conn):
+    # Rows appended by the old to_sql export, which had no key and may hold duplicates
+    legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='historical'").fetchone()
+    if legacy is None:
         return
-    
-    conn = sqlite3.connect(db_path)
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS historical (
-        symbol TEXT,
-        date date,
-        open REAL,
-        high REAL,
-        low REAL,
-        close REAL,
-        volume INTEGER
-    )
+    conn.execute(f"""
+    INSERT INTO {cold_table('historical')} (symbol, date, open, high, low, close, volume)
+    SELECT symbol, datetime(date), open, high, low, close, volume FROM historical WHERE datetime(date) IS NOT NULL
+    ON CONFLICT(symbol, date) DO NOTHING
+    """)
+    conn.execute("DROP TABLE historical")
+    print("✓ Migrated legacy 'historical' table into the keyed archive")
+
+def _utc_text(dates):
+    # Naive dates are HISTORY_TZ wall-clock time, as everywhere else
+    return _as_datetime(pd.Series(dates)).dt.tz_convert('UTC').dt.strftime('%Y-%m-%d %H:%M:%S')
+
+def _cold_rows(symbol, df):
+    date_col = _date_col(df)
+    volume = df['volume'] if 'volume' in df.columns else df.get('Volume', pd.Series(None, index=df.index))
+    columns = [df[col] for col in COLD_COLUMNS[:-1]] + [volume]
+    return list(zip([symbol] * len(df), _utc_text(df[date_col]), *(c.astype(float).tolist() for c in columns)))
+
+def archive_rows(conn, base_key, symbol, df):
+    """Upsert df into the cold table in one transaction."""
+    if df is None or df.empty:
+        return 0
+    rows = _cold_rows(symbol, df)
+    with conn:
+        conn.executemany(f"""
+        INSERT INTO {cold_table(base_key)} (symbol, date, open, high, low, close, volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(symbol, date) DO UPDATE SET
+            open=excluded.open, high=excluded.high, low=excluded.low,
+            close=excluded.close, volume=excluded.volume
+        """, rows)
+    return len(rows)
+
+def read_cold(symbol, base_key, start=None, end=None, lookback=0, db_path=ARCHIVE_DB_PATH, conn=None):
+    """Archived rows for symbol in [start, end) plus `lookback` rows before start, dates as UTC timestamps."""
+    table = cold_table(base_key)
+    sql = f"SELECT date, open, high, low, close, volume FROM {table} WHERE symbol = ?"
+    params = [symbol]
+    if start is not None:
+        sql += " AND date >= ?"
+        params.append(_utc_text(pd.Series([start])).iloc[0])
+    if end is not None:
+        sql += " AND date < ?"
+        params.append(_utc_text(pd.Series([end])).iloc[0])
+    sql += " ORDER BY date"
+    if lookback and start is not None:
+        # Both halves walk the (symbol, date) primary key
+        sql = f"""
+        SELECT * FROM (SELECT date, open, high, low, close, volume FROM {table}
+                       WHERE symbol = ? AND date < ? ORDER BY date DESC LIMIT ?)
+        UNION ALL SELECT * FROM ({sql})
+        ORDER BY date"""
+        params = [symbol, params[1], int(lookback)] + params
+    own = conn is None
+    conn = connect_archive_readonly(db_path) if own else conn
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is None:
+            # The archiver has not created the table yet
+            df = pd.DataFrame(columns=['date'] + COLD_COLUMNS)
+        else:
+            df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        if own:
+            conn.close()
+    df['date'] = pd.to_datetime(df['date'], utc=True)
+    return df
+
+def _cold_like_hot(cold, hot, symbol):
+    # Same column names, order and timezone as the Redis rows
+    date_col = _date_col(hot)
+    cold = cold.rename(columns={'date': date_col})
+    tz = hot[date_col].dt.tz
+    cold[date_col] = cold[date_col].dt.tz_convert(tz) if tz is not None else cold[date_col].dt.tz_localize(None)
+    if 'Volume' in hot.columns and 'volume' not in hot.columns:
+        cold = cold.rename(columns={'volume': 'Volume'})
+    if 'symbol' in hot.columns:
+        cold['symbol'] = symbol
+    return cold.reindex(columns=hot.columns)
+
+def read_history(redis_conn, symbol, base_key, start=None, end=None, lookback=0, db_path=ARCHIVE_DB_PATH):
     """
-    conn.execute(create_table_sql)
-    conn.commit()
-    
-    processed_count = 0
-    exported_rows = 0
-    for full_key in all_keys:
-        symbol = full_key.decode('utf-8').split(':')[-1] if isinstance(full_key, bytes) else full_key.split(':')[-1]
-        
-        feather_bytes = redis_conn.get(full_key)
-        if feather_bytes is None:
-            print(f"No data found for key: {full_key}")
-            continue
-        
-        buffer = io.BytesIO(feather_bytes)
-        try:
-            df = pd.read_feather(buffer)
-            print("df", df)
-            if 'date' in df.columns:
-                df['date'] = pd.to_datetime(df['date'])
-            else:
-                print(f"No 'date' column found for {symbol}, skipping.")
+    Rows for symbol in [start, end) plus `lookback` rows before start, across both tiers.
+
+    Whatever Redis still holds is served by a range read. The cold store is
+    queried only for the part of the request older than the first Redis row.
+    """
+    meta = read_meta(redis_conn, symbol, base_key)
+    hot = read_range_from_redis(redis_conn, symbol, base_key, start, end, lookback) if meta else None
+    if not os.path.exists(db_path):
+        return hot
+
+    hot_first = _ns(meta['first_ts']) if meta and meta['first_ts'] is not None else None
+    start_ns = _ns(start) if start is not None else None
+    cold_end = meta['first_ts'] if hot_first is not None else end
+    if end is not None and cold_end is not None and _ns(end) < _ns(cold_end):
+        cold_end = end
+
+    in_cold = hot_first is None or start_ns is None or start_ns < hot_first
+    short = 0
+    if start is not None and lookback:
+        before = 0
+        if hot is not None:
+            before = int((_ns_array(hot[_date_col(hot)]) < start_ns).sum())
+        short = max(lookback - before, 0)
+    if not in_cold and not short:
+        return hot
+
+    cold = read_cold(symbol, base_key, start if in_cold else cold_end, cold_end, lookback=short, db_path=db_path)
+    if cold.empty:
+        return hot
+    if hot is None:
+        if meta is None:
+            return cold
+        # Nothing in range is hot any more; the last row still gives the layout
+        hot = read_last_row(redis_conn, symbol, base_key).to_frame().T.infer_objects().iloc[:0]
+    return pd.concat([_cold_like_hot(cold, hot, symbol), hot], ignore_index=True)
+
+def trim_key(redis_conn, conn, base_key, symbol, n_rows=REDIS_ROW_BUDGET):
+    """
+    Move everything but the last n_rows of one key to SQLite.
+
+    Rows are upserted and committed before Redis is trimmed under WATCH, so a
+    concurrent append only causes a retry and re-archiving is harmless.
+    """
+    base = f"{base_key}:{symbol}"
+    tail = tail_key(base_key, symbol)
+    # Fold pending tail segments into the base blob before trimming it
+    compact_feather_in_redis(redis_conn, symbol, base_key)
+    with redis_conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(base, meta_key(base_key, symbol))
+                segments = pipe.lrange(tail, 0, -1)
+                df = _merge_segments(pipe.get(base), segments)
+                if df is None or len(df) <= n_rows or _date_col(df) is None:
+                    pipe.unwatch()
+                    return 0
+                older_df = df.iloc[:len(df) - n_rows]
+                recent_df = df.iloc[len(df) - n_rows:].reset_index(drop=True)
+                exported = archive_rows(conn, base_key, symbol, older_df)
+                pipe.multi()
+                write_base_to_redis(pipe, symbol, base_key, recent_df)
+                pipe.ltrim(tail, len(segments), -1)
+                pipe.execute()
+                return exported
+            except redis.WatchError:
                 continue
-        except Exception as e:
-            print(f"Error reading Feather for {full_key}: {e}")
-            continue
-        
-        original_len = len(df)
-        if original_len == 0:
-            print(f"No data rows for {symbol}, skipping.")
-            continue
-        
-        if original_len <= n_rows:
-            print(f"Data for {symbol} has {original_len} rows, less than or equal to {n_rows}, keeping as is.")
-            continue
-        
-        recent_df = df.iloc[-(n_rows):].reset_index(drop=True)
-        older_df = df.iloc[:(original_len - n_rows)].copy()
-        
-        recent_len = len(recent_df)
-        older_len = len(older_df)
-        
-        if older_len > 0:
-            older_df_export = older_df[['date', 'open', 'high', 'low', 'close', 'volume']].copy()
-            older_df_export['symbol'] = symbol
-            older_df_export.to_sql('historical', conn, if_exists='append', index=False)
-            exported_rows += older_len
-            print(f"Exported {older_len} older rows for {symbol} to SQLite.")
-        
-        buffer = io.BytesIO()
-        recent_df.to_feather(buffer)
-        redis_conn.set(full_key, buffer.getvalue())
-        print(f"Kept {recent_len} recent rows for {symbol} in Redis.")
-        
-        processed_count += 1
-        print(f"Processed {symbol}: from {original_len} to {recent_len} rows in Redis.")
-    
-    conn.close()
-    print(f"Operation completed. Processed {processed_count} symbols. Exported {exported_rows} total older rows to {db_path}.")
-
-trim_to_last_n_rows_and_export_older(redis_conn, "historical")
\ No newline at end of file
+
+class RedisArchiver:
+    """
+    Keeps every historical/spreads key within a row budget while the pipeline runs.
+
+    Each pass reads only the row counts from the meta sidecars. Keys over
+    budget * (1 + slack) are trimmed back to the budget. Their older rows are
+    upserted into the `{key}_archive` SQLite tables, keyed on (symbol, date).
+    """
+
+    def __init__(self, redis_conn, db_path=ARCHIVE_DB_PATH, keys=ARCHIVE_KEYS,
+                 n_rows=REDIS_ROW_BUDGET, slack=REDIS_ROW_SLACK):
+        self.redis = redis_conn
+        self.db_path = db_path
+        self.keys = keys
+        self.n_rows = n_rows
+        self.limit = int(n_rows * (1 + slack))
+        self.conn = None
+
+    def symbols(self, base_key):
+        prefix = meta_key(base_key, "")
+        found = {_str(k)[len(prefix):] for k in self.redis.scan_iter(match=f"{prefix}*", count=1000)}
+        # Keys written before the sidecar existed
+        found.update(_str(k)[len(base_key) + 1:] for k in self.redis.scan_iter(match=f"{base_key}:*", count=1000))
+        return sorted(found)
+
+    def over_budget(self, base_key):
+        rows = ensure_meta(self.redis, [(symbol, base_key) for symbol in self.symbols(base_key)])
+        return [symbol for (symbol, _), n in rows.items() if n > self.limit]
+
+    def run_once(self):
+        if self.conn is None:
+            self.conn = connect_archive(self.db_path, self.keys)
+        trimmed, exported = 0, 0
+        for base_key in self.keys:
+            for symbol in self.over_budget(base_key):
+                try:
+                    rows = trim_key(self.redis, self.conn, base_key, symbol, self.n_rows)
+                except Exception as e:
+                    print(f"❌ Archive error for {base_key}:{symbol}: {e}")
+                    continue
+                if rows:
+                    trimmed += 1
+                    exported += rows
+        if trimmed:
+            print(f"✓ Archived {exported} rows from {trimmed} keys to {self.db_path}")
+        return exported
+
+    def run(self, interval=ARCHIVE_INTERVAL):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Archive pass failed: {e}")
+            time.sleep(interval)
+
+def archive_loop(redis_conn, interval=ARCHIVE_INTERVAL):
+    RedisArchiver(redis_conn).run(interval)
+
+def trim_to_last_n_rows_and_export_older(redis_conn, base_key, db_path=ARCHIVE_DB_PATH, n_rows=REDIS_ROW_BUDGET):
+    archiver = RedisArchiver(redis_conn, db_path=db_path, keys=(base_key,), n_rows=n_rows, slack=0)
+    exported = archiver.run_once()
+    print(f"Operation completed. Exported {exported} total older rows to {db_path}.")
+
+if __name__ == "__main__":
+    trim_to_last_n_rows_and_export_older(RedisConnection.get_instance(), "historical")
@@ -1,37 +1,263 @@
-import psutil
+import os
+import json
 import time
+import psutil
+import numpy as np
+import multiprocessing as mp
 from datetime import datetime
+from dotenv import load_dotenv
 
-def monitor_process_usage(pid_dict):
-    while True:
-        timestamp = datetime.now().strftime("%H:%M:%S")
+load_dotenv()
+SUPERVISOR_INTERVAL = float(os.getenv("SUPERVISOR_INTERVAL", "10"))
+# Samples kept per process; 360 at 10s is the last hour
+SUPERVISOR_HISTORY = int(os.getenv("SUPERVISOR_HISTORY", "360"))
+SUPERVISOR_PRINT_EVERY = int(os.getenv("SUPERVISOR_PRINT_EVERY", "1"))
+# RSS rising faster than this over the window, on most samples, is flagged
+MEM_GROWTH_WINDOW = int(os.getenv("MEM_GROWTH_WINDOW", "30"))
+MEM_GROWTH_MB_PER_MIN = float(os.getenv("MEM_GROWTH_MB_PER_MIN", "5"))
+RESTART_BACKOFF_MIN = float(os.getenv("RESTART_BACKOFF_MIN", "1"))
+RESTART_BACKOFF_MAX = float(os.getenv("RESTART_BACKOFF_MAX", "300"))
+# A child that stays up this long starts again from the minimum backoff
+RESTART_RESET_SECONDS = float(os.getenv("RESTART_RESET_SECONDS", "600"))
+# Restarts happen after the parent has started threads holding locks and sockets,
+# so children begin from a fresh interpreter instead of a fork of it
+SUPERVISOR_START_METHOD = os.getenv("SUPERVISOR_START_METHOD", "spawn")
+FIELDS = ('ts', 'cpu', 'rss', 'read_bytes', 'write_bytes')
+
+
+class RingBuffer:
+    """Last `size` samples of FIELDS in a preallocated array."""
+
+    def __init__(self, size=SUPERVISOR_HISTORY):
+        self.data = np.full((size, len(FIELDS)), np.nan)
+        self.size = size
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.count % self.size] = row
+        self.count += 1
+
+    def values(self, last=None):
+        n = min(self.count, self.size)
+        if last is not None:
+            n = min(n, last)
+        idx = np.arange(self.count - n, self.count) % self.size
+        return self.data[idx]
+
+
+def memory_growth(samples, window=MEM_GROWTH_WINDOW, mb_per_min=MEM_GROWTH_MB_PER_MIN):
+    """RSS slope in MB/min when it is sustained over the window, else None."""
+    samples = samples[-window:]
+    if len(samples) < window:
+        return None
+    ts, rss = samples[:, 0], samples[:, 2] / (1024 * 1024)
+    if np.isnan(rss).any() or ts[-1] <= ts[0]:
+        return None
+    slope = np.polyfit((ts - ts[0]) / 60, rss, 1)[0]
+    # A saw-tooth that GC keeps bringing back down is not a leak
+    rising = (np.diff(rss) >= 0).mean()
+    return slope if slope > mb_per_min and rising >= 0.7 else None
+
+
+class Child:
+    def __init__(self, name, target=None, args=(), pid=None):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.process = None
+        self.pid = pid
+        self.proc = None
+        self.history = RingBuffer()
+        self.started = None
+        self.restarts = 0
+        self.failures = 0
+        self.restart_at = None
+        self.growth = None
+        self.up = False
+
+    @property
+    def restartable(self):
+        return self.target is not None
+
+    def start(self):
+        self.process = mp.get_context(SUPERVISOR_START_METHOD).Process(target=self.target, args=self.args, name=self.name)
+        self.process.start()
+        self.pid = self.process.pid
+        self.proc = None
+        self.started = time.monotonic()
+        self.restart_at = None
+
+    def alive(self):
+        if self.process is not None:
+            return self.process.is_alive()
+        try:
+            return psutil.Process(self.pid).is_running()
+        except psutil.NoSuchProcess:
+            return False
+
+    def sample(self, now):
+        """Append one sample; cpu_percent(None) is the usage since the previous call, so nothing blocks."""
+        try:
+            if self.proc is None or self.proc.pid != self.pid:
+                self.proc = psutil.Process(self.pid)
+                self.proc.cpu_percent(None)
+            with self.proc.oneshot():
+                cpu = self.proc.cpu_percent(None)
+                rss = self.proc.memory_info().rss
+                try:
+                    io = self.proc.io_counters()
+                    read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                except (AttributeError, psutil.AccessDenied):
+                    read_bytes = write_bytes = np.nan
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return False
+        self.history.append((now, cpu, rss, read_bytes, write_bytes))
+        self.growth = memory_growth(self.history.values())
+        return True
+
+
+class Supervisor:
+    """
+    Samples every child each pass, keeps a RingBuffer per child and restarts
+    dead children that it started itself.
+
+    Restarts back off exponentially from RESTART_BACKOFF_MIN to
+    RESTART_BACKOFF_MAX; the backoff resets once a child has stayed up for
+    RESTART_RESET_SECONDS.
+    """
+
+    def __init__(self, interval=SUPERVISOR_INTERVAL):
+        self.interval = interval
+        self.children = {}
+        self.passes = 0
+
+    def add(self, name, target, args=()):
+        self.children[name] = Child(name, target, args)
+        return self.children[name]
+
+    def watch(self, name, pid):
+        """Sample a process started elsewhere; it is not restarted."""
+        self.children[name] = Child(name, pid=pid)
+        return self.children[name]
+
+    def start(self):
+        for child in self.children.values():
+            if child.restartable and child.process is None:
+                child.start()
+        return self
+
+    def pids(self):
+        return {f"{name} PID": child.pid for name, child in self.children.items()}
+
+    def _handle_dead(self, child, now):
+        if not child.restartable:
+            return
+        if child.restart_at is None:
+            if time.monotonic() - child.started >= RESTART_RESET_SECONDS:
+                child.failures = 0
+            delay = min(RESTART_BACKOFF_MIN * 2 ** child.failures, RESTART_BACKOFF_MAX)
+            child.failures += 1
+            child.restart_at = now + delay
+            code = child.process.exitcode if child.process else None
+            print(f"❌ {child.name} [PID: {child.pid}] exited ({code}), restarting in {delay:.0f}s")
+        elif now >= child.restart_at:
+            child.process.join(timeout=0)
+            child.start()
+            child.restarts += 1
+            print(f"🔄 {child.name} restarted [PID: {child.pid}] (restart #{child.restarts})")
+
+    def run_once(self):
+        now = time.time()
+        for child in self.children.values():
+            growing = child.growth is not None
+            child.up = child.alive() and child.sample(now)
+            if not child.up:
+                self._handle_dead(child, now)
+            elif child.growth is not None and not growing:
+                print(f"⚠️ {child.name} RSS growing {child.growth:.1f} MB/min over the last {MEM_GROWTH_WINDOW} samples")
+        self.passes += 1
+        if SUPERVISOR_PRINT_EVERY and self.passes % SUPERVISOR_PRINT_EVERY == 0:
+            self.print_usage()
+
+    def restart_due(self):
+        now = time.time()
+        for child in self.children.values():
+            if child.restart_at is not None and now >= child.restart_at:
+                self._handle_dead(child, now)
+
+    def run(self):
+        next_sample = time.time()
+        while True:
+            if time.time() >= next_sample:
+                self.run_once()
+                next_sample = time.time() + self.interval
+            else:
+                self.restart_due()
+            # A pending restart can be due before the next sampling pass
+            wakeups = [next_sample] + [c.restart_at for c in self.children.values() if c.restart_at is not None]
+            time.sleep(max(min(wakeups) - time.time(), 0.05))
+
+    def print_usage(self):
+        total = psutil.virtual_memory().total
         print(f"\n{'='*70}")
-        print(f"⏰ {timestamp}")
+        print(f"⏰ {datetime.now().strftime('%H:%M:%S')}")
         print(f"{'='*70}")
-        
-        for name, pid in pid_dict.items():
-            try:
-                proc = psutil.Process(pid)
-                cpu = proc.cpu_percent(interval=0.5)
-                mem_percent = proc.memory_percent()
-                io = proc.io_counters()
-                read_mb = io.read_bytes / (1024 * 1024)
-                write_mb = io.write_bytes / (1024 * 1024)
-                
-                # Bars
-                cpu_bar = "█" * int(cpu / 10) + "░" * (10 - int(cpu / 10))
-                mem_bar = "█" * int(mem_percent / 10) + "░" * (10 - int(mem_percent / 10))
-                
-                # Status emoji
-                status = "🟢" if cpu < 50 else "🟡" if cpu < 80 else "🔴"
-                
-                print(f"\n{status} {name:<20} [PID: {pid}]")
-                print(f"   CPU  {cpu:5.1f}% [{cpu_bar}]")
-                print(f"   RAM  {mem_percent:5.2f}% [{mem_bar}]")
-                print(f"   I/O  ⬇️ {read_mb:7.1f} MB  ⬆️ {write_mb:7.1f} MB")
-                
-            except psutil.NoSuchProcess:
-                print(f"\n❌ {name:<20} [PID: {pid}] - Process Dead")
-        
+        for name, child in self.children.items():
+            if not child.up:
+                print(f"\n❌ {name:<20} [PID: {child.pid}] - Process Dead")
+                continue
+            _, cpu, rss, read_bytes, write_bytes = child.history.values(1)[0]
+            mem_percent = rss / total * 100
+            cpu_bar = "█" * min(int(cpu / 10), 10) + "░" * (10 - min(int(cpu / 10), 10))
+            mem_bar = "█" * min(int(mem_percent / 10), 10) + "░" * (10 - min(int(mem_percent / 10), 10))
+            status = "🟢" if cpu < 50 else "🟡" if cpu < 80 else "🔴"
+            print(f"\n{status} {name:<20} [PID: {child.pid}] restarts: {child.restarts}")
+            print(f"   CPU  {cpu:5.1f}% [{cpu_bar}]")
+            print(f"   RAM  {mem_percent:5.2f}% [{mem_bar}] {rss / (1024 * 1024):8.1f} MB")
+            print(f"   I/O  ⬇️ {read_bytes / (1024 * 1024):7.1f} MB  ⬆️ {write_bytes / (1024 * 1024):7.1f} MB")
         print(f"\n{'='*70}")
-        time.sleep(10)
\ No newline at end of file
+
+    def series(self, last=None):
+        """{name: {'pid', 'restarts', 'growth_mb_per_min', field: [...]}} from the ring buffers."""
+        out = {}
+        for name, child in self.children.items():
+            samples = child.history.values(last)
+            entry = {'pid': child.pid, 'restarts': child.restarts, 'growth_mb_per_min': child.growth}
+            for i, field in enumerate(FIELDS):
+                entry[field] = [None if np.isnan(v) else float(v) for v in samples[:, i]]
+            out[name] = entry
+        return out
+
+    def series_json(self):
+        return json.dumps(self.series())
+
+    def prometheus(self):
+        """Latest sample per child as gauges, for the metrics endpoint."""
+        metrics = {
+            'process_up': ('gauge', lambda c, last: int(c.up)),
+            'process_restarts': ('counter', lambda c, last: c.restarts),
+            'process_rss_growth_mb_per_min': ('gauge', lambda c, last: c.growth or 0.0),
+            'process_cpu_percent': ('gauge', lambda c, last: last and last[1]),
+            'process_rss_bytes': ('gauge', lambda c, last: last and last[2]),
+            'process_io_read_bytes': ('counter', lambda c, last: last and last[3]),
+            'process_io_write_bytes': ('counter', lambda c, last: last and last[4]),
+        }
+        latest = {name: (tuple(c.history.values(1)[0]) if c.up else None)
+                  for name, c in self.children.items()}
+        lines = []
+        for metric, (kind, value_of) in metrics.items():
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, child in self.children.items():
+                value = value_of(child, latest[name])
+                if value is not None and not np.isnan(value):
+                    lines.append(f'{metric}{{process="{name}"}} {float(value)!r}' if kind == 'gauge'
+                                 else f'{metric}{{process="{name}"}} {int(value)}')
+        return "\n".join(lines) + "\n"
+
+
+def monitor_process_usage(pid_dict):
+    """Sample and print processes started elsewhere, without restarting them."""
+    supervisor = Supervisor()
+    for name, pid in pid_dict.items():
+        supervisor.watch(name.replace(" PID", ""), pid)
+    supervisor.run()
@@ -0,0 +1,233 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from dotenv import load_dotenv
+from healper import _date_col, _normalize_dates, _as_datetime, _ts, _str, _table_bytes, codec_for, meta_key, tail_key
+from healper import read_range_from_redis, append_feather_to_redis
+
+load_dotenv()
+# Higher timeframes kept for every symbol and spread: minutes, hours or days ("15m", "1h", "1d")
+ROLLUP_TIMEFRAMES = [tf.strip() for tf in os.getenv("ROLLUP_TIMEFRAMES", "15m,1h,1d").split(",") if tf.strip()]
+# Buckets start at local midnight plus this; 555 puts intraday NSE bars on 09:15
+ROLLUP_ORIGIN = pd.Timedelta(minutes=int(os.getenv("ROLLUP_ORIGIN_MINUTES", "0")))
+ROLLUP_KEYS = ("historical", "spreads")
+# Anything not listed keeps the last value; spreads store the hedge ratio in "Volume"
+ROLLUP_AGG = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum',
+}
+
+
+UNITS = {'m': 'minutes', 'min': 'minutes', 'h': 'hours', 'd': 'days'}
+
+def timeframe_delta(tf):
+    match = re.fullmatch(r"(\d+)\s*(m|min|h|d)", tf.strip().lower())
+    if not match:
+        raise ValueError(f"unsupported timeframe {tf!r}")
+    return pd.Timedelta(**{UNITS[match.group(2)]: int(match.group(1))})
+
+def _timeframes(timeframes):
+    # Timeframes no longer than the base interval would just copy it
+    base = pd.Timedelta(minutes=int(''.join(filter(str.isdigit, os.getenv("hist_intv", "5"))) or 1))
+    valid = []
+    for tf in timeframes:
+        try:
+            if timeframe_delta(tf) > base:
+                valid.append(tf)
+        except ValueError:
+            print(f"⚠️ Ignoring rollup timeframe {tf!r}")
+    return valid
+
+TIMEFRAMES = _timeframes(ROLLUP_TIMEFRAMES)
+
+
+def rollup_key(key, tf):
+    """Key family of one timeframe, e.g. historical_1h:{symbol}."""
+    return f"{key}_{tf}"
+
+def rollup_keys(keys=ROLLUP_KEYS, timeframes=None):
+    timeframes = TIMEFRAMES if timeframes is None else timeframes
+    return tuple(rollup_key(key, tf) for key in keys for tf in timeframes)
+
+
+def bucket(dates, tf):
+    """Start of the tf bucket holding each date, on the bars' own wall clock."""
+    return (dates - ROLLUP_ORIGIN).dt.floor(timeframe_delta(tf)) + ROLLUP_ORIGIN
+
+REDUCERS = {'max': np.maximum.reduceat, 'min': np.minimum.reduceat, 'sum': np.add.reduceat}
+
+def rollup_frame(df, tf):
+    """Base bars (sorted by date) aggregated to tf with reduceat over bucket runs; dates are bucket starts."""
+    date_col = _date_col(df)
+    buckets = bucket(_as_datetime(df[date_col]).reset_index(drop=True), tf)
+    ns = buckets.to_numpy(dtype='datetime64[ns]')
+    starts = np.flatnonzero(np.r_[True, ns[1:] != ns[:-1]])
+    ends = np.r_[starts[1:], len(ns)] - 1
+    out = {}
+    for col in df.columns:
+        if col == date_col:
+            out[col] = buckets.iloc[starts].reset_index(drop=True)
+            continue
+        values = df[col].to_numpy()
+        how = ROLLUP_AGG.get(col, 'last')
+        if how == 'first':
+            out[col] = values[starts]
+        elif how in REDUCERS:
+            out[col] = REDUCERS[how](values, starts)
+        else:
+            out[col] = values[ends]
+    return pd.DataFrame(out)
+
+
+def _row_text(row):
+    return row.to_json(date_format='iso', date_unit='ns')
+
+def _fold_bar(prev, bar):
+    """One bar from the stored forming bar `prev` and the aggregate of the bars closed since."""
+    out = {}
+    for col, value in bar.items():
+        how = ROLLUP_AGG.get(col, 'last')
+        if col not in prev or how == 'last':
+            out[col] = value
+        elif how == 'first':
+            out[col] = prev[col]
+        elif how == 'max':
+            out[col] = max(prev[col], value)
+        elif how == 'min':
+            out[col] = min(prev[col], value)
+        else:
+            out[col] = prev[col] + value
+    return out
+
+def _rolled_meta(source, date_col, base_rows):
+    # The newest base row folded in and the base row count are kept with the bars,
+    # so the next call knows where to resume and whether it missed anything
+    return {
+        'rolled_ts': str(source[date_col]),
+        'rolled_last': _row_text(source),
+        'rolled_rows': int(base_rows or 0),
+    }
+
+def _write(redis_conn, symbol, key, tf, bars, source, base_rows):
+    append_feather_to_redis(redis_conn, symbol, bars, rollup_key(key, tf), extra_meta=_rolled_meta(source, _date_col(bars), base_rows))
+
+def _unrolled(rows, date_col, state, base_rows):
+    """Rows not yet folded into the rollup, or None when they revise bars that were."""
+    last, rolled_ts, rolled_last, rolled_rows = state[:4]
+    if last is None or rolled_ts is None or rolled_rows is None or base_rows is None:
+        return None
+    rolled_ts = _ts(_str(rolled_ts))
+    dates = rows[date_col]
+    new = rows
+    if dates.iloc[0] < rolled_ts:
+        return None
+    if dates.iloc[0] == rolled_ts:
+        # calculate_historical saves its last bar again; unchanged, it is already folded in
+        if rolled_last is None or _row_text(rows.iloc[0]) != _str(rolled_last):
+            return None
+        new = rows.iloc[1:]
+    # Anything else in the base since the last fold (a failed update, an archive trim) needs a rebuild
+    if int(base_rows) != int(rolled_rows) + len(new):
+        return None
+    return new
+
+def _fold(pipe, symbol, key, tf, records, date_col, state, rolled):
+    """Queue the bars base `records` make of the stored forming bar and anything after it on `pipe`."""
+    last, last_ts = state[0], state[4]
+    prev_table = pa.ipc.open_file(pa.py_buffer(last)).read_all()
+    prev = prev_table.to_pylist()[-1]
+    delta = timeframe_delta(tf)
+    bars = []
+    for row in records:
+        # Scalar form of bucket()
+        start = (row[date_col] - ROLLUP_ORIGIN).floor(delta) + ROLLUP_ORIGIN
+        if bars and bars[-1][date_col] == start:
+            bars[-1] = _fold_bar(bars[-1], row)
+        elif not bars and prev.get(date_col) == start:
+            bars.append(_fold_bar(prev, row))
+        else:
+            bars.append(dict(row))
+        bars[-1][date_col] = start
+
+    # Built on the stored bar's schema, so the tail matches the rest of the key without a DataFrame
+    table = pa.Table.from_pylist(bars, schema=prev_table.schema)
+    rkey = rollup_key(key, tf)
+    meta = meta_key(rkey, symbol)
+    last_ts = _ts(_str(last_ts)) if last_ts is not None else None
+    added = sum(1 for bar in bars if last_ts is None or bar[date_col] > last_ts)
+    pipe.rpush(tail_key(rkey, symbol), _table_bytes(table, codec_for(rkey)))
+    pipe.hset(meta, mapping={
+        # One-row blob, uncompressed like every sidecar 'last'
+        'last': _table_bytes(table.slice(len(table) - 1)),
+        'last_ts': str(bars[-1][date_col]),
+        **rolled,
+    })
+    # Counted up rather than set, so a trim that lands first is not overwritten
+    if added:
+        pipe.hincrby(meta, 'rows', added)
+    pipe.hincrby(meta, 'version', 1)
+
+def _rebuild(redis_conn, symbol, key, rows, since, base_rows):
+    """Recompute each timeframe in `since` ({tf: date}) from the bucket holding that date on."""
+    date_col = _date_col(rows)
+    starts = {tf: bucket(pd.Series([date]), tf).iloc[0] for tf, date in since.items()}
+    base = read_range_from_redis(redis_conn, symbol, key, start=min(starts.values()))
+    if base is None or base.empty:
+        return
+    newest = base.iloc[-1]
+    if rows[date_col].iloc[-1] == newest[_date_col(base)]:
+        newest = rows.iloc[-1]
+    for tf in since:
+        bars = rollup_frame(base, tf)
+        _write(redis_conn, symbol, key, tf, bars[bars[_date_col(bars)] >= starts[tf]], newest, base_rows)
+
+def update_rollups(redis_conn, symbol, key, rows, timeframes=None):
+    """
+    Refresh every timeframe of `symbol` after `rows` were written under `key`.
+
+    Rows newer than anything rolled up so far are folded into the stored
+    forming bar of each timeframe, so a normal close reads no base bars.
+    Rows that revise bars already rolled up (late ticks, backfills, a first
+    run), or a base that gained rows some earlier call never folded, rebuild
+    the buckets they fall in from the base bars since then.
+    """
+    timeframes = TIMEFRAMES if timeframes is None else timeframes
+    rows = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    if not timeframes or rows.empty:
+        return
+    date_col = _date_col(rows)
+    if date_col is None:
+        return
+    rows = _normalize_dates(rows)
+    if len(rows) > 1:
+        if not rows[date_col].is_monotonic_increasing:
+            rows = rows.sort_values(date_col, kind='stable')
+        rows = rows.drop_duplicates(subset=[date_col], keep='last').reset_index(drop=True)
+
+    with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.hget(meta_key(key, symbol), 'rows')
+        for tf in timeframes:
+            pipe.hmget(meta_key(rollup_key(key, tf), symbol), 'last', 'rolled_ts', 'rolled_last', 'rolled_rows', 'last_ts')
+        base_rows, *states = pipe.execute()
+    rebuild = {}
+    # Every timeframe's fold goes out in one transaction
+    with redis_conn.pipeline() as pipe:
+        rolled = _rolled_meta(rows.iloc[-1], date_col, base_rows)
+        records = None
+        for tf, state in zip(timeframes, states):
+            new = _unrolled(rows, date_col, state, base_rows)
+            if new is None:
+                # Base rows after the last one folded in may not have been rolled up either
+                rolled_ts = _ts(_str(state[1])) if state[1] is not None else None
+                rebuild[tf] = min(rows[date_col].iloc[0], rolled_ts) if rolled_ts is not None else rows[date_col].iloc[0]
+            elif not new.empty:
+                records = rows.to_dict('records') if records is None else records
+                _fold(pipe, symbol, key, tf, records[len(rows) - len(new):], date_col, state, rolled)
+        pipe.execute()
+    if rebuild:
+        _rebuild(redis_conn, symbol, key, rows, rebuild, base_rows)
@@ -2,14 +2,13 @@ import numpy as np
 import pandas as pd
 import os
 from dotenv import load_dotenv
-from statsmodels.regression.rolling import RollingOLS
 from spreads.spreads_resepy import calculate_hedge_ratios
 load_dotenv()
 
 LOOKBACK = int(os.getenv('LOOKBACK_DAYS'))
 
-def calculate_historical_spreads(df, pair):
-    hedge_ratios = calculate_hedge_ratios(df, pair)
+def calculate_historical_spreads(df, pair, from_date=None):
+    hedge_ratios = calculate_hedge_ratios(df, pair, from_date)
     if hedge_ratios.empty:
         return pd.DataFrame()
     
@@ -0,0 +1,269 @@
+import os
+import json
+import math
+import threading
+from collections import defaultdict
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from dotenv import load_dotenv
+from healper import read_last_row
+from aqi_write import _join
+from data.ltp_writer import LTP_CHANNEL
+from metrics import timed
+
+load_dotenv()
+# calculate_historical announces pairs that got new spread bars here
+SPREAD_BARS_CHANNEL = os.getenv("SPREAD_BARS_CHANNEL", "spread_bars")
+LIVE_SPREADS_CHANNEL = os.getenv("LIVE_SPREADS_CHANNEL", "live_spreads")
+
+
+# Hash of pair -> JSON of the forming bar, written with one HSET per tick.
+# Forming bars live only here; spreads:{pair} is written by calculate_historical.
+LIVE_SPREADS_KEY = "live_spreads"
+
+
+def ltp_names(sym):
+    # Binance ticks are keyed as BTCUSDT while pairs use BTC
+    return [sym] if sym.endswith('USDT') else [sym, sym + 'USDT']
+
+
+def _text(values):
+    return pa.array(values, type=pa.large_string())
+
+def _numbers(values):
+    # Shortest text that parses back to the same double, like repr
+    return pc.cast(pa.array(np.asarray(values, dtype=float)), pa.large_string())
+
+def _lit(text):
+    return pa.scalar(text, pa.large_string())
+
+
+def bar_json(dates, o, h, l, c, hr):
+    """JSON of many forming bars at once; every column is formatted by Arrow kernels, as in aqi_write."""
+    return _join(_lit('{"datetime":"'), _text(dates), _lit('","open":'), _numbers(o),
+                 _lit(',"high":'), _numbers(h), _lit(',"low":'), _numbers(l), _lit(',"close":'), _numbers(c),
+                 _lit(',"hedge_ratio":'), _numbers(hr), _lit('}'), sep='')
+
+
+def publish_live(redis_conn, pairs, bars):
+    """Store and broadcast forming bars (JSON text aligned with `pairs`) in one round trip."""
+    pairs = _text(pairs)
+    entries = _join(_lit('"'), pairs, _lit('":'), bars, sep='')
+    message = pc.binary_join(pa.LargeListArray.from_arrays([0, len(entries)], entries), _lit(','))[0].as_py()
+    with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.hset(LIVE_SPREADS_KEY, mapping=dict(zip(pairs.to_pylist(), bars.to_pylist())))
+        pipe.publish(LIVE_SPREADS_CHANNEL, "{" + message + "}")
+        pipe.execute()
+
+
+def read_live_bars(redis_conn, pairs):
+    """{pair: forming bar dict} from LIVE_SPREADS_KEY, in one HMGET."""
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+    return {pair: json.loads(v) for pair, v in zip(pairs, redis_conn.hmget(LIVE_SPREADS_KEY, pairs)) if v is not None}
+
+
+def forming_bar(redis_conn, pair, live=None):
+    """
+    The bar live prices extend: the last stored spread bar of `pair`, or None.
+
+    `live` is the pair's entry from read_live_bars; when it is the same bar
+    the engine restarted mid-bar, and the range it had reached is kept.
+    """
+    row = read_last_row(redis_conn, pair, key="spreads")
+    if row is None:
+        return None
+    bar = {'datetime': str(row['datetime']), 'Volume': float(row['Volume'])}
+    for col in ('open', 'high', 'low', 'close'):
+        bar[col] = float(row[col])
+    if live is not None and live['datetime'] == bar['datetime']:
+        bar['high'], bar['low'], bar['close'] = live['high'], live['low'], live['close']
+    return bar
+
+
+class LiveSpreadEngine:
+    """
+    Keeps each pair's latest hedge ratio and forming spread bar in memory and
+    recomputes the spread whenever a price update for either leg arrives.
+
+    Results go to the LIVE_SPREADS_KEY hash and are published on LIVE_SPREADS_CHANNEL.
+    """
+
+    def __init__(self, redis_conn, pairs):
+        self.redis = redis_conn
+        self.pairs = list(pairs)
+        self.legs = {pair: pair.split('_', 1) for pair in self.pairs}
+        self.alias = {}
+        self.pairs_by_leg = defaultdict(list)
+        for pair, legs in self.legs.items():
+            for sym in legs:
+                self.pairs_by_leg[sym].append(pair)
+                for name in ltp_names(sym):
+                    self.alias[name] = sym
+        self.ltp = {}
+        self.bars = {}
+        self.running = False
+
+    def load_pair(self, pair, live=None):
+        bar = forming_bar(self.redis, pair, live)
+        if bar is None:
+            self.bars.pop(pair, None)
+        else:
+            self.bars[pair] = bar
+
+    def load(self):
+        live = read_live_bars(self.redis, self.pairs)
+        for pair in self.pairs:
+            self.load_pair(pair, live.get(pair))
+        names = [f"ltp:{name}" for name in self.alias]
+        for name, val in zip(self.alias, self.redis.mget(names)):
+            if val is not None:
+                self.ltp[self.alias[name]] = float(val)
+
+    def on_prices(self, prices):
+        touched = set()
+        for name, price in prices.items():
+            sym = self.alias.get(name)
+            if sym is None:
+                continue
+            self.ltp[sym] = float(price)
+            touched.update(self.pairs_by_leg[sym])
+
+        updates = []
+        for pair in touched:
+            bar = self.bars.get(pair)
+            s1, s2 = self.legs[pair]
+            if bar is None or s1 not in self.ltp or s2 not in self.ltp:
+                continue
+            close = math.log(self.ltp[s1]) - bar['Volume'] * math.log(self.ltp[s2])
+            bar['close'] = close
+            bar['high'] = max(bar['high'], close)
+            bar['low'] = min(bar['low'], close)
+            updates.append(pair)
+        if not updates:
+            return {}
+        bars = [self.bars[pair] for pair in updates]
+        payload = bar_json(*([bar[col] for bar in bars] for col in ('datetime', 'open', 'high', 'low', 'close', 'Volume')))
+        publish_live(self.redis, updates, payload)
+        return dict(zip(updates, payload.to_pylist()))
+
+    def run(self):
+        self.running = True
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(LTP_CHANNEL, SPREAD_BARS_CHANNEL)
+        self.load()
+        print(f"✅ Live spread engine started for {len(self.pairs)} pairs")
+        try:
+            while self.running:
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    channel = message['channel']
+                    channel = channel.decode() if isinstance(channel, bytes) else channel
+                    data = message['data']
+                    if channel == SPREAD_BARS_CHANNEL:
+                        # A new historical bar replaces the forming bar and hedge ratio
+                        pair = data.decode() if isinstance(data, bytes) else data
+                        if pair in self.legs:
+                            self.load_pair(pair)
+                    else:
+                        with timed("live_spread"):
+                            self.on_prices(json.loads(data))
+        finally:
+            pubsub.close()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True, name="LiveSpreadEngine")
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+
+class LiveSpreadBatch:
+    """
+    Polling variant for large pair universes: one MGET for every LTP, one
+    vectorized spread update across all pairs, one pipeline out.
+
+    Hedge ratios and forming bars live in NumPy arrays aligned to `pairs`.
+    A pair is reloaded only when SPREAD_BARS_CHANNEL announces a new bar,
+    and written only when a leg's price moved or its bar was reloaded.
+    """
+
+    def __init__(self, redis_conn, pairs):
+        self.redis = redis_conn
+        self.pairs = list(pairs)
+        legs = [pair.split('_', 1) for pair in self.pairs]
+        self.symbols = sorted({sym for leg in legs for sym in leg})
+        col = {sym: i for i, sym in enumerate(self.symbols)}
+        self.i1 = np.array([col[s1] for s1, _ in legs], dtype=np.intp)
+        self.i2 = np.array([col[s2] for _, s2 in legs], dtype=np.intp)
+        self.index = {pair: p for p, pair in enumerate(self.pairs)}
+        self.names_of = np.array(self.pairs, dtype=object)
+        # Two candidate LTP keys per symbol, the first one that exists wins
+        self.names = [f"ltp:{name}" for sym in self.symbols for name in (ltp_names(sym) * 2)[:2]]
+
+        n = len(self.pairs)
+        self.hr = np.full(n, np.nan)
+        self.open = np.full(n, np.nan)
+        self.high = np.full(n, np.nan)
+        self.low = np.full(n, np.nan)
+        self.close = np.full(n, np.nan)
+        self.dates = np.full(n, None, dtype=object)
+        # Last log prices seen, and pairs to write even if no leg moved
+        self.logp = np.full(len(self.symbols), np.nan)
+        self.dirty = np.zeros(n, dtype=bool)
+        self.pubsub = None
+
+    def load_pair(self, p, live=None):
+        bar = forming_bar(self.redis, self.pairs[p], live)
+        if bar is None:
+            self.hr[p] = np.nan
+            return
+        self.dates[p], self.hr[p] = bar['datetime'], bar['Volume']
+        self.open[p], self.high[p], self.low[p], self.close[p] = bar['open'], bar['high'], bar['low'], bar['close']
+        self.dirty[p] = True
+
+    def load(self):
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(SPREAD_BARS_CHANNEL)
+        live = read_live_bars(self.redis, self.pairs)
+        for p, pair in enumerate(self.pairs):
+            self.load_pair(p, live.get(pair))
+
+    def _reload_announced(self):
+        while True:
+            message = self.pubsub.get_message(timeout=0)
+            if message is None:
+                return
+            pair = message['data']
+            pair = pair.decode() if isinstance(pair, bytes) else pair
+            if pair in self.index:
+                self.load_pair(self.index[pair])
+
+    def tick(self):
+        if self.pubsub is None:
+            self.load()
+        self._reload_announced()
+
+        raw = self.redis.mget(self.names)
+        px = np.array([np.nan if v is None else float(v) for v in raw]).reshape(-1, 2)
+        logp = np.log(np.where(np.isnan(px[:, 0]), px[:, 1], px[:, 0]))
+
+        moved = ~((logp == self.logp) | (np.isnan(logp) & np.isnan(self.logp)))
+        self.logp = logp
+
+        close = logp[self.i1] - self.hr * logp[self.i2]
+        idx = np.flatnonzero((moved[self.i1] | moved[self.i2] | self.dirty) & ~np.isnan(close))
+        if not len(idx):
+            return 0
+        self.dirty[idx] = False
+        self.close[idx] = close[idx]
+        self.high[idx] = np.maximum(self.high[idx], close[idx])
+        self.low[idx] = np.minimum(self.low[idx], close[idx])
+
+        publish_live(self.redis, self.names_of[idx], bar_json(
+            self.dates[idx], self.open[idx], self.high[idx], self.low[idx], self.close[idx], self.hr[idx]))
+        return len(idx)
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+def build_panel(frames, column):
+    """Outer-join one column of every symbol frame into a time x symbol array."""
+    series = {sym: df.set_index('date')[column] for sym, df in frames.items()}
+    panel = pd.concat(series, axis=1, join='outer').sort_index()
+    return panel.index, list(panel.columns), panel.to_numpy(dtype=float)
+
+
+def _window_sums(a, window):
+    c = np.cumsum(a, axis=0)
+    out = np.full_like(c, np.nan)
+    if len(a) >= window:
+        out[window - 1] = c[window - 1]
+        out[window:] = c[window:] - c[:-window]
+    return out
+
+
+def rolling_slopes(y, x, window):
+    """Rolling OLS slope of every column of y on [1, x], all columns at once."""
+    # Centering keeps the cumulative sums small enough to difference safely
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    sx, sy = _window_sums(x, window), _window_sums(y, window)
+    sxx, sxy = _window_sums(x * x, window), _window_sums(x * y, window)
+    var = sxx - sx * sx / window
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (sxy - sx * sy / window) / var
+    slopes[~(var > 0)] = np.nan
+    return slopes
+
+
+def panel_hedge_ratios(log_close, symbols, pairs, window):
+    """
+    Hedge ratios for every pair as a time x pair array.
+
+    Each pair regresses on the rows where both legs exist, like the
+    per-pair inner align. Pairs that share the same valid rows (all of
+    them on a gap-free panel) are solved together in one pass.
+    """
+    col = {s: i for i, s in enumerate(symbols)}
+    legs = np.array([[col[s] for s in p.split('_', 1)] for p in pairs]).reshape(-1, 2)
+    valid = ~np.isnan(log_close)
+    ratios = np.full((len(log_close), len(pairs)), np.nan)
+
+    groups = {}
+    for p, (i, j) in enumerate(legs):
+        mask = valid[:, i] & valid[:, j]
+        groups.setdefault(np.packbits(mask).tobytes(), (mask, []))[1].append(p)
+
+    for mask, members in groups.values():
+        rows = np.flatnonzero(mask)
+        if len(rows) < window:
+            continue
+        block = log_close[rows]
+        y, x = block[:, legs[members, 0]], block[:, legs[members, 1]]
+        ratios[np.ix_(rows, members)] = rolling_slopes(y, x, window)
+    return ratios, legs
+
+
+def aligned_rows(log_close, legs):
+    """Rows where both legs of each pair have a bar, like the per-pair inner align."""
+    valid = ~np.isnan(log_close)
+    return [np.flatnonzero(valid[:, i] & valid[:, j]) for i, j in legs]
+
+
+def panel_spreads(dates, symbols, log_open, log_close, pairs, window, from_dates=None):
+    """Spread frames for every pair, in the same layout as calculate_historical_spreads."""
+    ratios, legs = panel_hedge_ratios(log_close, symbols, pairs, window)
+    return spread_frames(dates, log_open, log_close, legs, ratios, pairs, from_dates)
+
+
+def spread_frames(dates, log_open, log_close, legs, ratios, pairs, from_dates=None):
+    """Spread frames from a time x pair array of hedge ratios; rows without one are left out."""
+    i, j = legs[:, 0], legs[:, 1]
+    o = log_open[:, i] - ratios * log_open[:, j]
+    c = log_close[:, i] - ratios * log_close[:, j]
+    high, low = np.maximum(o, c), np.minimum(o, c)
+
+    from_dates = from_dates or {}
+    out = {}
+    for p, pair in enumerate(pairs):
+        keep = ~(np.isnan(ratios[:, p]) | np.isnan(o[:, p]) | np.isnan(c[:, p]))
+        if from_dates.get(pair) is not None:
+            keep &= dates >= from_dates[pair]
+        rows = np.flatnonzero(keep)
+        out[pair] = pd.DataFrame({
+            'datetime': dates[rows],
+            'symbol': pair,
+            'open': o[rows, p],
+            'high': high[rows, p],
+            'low': low[rows, p],
+            'close': c[rows, p],
+            'Volume': ratios[rows, p]
+        })
+    return out
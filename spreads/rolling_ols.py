@@ -0,0 +1,243 @@
+import struct
+from collections import deque
+import numpy as np
+import pandas as pd
+from healper import _ns, _ns_array
+
+# One (x, y) point of the regression window, packed for the Redis list
+POINT = struct.Struct('<dd')
+
+def state_key(pair):
+    return f"hedge:{pair}"
+
+def window_key(pair):
+    return f"hedge_window:{pair}"
+
+class RollingHedge:
+    """
+    Rolling OLS slope of y on [1, x] over the last `window` points.
+
+    Keeps shifted running sums so each bar is one add and at most one evict.
+    Sums are rebuilt from the window every `window` updates to stop rounding
+    drift from accumulating.
+    """
+
+    FIELDS = ('n', 'kx', 'ky', 'su', 'sv', 'suu', 'suv', 'since_sync', 'last')
+    INT_FIELDS = ('n', 'since_sync', 'last')
+
+    def __init__(self, window):
+        self.window = window
+        self.n = 0
+        self.kx = self.ky = None
+        self.su = self.sv = self.suu = self.suv = 0.0
+        self.since_sync = 0
+        self.last = None
+
+    def _apply(self, x, y, sign):
+        u, v = x - self.kx, y - self.ky
+        self.su += sign * u
+        self.sv += sign * v
+        self.suu += sign * u * u
+        self.suv += sign * u * v
+
+    def add(self, x, y, evicted=None):
+        if self.kx is None:
+            self.kx, self.ky = x, y
+        self._apply(x, y, 1.0)
+        if evicted is not None:
+            self._apply(evicted[0], evicted[1], -1.0)
+        else:
+            self.n += 1
+        self.since_sync += 1
+
+    def replace(self, old, x, y):
+        self._apply(old[0], old[1], -1.0)
+        self._apply(x, y, 1.0)
+        self.since_sync += 1
+
+    def resync(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.n = len(points)
+        self.since_sync = 0
+        if self.n == 0:
+            self.kx = self.ky = None
+            self.su = self.sv = self.suu = self.suv = 0.0
+            return
+        self.kx, self.ky = points.mean(axis=0)
+        u, v = points[:, 0] - self.kx, points[:, 1] - self.ky
+        self.su, self.sv = float(u.sum()), float(v.sum())
+        self.suu, self.suv = float(u @ u), float(u @ v)
+
+    def slope(self):
+        if self.n < self.window:
+            return np.nan
+        sxx = self.suu - self.su * self.su / self.n
+        if sxx <= 0:
+            return np.nan
+        return (self.suv - self.su * self.sv / self.n) / sxx
+
+    def to_state(self):
+        cast = lambda f, v: str(int(v)) if f in self.INT_FIELDS else repr(float(v))
+        return {f: cast(f, getattr(self, f)) for f in self.FIELDS if getattr(self, f) is not None}
+
+    @classmethod
+    def from_state(cls, raw, window):
+        raw = {k.decode() if isinstance(k, bytes) else k: v for k, v in raw.items()}
+        if int(raw.get('window', -1)) != window:
+            return None
+        est = cls(window)
+        for f in cls.FIELDS:
+            if f in raw:
+                value = raw[f].decode() if isinstance(raw[f], bytes) else raw[f]
+                setattr(est, f, int(value) if f in cls.INT_FIELDS else float(value))
+        return est
+
+
+def rolling_hedge_ratios(log1, log2, window):
+    """Streaming pass over a whole series; returns the estimator, ratios and final window."""
+    est = RollingHedge(window)
+    points = deque()
+    ratios = np.full(len(log1), np.nan)
+    for i, (y, x) in enumerate(zip(log1, log2)):
+        evicted = points.popleft() if len(points) == window else None
+        points.append((x, y))
+        est.add(x, y, evicted)
+        if est.since_sync >= window:
+            est.resync(points)
+        ratios[i] = est.slope()
+    return est, ratios, points
+
+
+def _state_matches(raw, from_date, window):
+    est = RollingHedge.from_state(raw, window) if raw else None
+    return est if est is not None and est.last == _ns(from_date) else None
+
+def hedge_state_matches(redis_conn, pair, from_date, window):
+    """True when the persisted estimator ends exactly at the last stored spread bar."""
+    if from_date is None:
+        return False
+    return _state_matches(redis_conn.hgetall(state_key(pair)), from_date, window) is not None
+
+def matching_hedge_states(redis_conn, from_dates, window):
+    """{pair: estimator} for pairs whose persisted state ends at their date in `from_dates`, in one pipeline."""
+    pairs = [pair for pair, from_date in from_dates.items() if from_date is not None]
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for pair in pairs:
+            pipe.hgetall(state_key(pair))
+        states = pipe.execute() if pairs else []
+    matched = {pair: _state_matches(raw, from_dates[pair], window) for pair, raw in zip(pairs, states)}
+    return {pair: est for pair, est in matched.items() if est is not None}
+
+
+def _save_full(redis_conn, pair, est, points):
+    with redis_conn.pipeline() as pipe:
+        pipe.delete(state_key(pair), window_key(pair))
+        if points:
+            pipe.rpush(window_key(pair), *[POINT.pack(x, y) for x, y in points])
+        pipe.hset(state_key(pair), mapping={**est.to_state(), 'window': est.window})
+        pipe.execute()
+
+
+def seed_hedge_state(redis_conn, pair, dates, log1, log2, window):
+    """Store the estimator a streaming pass over these aligned bars would end with."""
+    points = list(zip(np.asarray(log2, dtype=float)[-window:], np.asarray(log1, dtype=float)[-window:]))
+    est = RollingHedge(window)
+    est.resync(points)
+    if len(dates):
+        est.last = int(_ns_array(pd.Index(dates))[-1])
+    _save_full(redis_conn, pair, est, points)
+
+
+def update_hedge_ratios(redis_conn, pair, dates, log1, log2, from_date, window):
+    """
+    Hedge ratios for aligned bars, indexed by date.
+
+    When the persisted state ends at `from_date` only bars from that date on
+    are fed, costing O(1) per bar. Otherwise the estimator is rebuilt from
+    the full input and the new state is stored.
+    """
+    dates = pd.Index(dates)
+    ns = _ns_array(dates)
+    log1 = np.asarray(log1, dtype=float)
+    log2 = np.asarray(log2, dtype=float)
+
+    est = _state_matches(redis_conn.hgetall(state_key(pair)), from_date, window) if from_date is not None else None
+    if est is None:
+        est, ratios, points = rolling_hedge_ratios(log1, log2, window)
+        if len(ns):
+            est.last = int(ns[-1])
+        _save_full(redis_conn, pair, est, points)
+        return pd.Series(ratios, index=dates)
+
+    return advance_hedge_ratios(redis_conn, {pair: est}, {pair: (dates, log1, log2)}, window)[pair]
+
+
+def advance_hedge_ratios(redis_conn, states, series, window):
+    """
+    Feed persisted estimators the aligned bars from their last date on.
+
+    `states` maps pairs to estimators that match their stored spreads and
+    `series` maps them to (dates, log1, log2). Evicted window points for all
+    pairs are read in one pipeline and the new states written in another.
+    Returns {pair: ratios indexed by date}.
+    """
+    out, plans = {}, {}
+    for pair, est in states.items():
+        dates, log1, log2 = series[pair]
+        dates = pd.Index(dates)
+        ns = _ns_array(dates)
+        start = int(np.searchsorted(ns, est.last))
+        if start == len(ns):
+            out[pair] = pd.Series(dtype=float)
+            continue
+        adds = len(ns) - start - int(ns[start] == est.last)
+        plans[pair] = (dates, ns, np.asarray(log1, dtype=float), np.asarray(log2, dtype=float),
+                       start, max(0, est.n + adds - window))
+
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for pair, plan in plans.items():
+            pipe.lrange(window_key(pair), 0, plan[5] - 1)
+            pipe.lindex(window_key(pair), -1)
+        fetched = pipe.execute() if plans else []
+
+    resync = []
+    with redis_conn.pipeline() as pipe:
+        for k, (pair, (dates, ns, log1, log2, start, evictions)) in enumerate(plans.items()):
+            est = states[pair]
+            last_point = fetched[2 * k + 1]
+            pending = deque(POINT.unpack(p) for p in (fetched[2 * k] if evictions else []))
+            ratios = []
+            for i in range(start, len(ns)):
+                x, y = log2[i], log1[i]
+                if ns[i] == est.last:
+                    old = POINT.unpack(last_point)
+                    est.replace(old, x, y)
+                    if len(pending) == est.n:
+                        pending[-1] = (x, y)
+                    pipe.rpop(window_key(pair))
+                else:
+                    evicted = pending.popleft() if est.n == window else None
+                    est.add(x, y, evicted)
+                    pending.append((x, y))
+                pipe.rpush(window_key(pair), POINT.pack(x, y))
+                est.last = int(ns[i])
+                ratios.append(est.slope())
+            pipe.ltrim(window_key(pair), -window, -1)
+            pipe.hset(state_key(pair), mapping={**est.to_state(), 'window': window})
+            out[pair] = pd.Series(ratios, index=dates[start:])
+            if est.since_sync >= window:
+                resync.append(pair)
+        pipe.execute()
+
+    if resync:
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for pair in resync:
+                pipe.lrange(window_key(pair), 0, -1)
+            windows = pipe.execute()
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for pair, points in zip(resync, windows):
+                states[pair].resync([POINT.unpack(p) for p in points])
+                pipe.hset(state_key(pair), mapping={**states[pair].to_state(), 'window': window})
+            pipe.execute()
+
+    return out
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# Set in each pool worker by attach_frames: {symbol: (shm_name, rows, columns, tz)}
+_handles = {}
+_attached = {}
+
+
+def publish_frames(frames):
+    """
+    Copy each symbol frame into one shared memory block, laid out as the
+    int64 ns dates followed by one float64 row per column.
+    Returns the handles for the workers and the blocks the parent must release.
+    """
+    handles, blocks = {}, []
+    for sym, df in frames.items():
+        cols = [c for c in COLUMNS if c in df.columns]
+        n = len(df)
+        shm = shared_memory.SharedMemory(create=True, size=max(8 * n * (len(cols) + 1), 1))
+        blocks.append(shm)
+        dates = np.ndarray((n,), dtype=np.int64, buffer=shm.buf)
+        values = np.ndarray((len(cols), n), dtype=np.float64, buffer=shm.buf, offset=8 * n)
+        date_col = pd.to_datetime(df['date'])
+        dates[:] = date_col.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        values[:] = df[cols].to_numpy(dtype=np.float64).T
+        tz = date_col.dt.tz
+        handles[sym] = (shm.name, n, cols, str(tz) if tz is not None else None)
+    return handles, blocks
+
+
+def release(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def attach_frames(handles):
+    global _handles
+    _handles = handles
+    _attached.clear()
+
+
+def shared_frame(sym, start=None, lookback=0):
+    """Rows of `sym` from `start` plus `lookback` earlier rows, viewed straight from shared memory."""
+    if sym not in _handles:
+        return None
+    name, n, cols, tz = _handles[sym]
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    buf = _attached[name].buf
+    dates = np.ndarray((n,), dtype=np.int64, buffer=buf)
+    values = np.ndarray((len(cols), n), dtype=np.float64, buffer=buf, offset=8 * n)
+
+    lo = 0
+    if start is not None:
+        lo = max(int(np.searchsorted(dates, pd.Timestamp(start).value)) - lookback, 0)
+    date_col = dates[lo:].view('datetime64[ns]')
+    if tz is not None:
+        date_col = pd.DatetimeIndex(date_col).tz_localize('UTC').tz_convert(tz)
+    data = {'date': date_col}
+    data.update({c: values[i, lo:] for i, c in enumerate(cols)})
+    return pd.DataFrame(data, copy=False)
@@ -4,14 +4,23 @@ import os
 import time
 import sqlite3
 import traceback
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
 from multiprocessing import Pool, Lock, cpu_count
-from spreads.cal import calculate_historical_spreads, calculate_live
+from spreads.cal import calculate_historical_spreads
+from spreads.rolling_ols import hedge_state_matches, matching_hedge_states, seed_hedge_state, advance_hedge_ratios
+from spreads.panel import build_panel, panel_spreads, spread_frames, aligned_rows
+from spreads.shared import publish_frames, attach_frames, shared_frame, release
+from spreads.live import LiveSpreadEngine, LiveSpreadBatch, SPREAD_BARS_CHANNEL
 import warnings
 from config import RedisConnection
 from healper import read_feather_from_redis, write_feather_to_redis
+from redis_to_db import read_history
+from disk_store import store_write
+from metrics import timed, push_metrics
+from rollup import update_rollups
 redis_conn = RedisConnection.get_instance()
 warnings.filterwarnings('ignore', message='divide by zero')
 warnings.filterwarnings('ignore', message='invalid value encountered')
@@ -24,29 +33,56 @@ PAIR_CSV = "pair.csv"
 LOOKBACK_DAYS = int(os.getenv("LOOKBACK_DAYS"))
 TABLE_NAME = os.getenv("TABLE_NAME", "OHLCV_DATA")
 DATA_START = os.getenv("data_start_date", "2025-01-01")
+# "panel" solves all pairs in one vectorized pass, "pool" fans pairs out to processes;
+# both advance the streaming hedge:{pair} state once it exists
+SPREADS_ENGINE = os.getenv("SPREADS_ENGINE", "panel")
 
 # ----------------- DB Helpers -----------------
 def save_df(pair, df):
     write_feather_to_redis(redis_conn, pair, df, key="spreads", live=False, spreads=True)
+    store_write("spreads", pair, df)
+    redis_conn.publish(SPREAD_BARS_CHANNEL, pair)
+    update_rollups(redis_conn, pair, "spreads", df)
 
 # ----------------- Pair & Data Helpers -----------------
 def load_pairs():
     df = pd.read_csv(PAIR_CSV).dropna(subset=["pair"])
     return df
 
-def get_data(pair, from_date):
+def get_symbol_data(sym, from_date, lookback=LOOKBACK_DAYS):
+    # Rows trimmed out of Redis by the archiver come back from SQLite
+    if from_date:
+        return read_history(redis_conn, sym, "historical", start=from_date, lookback=lookback)
+    return read_history(redis_conn, sym, "historical")
+
+def get_data(pair, from_date, lookback=LOOKBACK_DAYS):
     symbols = pair.split("_")
     dfs = {}
     for sym in symbols:
-        df = read_feather_from_redis(redis_conn, sym, key="historical", lr=False)
-        if from_date:
-            mask = df['date'] < from_date
-            lookback_df = df[mask].tail(LOOKBACK_DAYS)
-            forward_df = df[df['date'] >= from_date]
-            df = pd.concat([lookback_df, forward_df])
-        dfs[sym] = df
+        # Pool workers read from the blocks the parent published, if any
+        df = shared_frame(sym, from_date, lookback)
+        dfs[sym] = df if df is not None else get_symbol_data(sym, from_date, lookback)
     return dfs
 
+def load_symbol_frames(pairs, from_dates, lookbacks=None):
+    # Every symbol is read once, from the earliest bar any of its pairs needs
+    starts, depth = {}, {}
+    for pair in pairs:
+        lookback = LOOKBACK_DAYS if lookbacks is None else lookbacks[pair]
+        for sym in pair.split('_', 1):
+            start = from_dates[pair]
+            if sym not in starts or start is None or (starts[sym] is not None and start < starts[sym]):
+                starts[sym] = start
+            depth[sym] = max(depth.get(sym, 0), lookback)
+    frames = {}
+    for sym, start in starts.items():
+        df = get_symbol_data(sym, start, depth[sym])
+        if df is None or df.empty:
+            print(f"Skipping {sym}, no historical data")
+            continue
+        frames[sym] = df
+    return frames
+
 def last_spread_info(pair):
     lastD = read_feather_from_redis(redis_conn, pair, key="spreads", lr=True)
     if lastD is not None:
@@ -56,12 +92,17 @@ def last_spread_info(pair):
 
 # ----------------- Historical -----------------
 def process_historical(pair, loop):
-    from_date = last_spread_info(pair)
-    df = get_data(pair, from_date)
-    spreads = calculate_historical_spreads(df, pair)
-    if not spreads.empty:
-        # print("spreads", spreads)
-        save_df(pair, spreads)
+    with timed("spread_pair"):
+        from_date = last_spread_info(pair)
+        # A hedge state that ends at the last spread bar needs no lookback rows
+        lookback = 0 if hedge_state_matches(redis_conn, pair, from_date, LOOKBACK_DAYS) else LOOKBACK_DAYS
+        df = get_data(pair, from_date, lookback)
+        spreads = calculate_historical_spreads(df, pair, from_date)
+        if not spreads.empty:
+            # print("spreads", spreads)
+            save_df(pair, spreads)
+    # Pool workers are terminated without a chance to push later
+    push_metrics()
 
 # def calculate_historical(loop):
 #     pairs = load_pairs()
@@ -69,78 +110,96 @@ def process_historical(pair, loop):
 #         process_historical(pair, loop=loop)
     
 
+def calculate_historical_pool(loop):
+    pairs = load_pairs()['pair'].tolist()
+    from_dates = {pair: last_spread_info(pair) for pair in pairs}
+    handles, blocks = publish_frames(load_symbol_frames(pairs, from_dates))
+    try:
+        with Pool(processes=10, initializer=attach_frames, initargs=(handles,)) as pool:
+            pool.map(partial(process_historical, loop=loop), pairs)
+    finally:
+        release(blocks)
+
+def _panel(frames, pairs):
+    legs = {sym for pair in pairs for sym in pair.split('_', 1)}
+    frames = {sym: df for sym, df in frames.items() if sym in legs}
+    dates, symbols, close = build_panel(frames, 'close')
+    _, _, open_ = build_panel(frames, 'open')
+    col = {s: i for i, s in enumerate(symbols)}
+    pair_legs = np.array([[col[s] for s in p.split('_', 1)] for p in pairs]).reshape(-1, 2)
+    return dates, symbols, np.log(open_), np.log(close), pair_legs
+
+def panel_cold_spreads(frames, pairs, from_dates):
+    """Solve `pairs` from scratch on one panel and seed their streaming hedge state."""
+    dates, symbols, log_open, log_close, legs = _panel(frames, pairs)
+    spreads = panel_spreads(dates, symbols, log_open, log_close, pairs, LOOKBACK_DAYS, from_dates)
+    for pair, (i, j), rows in zip(pairs, legs, aligned_rows(log_close, legs)):
+        seed_hedge_state(redis_conn, pair, dates[rows], log_close[rows, i], log_close[rows, j], LOOKBACK_DAYS)
+    return spreads
+
+def panel_warm_spreads(frames, states, from_dates):
+    """Advance the stored hedge state of every pair in `states` by the bars since its last spread."""
+    pairs = list(states)
+    dates, _, log_open, log_close, legs = _panel(frames, pairs)
+    rows = aligned_rows(log_close, legs)
+    series = {pair: (dates[r], log_close[r, i], log_close[r, j]) for pair, (i, j), r in zip(pairs, legs, rows)}
+    advanced = advance_hedge_ratios(redis_conn, states, series, LOOKBACK_DAYS)
+    ratios = np.full((len(dates), len(pairs)), np.nan)
+    for p, (pair, r) in enumerate(zip(pairs, rows)):
+        ratios[r[len(r) - len(advanced[pair]):], p] = advanced[pair].to_numpy()
+    return spread_frames(dates, log_open, log_close, legs, ratios, pairs, from_dates)
+
+def calculate_historical_panel(loop):
+    pairs = load_pairs()['pair'].tolist()
+    from_dates = {pair: last_spread_info(pair) for pair in pairs}
+    # Pairs whose hedge state ends at their last spread bar only need the bars since
+    warm = matching_hedge_states(redis_conn, from_dates, LOOKBACK_DAYS)
+    lookbacks = {pair: 0 if pair in warm else LOOKBACK_DAYS for pair in pairs}
+    frames = load_symbol_frames(pairs, from_dates, lookbacks)
+    pairs = [p for p in pairs if all(s in frames for s in p.split('_', 1))]
+    if not pairs:
+        return
+
+    with timed("spread_panel"):
+        cold = [p for p in pairs if p not in warm]
+        spreads = panel_cold_spreads(frames, cold, from_dates) if cold else {}
+        warm = {pair: warm[pair] for pair in pairs if pair in warm}
+        if warm:
+            spreads.update(panel_warm_spreads(frames, warm, from_dates))
+    for pair, df in spreads.items():
+        if df.empty:
+            print(f"Skipping {pair}, not enough aligned data")
+            continue
+        with timed("spread_save"):
+            save_df(pair, df)
+
 def calculate_historical(loop):
     print("Spreads Start")
-    pairs = load_pairs()
-    with Pool(processes=10) as pool:
-        pool.map(partial(process_historical, loop=loop), pairs['pair'])
+    with timed("calculate_historical"):
+        if SPREADS_ENGINE == "pool":
+            calculate_historical_pool(loop)
+        else:
+            calculate_historical_panel(loop)
 
 # ----------------- Live -----------------
-def last_info(pair):
-    lastD = read_feather_from_redis(redis_conn, pair, key="spreads", lr=True)
-    if lastD is not None:
-        return lastD['datetime'], lastD['Volume']
-    else:
-        return None
-
-def write_live_spread_to_redis(redis_conn, symbol, live_df, key):
-    key = f"{key}:{symbol}"
-    new_close = float(live_df.iloc[-1]['close'])
-    
-    if redis_conn.exists(key):
-        existing_bytes = redis_conn.get(key)
-        existing_df = pd.read_feather(io.BytesIO(existing_bytes))   
-        existing_df.iloc[-1, existing_df.columns.get_loc('close')] = new_close
-        existing_df.iloc[-1, existing_df.columns.get_loc('high')] = max(
-            float(existing_df.iloc[-1]['high']), 
-            new_close
-        )
-        existing_df.iloc[-1, existing_df.columns.get_loc('low')] = min(
-            float(existing_df.iloc[-1]['low']), 
-            new_close
-        )
-        
-        ohlc_df = existing_df 
-    else:
-        ohlc_df = pd.DataFrame([{
-            'open': new_close,
-            'high': new_close,
-            'low': new_close,
-            'close': new_close
-        }])
-    buffer = io.BytesIO()
-    ohlc_df.to_feather(buffer)
-    redis_conn.set(key, buffer.getvalue())
-    last_row = ohlc_df.iloc[-1]
-    # print(f"Redis WRITE {symbol} | O:{last_row['open']:.5f} H:{last_row['high']:.5f} L:{last_row['low']:.5f} C:{last_row['close']:.5f}")
-
-def process_live(pairs):
-    s1, s2 = pairs.split('_', 1)
-    symbols=[s1, s2]
-    ltp = {}
-    for sym in symbols:
-        val = redis_conn.get(f"ltp:{sym}")
-        if val:
-            ltp[sym] = float(val)
-            s1, s2 = pairs.split('_', 1)
-            if s1 in ltp and s2 in ltp:
-                from_date, hr = last_info(pairs)
-                s1_data = pd.DataFrame([{'close': ltp[s1]}])
-                s2_data = pd.DataFrame([{'close': ltp[s2]}])
-                live = calculate_live(pairs, s1_data, s2_data, hr, from_date)
-                # print(f"spreads lpt :- {live.to_string(index=False, header=False)}")
-                write_live_spread_to_redis(redis_conn, pairs, live, key="spreads")
+_live_batch = None
 
 def calculate_live_spread():
-    pairs = load_pairs()
-    for pair in pairs['pair']:
-        process_live(pair)
+    global _live_batch
+    if _live_batch is None:
+        _live_batch = LiveSpreadBatch(redis_conn, load_pairs()['pair'])
+    with timed("live_spread"):
+        return _live_batch.tick()
 
 def live_Spreads_loop():
     while True:
         calculate_live_spread()
         time.sleep(1)
 
+def live_spread_engine():
+    pairs = load_pairs()['pair']
+    LiveSpreadEngine(redis_conn, pairs).run()
+
 # ----------------- Main -----------------
 # if __name__ == "__main__":
 #     calculate_historical(loop=False)
@@ -1,51 +1,83 @@
 import numpy as np
 import pandas as pd
-from statsmodels.regression.rolling import RollingOLS
-import statsmodels.api as sm
 import os
 from dotenv import load_dotenv
+from config import RedisConnection
+from healper import read_feather_from_redis
+from spreads.rolling_ols import update_hedge_ratios, rolling_hedge_ratios
 
 load_dotenv()
 LOOKBACK = int(os.getenv('LOOKBACK_DAYS'))
+VERIFY_TOL = float(os.getenv('HEDGE_VERIFY_TOL', '1e-8'))
+redis_conn = RedisConnection.get_instance()
 
-def calculate_hedge_ratios(df, pair):
+def calculate_hedge_ratios(df, pair, from_date=None):
     global LOOKBACK    
     s1, s2 = pair.split('_', 1)
     
     df1, df2 = df[s1], df[s2]
     
-    if len(df1) < LOOKBACK:
-        print(f"Skipping {pair}, not enough data ({len(df1)} < {LOOKBACK})")
-        return pd.Series()
-    
     close1 = df1.set_index('date')['close']
     close2 = df2.set_index('date')['close']
     
     # Align both series
     close1, close2 = close1.align(close2, join='inner')
     
-    # Check aligned length
-    if len(close1) < LOOKBACK:
-        print(f"Skipping {pair}, not enough aligned data ({len(close1)} < {LOOKBACK})")
-        return pd.Series()
-    
-    log1 = np.log(close1)
-    log2 = np.log(close2)
-    
-    log2_with_const = sm.add_constant(log2)
-    
-    log1 = log1.reset_index(drop=True)
-    log2_with_const = log2_with_const.reset_index(drop=True)
-    
-    model = RollingOLS(log1, log2_with_const, window=LOOKBACK)
-    results = model.fit()
+    log1 = np.log(close1.to_numpy(dtype=float))
+    log2 = np.log(close2.to_numpy(dtype=float))
     
-    hedge_ratios = results.params.iloc[:, 1]
+    hedge_ratios = update_hedge_ratios(redis_conn, pair, close1.index, log1, log2, from_date, LOOKBACK)
     
-    hedge_ratios.index = close1.index
+    if hedge_ratios.notna().sum() == 0 and len(close1) < LOOKBACK:
+        print(f"Skipping {pair}, not enough aligned data ({len(close1)} < {LOOKBACK})")
+        return pd.Series()
     
     return hedge_ratios
 
+def rolling_ols_hedge_ratios(log1, log2, window):
+    # Reference implementation, only used to verify the streaming estimator
+    from statsmodels.regression.rolling import RollingOLS
+    import statsmodels.api as sm
+    
+    log2_with_const = sm.add_constant(pd.Series(log2), has_constant='add')
+    model = RollingOLS(pd.Series(log1), log2_with_const, window=window)
+    return model.fit().params.iloc[:, 1].to_numpy()
+
+def verify_hedge_ratios(pair, tol=VERIFY_TOL):
+    """Compare streaming and stored hedge ratios with RollingOLS over the stored history."""
+    s1, s2 = pair.split('_', 1)
+    df1 = read_feather_from_redis(redis_conn, s1, key="historical")
+    df2 = read_feather_from_redis(redis_conn, s2, key="historical")
+    if df1 is None or df2 is None:
+        print(f"Skipping {pair}, no historical data")
+        return None
+    
+    close1, close2 = df1.set_index('date')['close'].align(df2.set_index('date')['close'], join='inner')
+    if len(close1) < LOOKBACK:
+        # RollingOLS raises IndexError below one full window
+        print(f"Skipping {pair}, not enough aligned data ({len(close1)} < {LOOKBACK})")
+        return None
+    log1, log2 = np.log(close1.to_numpy(dtype=float)), np.log(close2.to_numpy(dtype=float))
+    expected = rolling_ols_hedge_ratios(log1, log2, LOOKBACK)
+    _, streamed, _ = rolling_hedge_ratios(log1, log2, LOOKBACK)
+    
+    report = {'pair': pair, 'rows': len(expected),
+              'streaming_max_err': float(np.nanmax(np.abs(streamed - expected), initial=0.0))}
+    
+    spreads = read_feather_from_redis(redis_conn, pair, key="spreads")
+    if spreads is not None and not spreads.empty:
+        stored = spreads.set_index('datetime')['Volume']
+        reference = pd.Series(expected, index=close1.index).reindex(stored.index)
+        report['stored_max_err'] = float(np.nanmax(np.abs(stored.to_numpy() - reference.to_numpy()), initial=0.0))
+    
+    report['ok'] = all(v <= tol for k, v in report.items() if k.endswith('_err'))
+    status = "✅" if report['ok'] else "❌"
+    print(f"{status} {pair}: " + ", ".join(f"{k}={v:.3e}" for k, v in report.items() if k.endswith('_err')))
+    return report
+
+if __name__ == "__main__":
+    for pair in pd.read_csv("pair.csv").dropna(subset=["pair"])['pair']:
+        verify_hedge_ratios(pair)
 
 
 
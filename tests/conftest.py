@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+# Set before any module runs load_dotenv, which never overrides them
+os.environ.setdefault("LOOKBACK_DAYS", "50")
+os.environ.setdefault("hist_intv", "5minute")
+os.environ.setdefault("HISTORY_STORE", "0")
+os.environ.setdefault("ARCHIVE_DB_PATH", os.path.join(tempfile.mkdtemp(), "archive.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis
+import pytest
+import config
+
+# Modules that bind the shared connection at import get this one
+config.RedisConnection._instance = fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def redis_conn():
+    conn = config.RedisConnection.get_instance()
+    conn.flushall()
+    return conn
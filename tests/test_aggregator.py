@@ -0,0 +1,22 @@
+from datetime import datetime, timezone
+import pandas as pd
+from data.aggregator import CandleAggregator, tick_ts_ns, bar_time
+
+TS = 1735700400.25  # 2025-01-01 08:30:00.25 IST
+
+
+def test_tick_ts_ns_agrees_across_feed_formats():
+    naive = datetime(2025, 1, 1, 8, 30, 0, 250000)
+    for value in (TS, naive, pd.Timestamp(naive), datetime.fromtimestamp(TS, timezone.utc),
+                  pd.Timestamp(naive, tz="Asia/Kolkata")):
+        assert tick_ts_ns({'exchange_timestamp': value}) == 1735700400250000000
+    assert tick_ts_ns({}) is None
+
+
+def test_naive_kite_tick_lands_in_its_ist_bar():
+    aggregator = CandleAggregator(interval_minutes=5)
+    aggregator.process_tick("AAA", {'last_price': 1.0, 'exchange_timestamp': datetime(2025, 1, 1, 8, 34, 59)})
+    aggregator.advance(TS + 600)
+    [candle] = aggregator.get_candle("AAA")['data']
+    assert candle['date'] == bar_time(1735700400)
+    assert str(candle['date']) == "2025-01-01 08:30:00+05:30"
@@ -0,0 +1,13 @@
+import numpy as np
+from aqi_write import _fixed6
+
+
+def test_fixed6_matches_python_formatting():
+    rng = np.random.default_rng(0)
+    prices = np.round(rng.uniform(0, 50_000, 20_000) / 0.05) * 0.05
+    # 7th-decimal ties and values that round up into the next integer
+    ties = (rng.integers(0, 10**8, 20_000) * 10 + 5) / 10**8 + rng.integers(0, 3000, 20_000)
+    edges = np.array([0.0, -0.0, 0.9999995, 0.9999994999, 1e-7, -1e-7, 5e-7, -5e-7, 2.5e-6, 123456789.0000005,
+                      -1234.5678905, 1e12 + 0.25, np.nextafter(0.5e-6, 1), np.nextafter(0.5e-6, 0)])
+    values = np.concatenate([prices, -prices, ties, -ties, rng.standard_normal(20_000) * 1e3, edges])
+    assert _fixed6(values).to_pylist() == [f"{x:.6f}" for x in values]
@@ -0,0 +1,49 @@
+import os
+import pandas as pd
+from benchmarks import synthetic
+from disk_store import HistoryStore
+
+
+def test_closed_bars_append_to_month_tail(tmp_path):
+    # 5-minute bars around the clock, crossing from January into February
+    full = synthetic.ohlcv_frame(900, start='2025-01-31 00:00')
+    bulk = HistoryStore(root=str(tmp_path / "bulk"))
+    bulk.write("historical", "AAA", full)
+
+    store = HistoryStore(root=str(tmp_path / "live"), tail_segments=16)
+    month_file = os.path.join(store._dir("historical", "AAA"), "2025-01.arrow")
+    store.write("historical", "AAA", full.iloc[:100])
+    written = os.stat(month_file).st_mtime_ns
+    for i in range(100, 110):
+        store.write("historical", "AAA", full.iloc[[i]])
+    # Closed bars go to the tail; the month file is left alone
+    assert os.stat(month_file).st_mtime_ns == written
+    assert store.state[("historical", "AAA")]["2025-01"][0] == 10
+    pd.testing.assert_frame_equal(store.read_frame("historical", "AAA"), full.iloc[:110].reset_index(drop=True))
+
+    for i in range(110, 800):
+        store.write("historical", "AAA", full.iloc[[i]])
+    # February started, so January was folded in and takes no more appends
+    assert not os.path.exists(store._tail_path("historical", "AAA", "2025-01"))
+    assert store.state[("historical", "AAA")]["2025-02"][0] < 16
+
+    # A late amendment rewrites its month instead of appending
+    amended = full.iloc[[790]].copy()
+    amended['close'] += 1
+    store.write("historical", "AAA", amended)
+    full.loc[790, 'close'] += 1
+    bulk.write("historical", "AAA", amended)
+
+    for i in range(800, 805):
+        store.write("historical", "AAA", full.iloc[[i]])
+
+    # A new process picks up the tail left on disk
+    store = HistoryStore(root=str(tmp_path / "live"), tail_segments=16)
+    store.write("historical", "AAA", full.iloc[[805]])
+    assert store.state[("historical", "AAA")]["2025-02"][0] == 6
+    store.write("historical", "AAA", full.iloc[806:])
+    for start, end in [(None, None), ('2025-01-31 10:00', '2025-02-02 09:00'), ('2025-02-03', None)]:
+        expected = bulk.read_frame("historical", "AAA", start, end)
+        pd.testing.assert_frame_equal(store.read_frame("historical", "AAA", start, end), expected)
+        arrays = store.read_arrays("historical", "AAA", ['close'], start, end)
+        assert (arrays['close'] == expected['close'].to_numpy()).all()
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+import healper
+from benchmarks import synthetic
+from healper import (append_feather_to_redis, compact_feather_in_redis, read_feather_from_redis,
+                     read_range_from_redis, read_meta, read_last_row, tail_key)
+
+RANGES = [
+    (None, '2015-01-01 12:00', 0),
+    ('2015-01-02 10:00', None, 0),
+    ('2015-01-02 10:02', '2015-01-03 14:00', 30),
+    ('2015-01-01 09:15', '2015-01-01 09:20', 5),
+    ('2014-12-01', '2015-01-01', 10),
+]
+
+
+def assert_reads_match(redis_conn, expected):
+    full = read_feather_from_redis(redis_conn, "AAA", "historical")
+    pd.testing.assert_frame_equal(full, expected)
+    dates = expected['date']
+    for start, end, lookback in RANGES:
+        keep = pd.Series(True, index=expected.index)
+        if end is not None:
+            keep &= dates < pd.Timestamp(end, tz='Asia/Kolkata')
+        before = expected[keep & (dates < pd.Timestamp(start, tz='Asia/Kolkata'))] if start else expected.iloc[:0]
+        after = expected[keep & (dates >= pd.Timestamp(start, tz='Asia/Kolkata'))] if start else expected[keep]
+        want = pd.concat([before.tail(lookback), after]).reset_index(drop=True)
+        got = read_range_from_redis(redis_conn, "AAA", "historical", start=start, end=end, lookback=lookback)
+        pd.testing.assert_frame_equal(got, want)
+
+    meta = read_meta(redis_conn, "AAA", "historical")
+    assert meta['rows'] == len(expected)
+    assert meta['first_ts'] == dates.iloc[0] and meta['last_ts'] == dates.iloc[-1]
+    pd.testing.assert_series_equal(read_last_row(redis_conn, "AAA", "historical"), expected.iloc[-1], check_names=False)
+
+
+@pytest.mark.parametrize("codec", ["uncompressed", "lz4"])
+def test_append_compact_and_range_reads(redis_conn, monkeypatch, codec):
+    # Small index chunks so range reads pick a few batches out of many
+    monkeypatch.setattr(healper, "INDEX_CHUNK_ROWS", 64)
+    monkeypatch.setitem(healper.FEATHER_CODECS, "historical", codec)
+    full = synthetic.ohlcv_frame(1000)
+    # Naive dates are IST wall clock, like the bars from Kite
+    naive = full.iloc[:400].assign(date=full['date'].iloc[:400].dt.tz_localize(None))
+    append_feather_to_redis(redis_conn, "AAA", naive, "historical")
+    compact_feather_in_redis(redis_conn, "AAA", "historical")
+
+    for start in range(400, 700, 50):
+        append_feather_to_redis(redis_conn, "AAA", full.iloc[start:start + 50], "historical")
+    # A late amendment of a bar already in the base, and a re-sent last bar
+    amended = full.iloc[[120]].assign(close=1.0)
+    append_feather_to_redis(redis_conn, "AAA", amended, "historical")
+    append_feather_to_redis(redis_conn, "AAA", full.iloc[699:760], "historical")
+    expected = full.iloc[:760].copy()
+    expected.loc[120, 'close'] = 1.0
+    assert redis_conn.llen(tail_key("historical", "AAA")) == 8
+    assert_reads_match(redis_conn, expected)
+
+    compact_feather_in_redis(redis_conn, "AAA", "historical")
+    assert redis_conn.llen(tail_key("historical", "AAA")) == 0
+    assert_reads_match(redis_conn, expected)
+
+    append_feather_to_redis(redis_conn, "AAA", full.iloc[760:], "historical")
+    assert_reads_match(redis_conn, full.assign(close=expected['close'].reindex(full.index).fillna(full['close'])))
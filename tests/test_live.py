@@ -0,0 +1,43 @@
+import json
+import numpy as np
+from benchmarks import synthetic
+from healper import write_feather_to_redis
+from spreads.live import LiveSpreadBatch, LIVE_SPREADS_KEY, read_live_bars
+
+PAIRS = ["SYM000_SYM001", "SYM002_SYM003"]
+
+
+def _seed(redis_conn):
+    for pair in PAIRS:
+        write_feather_to_redis(redis_conn, pair, synthetic.spread_frame(3, pair=pair), key="spreads", live=False, spreads=True)
+    redis_conn.mset({f"ltp:SYM00{i}": 100.0 + i for i in range(4)})
+
+
+def test_batch_writes_only_pairs_whose_legs_moved(redis_conn):
+    _seed(redis_conn)
+    batch = LiveSpreadBatch(redis_conn, PAIRS)
+    assert batch.tick() == 2
+    assert batch.tick() == 0
+    redis_conn.set("ltp:SYM002", 110.0)
+    redis_conn.delete(LIVE_SPREADS_KEY)
+    assert batch.tick() == 1
+    [(pair, bar)] = read_live_bars(redis_conn, PAIRS).items()
+    assert pair == "SYM002_SYM003"
+    p = batch.index[pair]
+    # Arrow's text parses back to the exact doubles held in memory
+    assert bar['close'] == batch.close[p] == np.log(110.0) - batch.hr[p] * np.log(103.0)
+    assert bar['hedge_ratio'] == batch.hr[p]
+
+
+def test_restart_mid_bar_keeps_the_range(redis_conn):
+    _seed(redis_conn)
+    first = LiveSpreadBatch(redis_conn, PAIRS)
+    redis_conn.set("ltp:SYM000", 1e6)
+    first.tick()
+    high = json.loads(redis_conn.hget(LIVE_SPREADS_KEY, PAIRS[0]))['high']
+
+    redis_conn.set("ltp:SYM000", 100.0)
+    restarted = LiveSpreadBatch(redis_conn, PAIRS)
+    restarted.tick()
+    assert restarted.high[0] == high
+    assert json.loads(redis_conn.hget(LIVE_SPREADS_KEY, PAIRS[0]))['high'] == high
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import rollup
+from benchmarks import synthetic
+from data.aggregator import IST
+from healper import append_feather_to_redis, live_feather_to_redis, read_feather_from_redis, read_meta, compact_feather_in_redis
+from rollup import update_rollups, rollup_frame, rollup_key, TIMEFRAMES
+
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    calls = []
+    rebuild = rollup._rebuild
+    monkeypatch.setattr(rollup, "_rebuild", lambda *a: calls.append(a[4]) or rebuild(*a))
+    return calls
+
+
+def assert_rolled_up(redis_conn, symbol, key):
+    """Every timeframe, and its sidecar, equals a rollup of the whole base."""
+    base = read_feather_from_redis(redis_conn, symbol, key)
+    for tf in TIMEFRAMES:
+        expected = rollup_frame(base, tf)
+        stored = read_feather_from_redis(redis_conn, symbol, rollup_key(key, tf))
+        pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+        meta = read_meta(redis_conn, symbol, rollup_key(key, tf))
+        assert meta['rows'] == len(expected)
+        assert pd.Timestamp(meta['last_ts']) == expected.iloc[-1, 0]
+
+
+def test_live_closes_fold_like_a_full_rebuild(redis_conn, rebuilds):
+    bars = synthetic.ohlcv_frame(1250)
+    seed = bars.iloc[:1000]
+    append_feather_to_redis(redis_conn, "S", seed, "historical")
+    update_rollups(redis_conn, "S", "historical", seed)
+    assert len(rebuilds) == 1
+
+    for i in range(1000, 1250):
+        # Live candles carry datetime dates with a fixed +05:30 offset
+        candle = dict(bars.iloc[i].to_dict(), date=bars['date'].iloc[i].to_pydatetime().astimezone(IST))
+        live_feather_to_redis(redis_conn, "S", {'data': [candle]}, "historical", live=True, spreads=False)
+        update_rollups(redis_conn, "S", "historical", [candle])
+        if i % 100 == 0:
+            compact_feather_in_redis(redis_conn, "S", rollup_key("historical", TIMEFRAMES[0]))
+            assert_rolled_up(redis_conn, "S", "historical")
+    assert len(rebuilds) == 1
+    assert_rolled_up(redis_conn, "S", "historical")
+
+
+def test_revisions_and_resaves(redis_conn, rebuilds):
+    bars = synthetic.ohlcv_frame(600)
+    append_feather_to_redis(redis_conn, "S", bars.iloc[:500], "historical")
+    update_rollups(redis_conn, "S", "historical", bars.iloc[:500])
+
+    # The last bar saved again unchanged, with new bars after it, is folded
+    rows = bars.iloc[499:520]
+    append_feather_to_redis(redis_conn, "S", rows, "historical")
+    update_rollups(redis_conn, "S", "historical", rows)
+    assert len(rebuilds) == 1
+    assert_rolled_up(redis_conn, "S", "historical")
+
+    # A late amendment to an older bar rebuilds from its bucket
+    late = bars.iloc[[505]].copy()
+    late['high'] += 50
+    append_feather_to_redis(redis_conn, "S", late, "historical")
+    update_rollups(redis_conn, "S", "historical", late)
+    assert len(rebuilds) == 2
+    assert_rolled_up(redis_conn, "S", "historical")
+
+    # Base rows that no call rolled up are caught by the row count
+    append_feather_to_redis(redis_conn, "S", bars.iloc[520:530], "historical")
+    rows = bars.iloc[530:531]
+    append_feather_to_redis(redis_conn, "S", rows, "historical")
+    update_rollups(redis_conn, "S", "historical", rows)
+    assert len(rebuilds) == 3
+    assert_rolled_up(redis_conn, "S", "historical")
+
+
+def test_spreads_resaving_their_last_bar_fold(redis_conn, rebuilds):
+    spreads = synthetic.spread_frame(300, pair="A_B")
+    append_feather_to_redis(redis_conn, "A_B", spreads.iloc[:200], "spreads")
+    update_rollups(redis_conn, "A_B", "spreads", spreads.iloc[:200])
+    for i in range(200, 300):
+        # calculate_historical saves from its last stored bar, inclusive
+        rows = spreads.iloc[i - 1:i + 1]
+        append_feather_to_redis(redis_conn, "A_B", rows, "spreads")
+        update_rollups(redis_conn, "A_B", "spreads", rows)
+    assert len(rebuilds) == 1
+    assert_rolled_up(redis_conn, "A_B", "spreads")
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks import synthetic
+from healper import write_feather_to_redis, read_feather_from_redis
+from spreads import spreads
+from spreads import rolling_ols
+from spreads.rolling_ols import RollingHedge, state_key, rolling_hedge_ratios, update_hedge_ratios
+from spreads.spreads_resepy import rolling_ols_hedge_ratios
+
+PAIRS = ["SYM000_SYM001", "SYM001_SYM002"]
+
+
+@pytest.fixture
+def universe(redis_conn, monkeypatch):
+    monkeypatch.setattr(spreads, "load_pairs", lambda: pd.DataFrame({'pair': PAIRS}))
+    return synthetic.symbol_frames(synthetic.symbol_names(3), 200)
+
+
+def test_panel_engine_advances_streaming_state(redis_conn, universe, monkeypatch):
+    window = spreads.LOOKBACK_DAYS
+    for sym, df in universe.items():
+        write_feather_to_redis(redis_conn, sym, df.iloc[:120], key="historical", live=False, spreads=True)
+    spreads.calculate_historical_panel(loop=False)
+
+    cold = []
+    solve = spreads.panel_cold_spreads
+    monkeypatch.setattr(spreads, "panel_cold_spreads", lambda f, p, d: cold.append(p) or solve(f, p, d))
+    for start in range(120, 200, 20):
+        for sym, df in universe.items():
+            write_feather_to_redis(redis_conn, sym, df.iloc[start:start + 20], key="historical", live=False, spreads=True)
+        spreads.calculate_historical_panel(loop=False)
+    # Every later run advanced the stored state instead of solving the panel again
+    assert cold == []
+
+    for pair in PAIRS:
+        s1, s2 = pair.split('_')
+        log1, log2 = np.log(universe[s1]['close'].iloc[:200]), np.log(universe[s2]['close'].iloc[:200])
+        expected = rolling_ols_hedge_ratios(log1.to_numpy(), log2.to_numpy(), window)[window - 1:]
+        stored = read_feather_from_redis(redis_conn, pair, key="spreads")
+        assert len(stored) == len(expected)
+        assert np.allclose(stored['Volume'], expected, rtol=0, atol=1e-8)
+        est = RollingHedge.from_state(redis_conn.hgetall(state_key(pair)), window)
+        assert est.last == pd.Timestamp(stored['datetime'].iloc[-1]).value
+
+
+def test_streaming_hedge_matches_rolling_ols(redis_conn, monkeypatch):
+    window = 50
+    closes = synthetic.price_paths(["A", "B"], 1500, seed=3)
+    log1, log2 = np.log(closes["A"]), np.log(closes["B"])
+    expected = rolling_ols_hedge_ratios(log1, log2, window)
+    # Long enough for the running sums to be resynced many times
+    _, streamed, _ = rolling_hedge_ratios(log1, log2, window)
+    # RollingOLS itself drifts by a few 1e-8 on low-variance windows
+    assert np.allclose(streamed[window - 1:], expected[window - 1:], rtol=1e-6, atol=1e-8)
+
+    # Naive bar dates are IST wall clock, as everywhere else in the store
+    dates = pd.date_range("2025-01-01 09:15", periods=1500, freq="5min")
+    cold = update_hedge_ratios(redis_conn, "A_B", dates[:1000], log1[:1000], log2[:1000], None, window)
+    full = []
+    monkeypatch.setattr(rolling_ols, "rolling_hedge_ratios", lambda *a: full.append(a))
+    from_date = dates[999].tz_localize("Asia/Kolkata")
+    warm = update_hedge_ratios(redis_conn, "A_B", dates[999:], log1[999:], log2[999:], from_date, window)
+    assert full == []
+    assert np.allclose(cold.to_numpy()[window - 1:], expected[window - 1:1000], rtol=1e-6, atol=1e-8)
+    assert np.allclose(warm.to_numpy(), expected[999:], rtol=1e-6, atol=1e-8)
@@ -0,0 +1,47 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from data.aggregator import CandleAggregator
+from data.tick_recorder import TickRecorder, rebuild_day, ticks_to_bars, read_ticks, _local_day
+from healper import live_feather_to_redis, read_feather_from_redis
+
+START = 1735700400  # 2025-01-01 08:30 IST
+
+
+@pytest.fixture(params=["UTC", "America/New_York", "Asia/Kolkata"])
+def host_tz(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_rebuilt_bars_replace_live_bars(redis_conn, tmp_path, host_tz):
+    rng = np.random.default_rng(0)
+    ts = START + np.sort(rng.uniform(0, 1800, 600))
+    prices = 100 + rng.standard_normal(600).cumsum()
+    recorder = TickRecorder(root=str(tmp_path))
+    aggregator = CandleAggregator(interval_minutes=5)
+    for i, (t, p) in enumerate(zip(ts, prices)):
+        recorder.record("AAA", p, 1.0, int(t * 1e9))
+        # The live feed died after 400 ticks, cutting its last bar short
+        if i < 400:
+            aggregator.process_tick("AAA", {'last_price': p, 'last_traded_quantity': 1.0, 'exchange_timestamp': float(t)})
+    recorder.stop()
+    aggregator.advance(ts[-1] + 600)
+    live = aggregator.get_candle("AAA")
+    live_feather_to_redis(redis_conn, "AAA", live, key="historical", live=True, spreads=False)
+
+    day = _local_day(int(ts[0] * 1e9))
+    assert rebuild_day(day, 5, ["AAA"], redis_conn, root=str(tmp_path)) == {"AAA": 6}
+
+    expected = ticks_to_bars(read_ticks("AAA", day, str(tmp_path)), 5)
+    stored = read_feather_from_redis(redis_conn, "AAA", key="historical")
+    assert len(stored) == 6
+    # Every live bar was overwritten in place, none left beside a shifted copy
+    assert set(pd.DatetimeIndex([c['date'] for c in live['data']])) <= set(stored['date'])
+    assert (stored['date'] == pd.Series(expected['date'])).all()
+    assert np.allclose(stored[['open', 'high', 'low', 'close']], expected[['open', 'high', 'low', 'close']])
+    assert stored['date'].iloc[0] == pd.Timestamp("2025-01-01 08:30", tz="Asia/Kolkata")